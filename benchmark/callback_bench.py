@@ -0,0 +1,122 @@
+"""Micro-benchmark of the C callbacks created from python callables.
+
+A C++ program passes a `std::function` to a C style visitor through `FnPointerWrapper`, like the generated bindings
+do for a python callback, the visitor invokes the callback `--calls` times, from 1 thread and from `--threads`
+threads. The callback does nothing, so only the cost of the runtime header is measured.
+
+Usage:
+    python benchmark/callback_bench.py --calls 2000000
+    python benchmark/callback_bench.py --include /path/to/other/include  # compare with another runtime header
+"""
+import argparse
+import os
+import subprocess
+import sysconfig
+import tempfile
+
+import pybind11
+
+_REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+_CALL_SITE = """pybind11_weaver::FnPointerWrapper<int, int, int>::GetCptr<int, int, void *>::Run(
+      callback, pybind11_weaver::Guardian(),
+      [](const std::function<int(int, int)> &to_call, int arg0, void *arg1) {
+        return to_call(arg0, static_cast<int>(reinterpret_cast<intptr_t>(arg1)));
+      })"""
+
+# call site generated with the header before the slot table
+_LEGACY_CALL_SITE = """pybind11_weaver::FnPointerWrapper<int, int, int>::GetCptr<int, int, void *>::Run(
+      callback, pybind11_weaver::Guardian(),
+      [](int arg0, void *arg1) {
+        auto to_call = pybind11_weaver::FnPointerWrapper<int, int, int>::GetFnProxy(__DATE__ __TIME__ __FILE__, __COUNTER__);
+        return to_call(arg0, static_cast<int>(reinterpret_cast<intptr_t>(arg1)));
+      },
+      __DATE__ __TIME__ __FILE__, __COUNTER__ - 1)"""
+
+_MAIN_TEMPLATE = """
+#include <chrono>
+#include <cstdio>
+#include <thread>
+#include <vector>
+#include <pybind11_weaver/pybind11_weaver.h>
+
+namespace {{
+long Visit(long calls, int threads, int (*visitor)(int, void *)) {{
+  std::vector<long> sums(threads);
+  std::vector<std::thread> workers;
+  for (int t = 0; t < threads; ++t) {{
+    workers.emplace_back([&sums, t, threads, calls, visitor]() {{
+      for (long i = t; i < calls; i += threads) {{
+        sums[t] += visitor(static_cast<int>(i), reinterpret_cast<void *>(1));
+      }}
+    }});
+  }}
+  long sum = 0;
+  for (int t = 0; t < threads; ++t) {{
+    workers[t].join();
+    sum += sums[t];
+  }}
+  return sum;
+}}
+
+long VisitWith(std::function<int(int, int)> callback, long calls, int threads) {{
+  return Visit(calls, threads, {call_site});
+}}
+
+double BestNanosecondsPerCall(long calls, int threads, int repeat) {{
+  std::function<int(int, int)> callback = [](int x, int y) {{ return (x & 1) + y; }};
+  double best = 1e30;
+  for (int r = 0; r < repeat; ++r) {{
+    auto beg = std::chrono::steady_clock::now();
+    if (VisitWith(callback, calls, threads) < calls) {{
+      return -1;
+    }}
+    auto end = std::chrono::steady_clock::now();
+    best = std::min(best, std::chrono::duration<double, std::nano>(end - beg).count() / calls);
+  }}
+  return best;
+}}
+}} // namespace
+
+int main() {{
+  std::printf("1_thread_ns_per_call %.2f\\n", BestNanosecondsPerCall({calls}, 1, {repeat}));
+  std::printf("{threads}_threads_ns_per_call %.2f\\n", BestNanosecondsPerCall({calls}, {threads}, {repeat}));
+  return 0;
+}}
+"""
+
+
+def gen_source(calls: int, threads: int, repeat: int, legacy: bool) -> str:
+    return _MAIN_TEMPLATE.format(call_site=_LEGACY_CALL_SITE if legacy else _CALL_SITE, calls=calls,
+                                 threads=threads, repeat=repeat)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=2000000)
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 4)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--cxx", type=str, default=os.environ.get("CXX", "c++"))
+    parser.add_argument("--include", type=str, default=os.path.join(_REPO_ROOT, "pybind11_weaver", "include"),
+                        help="Include directory of the runtime header to benchmark.")
+    args = parser.parse_args()
+
+    with open(os.path.join(args.include, "pybind11_weaver", "pybind11_weaver.h")) as f:
+        legacy = "GetFnProxy" in f.read()
+    with tempfile.TemporaryDirectory(prefix="pybind11_weaver_callback_") as work_dir:
+        src = os.path.join(work_dir, "bench.cc")
+        with open(src, "w") as f:
+            f.write(gen_source(args.calls, args.threads, args.repeat, legacy))
+        exe = os.path.join(work_dir, "bench")
+        python_lib = sysconfig.get_config_var("LIBDIR")
+        python_ld = f"python{sysconfig.get_config_var('LDVERSION')}"
+        subprocess.run([args.cxx, "-std=c++17", "-O2", "-pthread", f"-I{args.include}",
+                        f"-I{pybind11.get_include()}", f"-I{sysconfig.get_paths()['include']}", src, "-o", exe,
+                        f"-L{python_lib}", f"-Wl,-rpath,{python_lib}", f"-l{python_ld}"], check=True)
+        # no python api is called, so the interpreter is not initialized
+        print(f"calls {args.calls}, threads {args.threads}")
+        print(subprocess.run([exe], check=True, capture_output=True, text=True).stdout, end="")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""Compare the compile time and extension size of the bindings generated by default and compact codegen.
+
+Bindings of `sample/all_feature` and of synthetic headers are generated in both modes, then compiled into a
+python extension with a minimal module source that calls `DeclFn`, so no customization is involved.
+
+Usage:
+    python benchmark/compile_bench.py --targets all_feature small --repeat 3 --json out.json
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import sysconfig
+import tempfile
+import time
+from typing import Dict, List
+
+import pybind11
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from synthetic import SyntheticSpec, gen_header
+
+_REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+_SAMPLE_DIR = os.path.join(_REPO_ROOT, "sample", "all_feature")
+
+# Limited to what compiles yet: function pointer parameters are not bindable, and the generated names of numbered
+# symbols may collide (e.g. the 2nd overload of `method1` and `method11`), so they scale by overloads instead.
+SPECS = {
+    "small": SyntheticSpec(namespaces=1, classes=10, methods=8, overloads=2, templates=8, hierarchy_depth=4,
+                           callbacks=0),
+    "large": SyntheticSpec(namespaces=1, classes=10, methods=10, overloads=6, templates=10, hierarchy_depth=6,
+                           callbacks=0),
+}
+
+_MODULE_SRC = """
+#include "binding.cc.inc"
+
+PYBIND11_MODULE(bench_ext, m) {
+  pybind11_weaver::CustomBindingRegistry reg;
+  auto update_guard = DeclFn(m, reg);
+}
+"""
+
+
+def _write_config(target: str, work_dir: str, compact: bool) -> str:
+    if target == "all_feature":
+        include_dir = _SAMPLE_DIR
+        inputs = '"c_lib/c_lib.h","template_pb11_weaver_helper.h"'
+    else:
+        include_dir = work_dir
+        with open(os.path.join(work_dir, "bench.h"), "w") as f:
+            f.write(gen_header(SPECS[target]))
+        inputs = '"bench.h"'
+    cfg = os.path.join(work_dir, "cfg.yaml")
+    with open(cfg, "w") as f:
+        f.write(f"""
+common_config:
+  cxx_flags: [ "-std=c++17", ]
+  include_directories: [ "{include_dir}" ]
+io_configs:
+  - inputs: [ {inputs} ]
+    output: "{work_dir}/binding.cc.inc"
+    compact_codegen: {"true" if compact else "false"}
+""")
+    return include_dir
+
+
+def run_once(target: str, compact: bool, cxx: str, opt: str) -> Dict:
+    with tempfile.TemporaryDirectory(prefix="pybind11_weaver_compile_") as work_dir:
+        include_dir = _write_config(target, work_dir, compact)
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join([_REPO_ROOT, os.environ.get("PYTHONPATH", "")]))
+        subprocess.run([sys.executable, "-m", "pybind11_weaver.main", "--config", os.path.join(work_dir, "cfg.yaml")],
+                       check=True, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        src = os.path.join(work_dir, "module.cc")
+        with open(src, "w") as f:
+            f.write(_MODULE_SRC)
+        ext = os.path.join(work_dir, "bench_ext" + sysconfig.get_config_var("EXT_SUFFIX"))
+        # only compile, the symbols of the sample library are left undefined
+        cmd = [cxx, "-std=c++17", opt, "-fPIC", "-shared", "-fvisibility=hidden", f"-I{work_dir}", f"-I{include_dir}",
+               f"-I{pybind11.get_include()}", f"-I{sysconfig.get_paths()['include']}",
+               f"-I{os.path.join(_REPO_ROOT, 'pybind11_weaver', 'include')}", src, "-o", ext]
+        beg = time.perf_counter()
+        beg_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        end_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        seconds = time.perf_counter() - beg
+        if result.returncode != 0:
+            sys.stderr.write(result.stderr)
+            raise RuntimeError(f"Failed to compile the bindings of {target}")
+        # cpu time of the compiler is less noisy than the wall time
+        cpu_seconds = (end_usage.ru_utime + end_usage.ru_stime) - (beg_usage.ru_utime + beg_usage.ru_stime)
+        stripped = ext + ".stripped"
+        subprocess.run(["strip", "-o", stripped, ext], check=True)
+        return {
+            "compile_seconds": seconds,
+            "compile_cpu_seconds": cpu_seconds,
+            "ext_bytes": os.path.getsize(ext),
+            "stripped_ext_bytes": os.path.getsize(stripped),
+            "inc_bytes": os.path.getsize(os.path.join(work_dir, "binding.cc.inc")),
+        }
+
+
+def run_target(target: str, repeat: int, cxx: str, opt: str) -> List[Dict]:
+    runs = {False: [], True: []}
+    for _ in range(repeat):
+        # modes are interleaved, so a drift of the machine affects both of them
+        for compact in [False, True]:
+            runs[compact].append(run_once(target, compact, cxx, opt))
+    results = []
+    for compact in [False, True]:
+        result = {"target": target, "mode": "compact" if compact else "default"}
+        for key in runs[compact][0]:
+            result[key] = statistics.median(run[key] for run in runs[compact])
+        results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--targets", nargs="+", default=["all_feature", "small"],
+                        choices=["all_feature"] + list(SPECS.keys()))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--cxx", type=str, default=os.environ.get("CXX", "c++"))
+    parser.add_argument("--opt", type=str, default="-O2")
+    parser.add_argument("--json", type=str, default="", help="Write results as json.")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'target':>12} {'mode':>8} {'compile(s)':>10} {'cpu(s)':>8} {'ext(KB)':>8} {'stripped(KB)':>12} {'inc(KB)':>8}")
+    for target in args.targets:
+        for r in run_target(target, args.repeat, args.cxx, args.opt):
+            results.append(r)
+            print(f"{target:>12} {r['mode']:>8} {r['compile_seconds']:>10.2f} {r['compile_cpu_seconds']:>8.2f} {r['ext_bytes'] / 1024:>8.1f} "
+                  f"{r['stripped_ext_bytes'] / 1024:>12.1f} {r['inc_bytes'] / 1024:>8.1f}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"cxx": args.cxx, "opt": args.opt, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
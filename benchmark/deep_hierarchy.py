@@ -0,0 +1,77 @@
+"""Benchmark trampoline generation on a synthetic deep class hierarchy.
+
+A chain of `depth` classes, each declares `methods` virtual methods and overrides one method of its base, and
+`leaves` classes derive from the deepest one. Every class gets a trampoline, the time of generating all of them
+should grow linearly with the number of leaves.
+
+Usage:
+    python benchmark/deep_hierarchy.py --depth 10 --methods 8 --leaves 50 100 200 400
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from pybind11_weaver import entity_tree, gen_unit
+from pybind11_weaver.entity.klass import klass, trampoline
+from pybind11_weaver.utils import class_traits
+
+
+def gen_header(depth: int, methods: int, leaves: int) -> str:
+    lines = ["namespace bench {"]
+    for level in range(depth):
+        base = f" : public Level{level - 1}" if level > 0 else ""
+        lines.append(f"struct Level{level}{base} {{")
+        lines.append("    virtual ~Level{0}() = default;".format(level))
+        lines.append("    virtual int shared(int v);")
+        for m in range(methods):
+            lines.append(f"    virtual int level{level}_method{m}(int v, double w);")
+        lines.append("};")
+    for leaf in range(leaves):
+        lines.append(f"struct Leaf{leaf} : public Level{depth - 1} {{ int shared(int v) override; }};")
+    lines.append("}")
+    return "\n".join(lines)
+
+
+def run_once(depth: int, methods: int, leaves: int, use_cache: bool) -> float:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with open(os.path.join(tmp_dir, "bench.h"), "w") as f:
+            f.write(gen_header(depth, methods, leaves))
+        gu = gen_unit.load_all_gu(f"""
+common_config:
+    include_directories: ["{tmp_dir}"]
+io_configs:
+    - inputs: ["bench.h"]
+      output: "{tmp_dir}/out.inc"
+""")[0]
+        classes = [e for e in entity_tree.EntityTree(gu)["bench"].children.values() if
+                   isinstance(e, klass.ClassEntity)]
+        class_traits.clear()
+        trampoline.clear_cache()
+        beg = time.perf_counter()
+        for entity in classes:
+            if not use_cache:
+                trampoline.clear_cache()
+            trampoline.Trampoline(entity).get_defs()
+        return time.perf_counter() - beg
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--depth", type=int, default=10)
+    parser.add_argument("--methods", type=int, default=8)
+    parser.add_argument("--leaves", type=int, nargs="+", default=[50, 100, 200, 400])
+    args = parser.parse_args()
+    print(f"{'leaves':>8} {'cached(s)':>10} {'us/class':>9} {'uncached(s)':>12} {'us/class':>9}")
+    for leaves in args.leaves:
+        n_cls = args.depth + leaves
+        cached = run_once(args.depth, args.methods, leaves, True)
+        uncached = run_once(args.depth, args.methods, leaves, False)
+        print(f"{leaves:>8} {cached:>10.3f} {cached / n_cls * 1e6:>9.0f} {uncached:>12.3f} {uncached / n_cls * 1e6:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Compare the import time of the bindings generated with and without lazy namespaces.
+
+Bindings of a synthetic header are generated in both modes and compiled into python extensions, then every extension
+is imported in fresh processes, to measure the time of the import, of the import and the first access of one
+namespace, and of the import and the access of all namespaces.
+
+Usage:
+    python benchmark/import_bench.py --namespaces 16 --repeat 10 --json out.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import sysconfig
+import tempfile
+from typing import Dict, List
+
+import pybind11
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from synthetic import SyntheticSpec, gen_header
+
+_REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+_MODULE_SRC = """
+#include "binding.cc.inc"
+
+PYBIND11_MODULE(bench_ext, m) {
+  pybind11_weaver::CustomBindingRegistry reg;
+  auto update_guard = DeclFn(m, reg);
+}
+"""
+
+_MEASURE_SRC = """
+import sys
+import time
+sys.path.insert(0, sys.argv[1])
+beg = time.perf_counter()
+import bench_ext
+imported = time.perf_counter()
+bench_ext.ns0.Class0
+one = time.perf_counter()
+for i in range(int(sys.argv[2])):
+    dir(getattr(bench_ext, f"ns{i}"))
+print(imported - beg, one - beg, time.perf_counter() - beg)
+"""
+
+
+def build(spec: SyntheticSpec, lazy: bool, work_dir: str, cxx: str, opt: str):
+    with open(os.path.join(work_dir, "bench.h"), "w") as f:
+        f.write(gen_header(spec, with_bodies=True))
+    cfg = os.path.join(work_dir, "cfg.yaml")
+    with open(cfg, "w") as f:
+        f.write(f"""
+common_config:
+  cxx_flags: [ "-std=c++17", ]
+  include_directories: [ "{work_dir}" ]
+io_configs:
+  - inputs: [ "bench.h" ]
+    output: "{work_dir}/binding.cc.inc"
+    lazy_namespaces: {"true" if lazy else "false"}
+""")
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([_REPO_ROOT, os.environ.get("PYTHONPATH", "")]))
+    subprocess.run([sys.executable, "-m", "pybind11_weaver.main", "--config", cfg],
+                   check=True, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    src = os.path.join(work_dir, "module.cc")
+    with open(src, "w") as f:
+        f.write(_MODULE_SRC)
+    ext = os.path.join(work_dir, "bench_ext" + sysconfig.get_config_var("EXT_SUFFIX"))
+    cmd = [cxx, "-std=c++17", opt, "-fPIC", "-shared", "-fvisibility=hidden", f"-I{work_dir}",
+           f"-I{pybind11.get_include()}", f"-I{sysconfig.get_paths()['include']}",
+           f"-I{os.path.join(_REPO_ROOT, 'pybind11_weaver', 'include')}", src, "-o", ext]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        sys.stderr.write(result.stderr)
+        raise RuntimeError("Failed to compile the bindings")
+
+
+def measure(work_dir: str, namespaces: int, repeat: int) -> Dict:
+    runs = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", _MEASURE_SRC, work_dir, str(namespaces)], check=True,
+                             capture_output=True, text=True).stdout
+        runs.append([float(v) for v in out.split()])
+    keys = ["import_ms", "first_namespace_ms", "all_namespaces_ms"]
+    return {key: statistics.median(run[i] for run in runs) * 1000 for i, key in enumerate(keys)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--namespaces", type=int, default=16)
+    parser.add_argument("--classes", type=int, default=8, help="Number of classes in each namespace.")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--cxx", type=str, default=os.environ.get("CXX", "c++"))
+    parser.add_argument("--opt", type=str, default="-O1")
+    parser.add_argument("--json", type=str, default="", help="Write results as json.")
+    args = parser.parse_args()
+
+    # no virtual methods, their trampolines of different namespaces may share names yet
+    spec = SyntheticSpec(namespaces=args.namespaces, classes=args.classes, methods=4, overloads=1, templates=2,
+                         hierarchy_depth=0, callbacks=0)
+    results: List[Dict] = []
+    print(f"{'mode':>8} {'import(ms)':>10} {'+1 ns(ms)':>10} {'+all ns(ms)':>11}")
+    for lazy in [False, True]:
+        with tempfile.TemporaryDirectory(prefix="pybind11_weaver_import_") as work_dir:
+            build(spec, lazy, work_dir, args.cxx, args.opt)
+            r = {"mode": "lazy" if lazy else "eager", **measure(work_dir, args.namespaces, args.repeat)}
+        results.append(r)
+        print(f"{r['mode']:>8} {r['import_ms']:>10.2f} {r['first_namespace_ms']:>10.2f} {r['all_namespaces_ms']:>11.2f}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"cxx": args.cxx, "opt": args.opt, "namespaces": args.namespaces, "classes": args.classes,
+                       "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Micro-benchmark of the entity creation done by `DeclFn` at module import.
+
+A C++ program with `--entities` trivial entities is generated, it creates and updates all of them like the generated
+`DeclFn` does, with an empty registry and with a registry of `--custom` custom bindings. Entities bind nothing, so
+only the cost of the runtime header is measured.
+
+Usage:
+    python benchmark/registry_bench.py --entities 2000
+    python benchmark/registry_bench.py --include /path/to/other/include  # compare with another runtime header
+"""
+import argparse
+import os
+import subprocess
+import sysconfig
+import tempfile
+
+import pybind11
+
+_REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+_ENTITY_TEMPLATE = """
+struct Entity{i} : public pybind11_weaver::EntityBase {{
+  explicit Entity{i}(pybind11_weaver::EntityScope) {{}}
+  void Update() override {{ ++updated; }}
+  pybind11_weaver::EntityScope AsScope() override {{ return pybind11_weaver::EntityScope(m); }}
+  static constexpr const char *Key() {{ return "bench_ns_Entity{i}"; }}
+}};
+"""
+
+_MAIN_TEMPLATE = """
+#include <chrono>
+#include <cstdio>
+#include <pybind11_weaver/pybind11_weaver.h>
+
+namespace {{
+pybind11::module_ m;
+long updated = 0;
+{entities}
+
+pybind11_weaver::CallUpdateGuard DeclFn(const pybind11_weaver::CustomBindingRegistry &registry) {{
+  pybind11_weaver::EntityTable entities({entity_num});
+{create_stmts}
+  auto update_fn = [entities = std::move(entities)]() {{
+    for (auto &entity : entities) {{
+      entity->Update();
+    }}
+  }};
+  return {{std::move(update_fn)}};
+}}
+
+double BestMicroseconds(const pybind11_weaver::CustomBindingRegistry &registry, int repeat) {{
+  double best = 1e30;
+  for (int r = 0; r < repeat; ++r) {{
+    auto beg = std::chrono::steady_clock::now();
+    {{
+      auto guard = DeclFn(registry);
+    }}
+    auto end = std::chrono::steady_clock::now();
+    best = std::min(best, std::chrono::duration<double, std::micro>(end - beg).count());
+  }}
+  return best;
+}}
+}} // namespace
+
+int main() {{
+  pybind11_weaver::CustomBindingRegistry empty;
+  pybind11_weaver::CustomBindingRegistry custom;
+{custom_stmts}
+  std::printf("empty_registry_us %.1f\\n", BestMicroseconds(empty, {repeat}));
+  std::printf("custom_registry_us %.1f\\n", BestMicroseconds(custom, {repeat}));
+  return updated == 0;
+}}
+"""
+
+
+def gen_source(entity_num: int, custom_num: int, repeat: int) -> str:
+    entities = "".join(_ENTITY_TEMPLATE.format(i=i) for i in range(entity_num))
+    create_stmts = "\n".join(
+        f"  entities[{i}] = pybind11_weaver::CreateEntity<Entity{i}>(pybind11_weaver::EntityScope(m), registry);"
+        for i in range(entity_num))
+    # spread the custom bindings over the entities
+    step = max(entity_num // max(custom_num, 1), 1)
+    custom_stmts = "\n".join(f"  custom.SetCustomBinding<Entity{i}>();" for i in range(0, entity_num, step)[:custom_num])
+    return _MAIN_TEMPLATE.format(entities=entities, entity_num=entity_num, create_stmts=create_stmts,
+                                 custom_stmts=custom_stmts, repeat=repeat)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entities", type=int, default=2000,
+                        help="Compile time grows quickly with it, 2000 takes about a minute.")
+    parser.add_argument("--custom", type=int, default=20, help="Number of custom bindings in the registry.")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--cxx", type=str, default=os.environ.get("CXX", "c++"))
+    parser.add_argument("--include", type=str, default=os.path.join(_REPO_ROOT, "pybind11_weaver", "include"),
+                        help="Include directory of the runtime header to benchmark.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="pybind11_weaver_registry_") as work_dir:
+        src = os.path.join(work_dir, "bench.cc")
+        with open(src, "w") as f:
+            f.write(gen_source(args.entities, args.custom, args.repeat))
+        exe = os.path.join(work_dir, "bench")
+        python_lib = sysconfig.get_config_var("LIBDIR")
+        python_ld = f"python{sysconfig.get_config_var('LDVERSION')}"
+        subprocess.run([args.cxx, "-std=c++17", "-O1", f"-I{args.include}", f"-I{pybind11.get_include()}",
+                        f"-I{sysconfig.get_paths()['include']}", src, "-o", exe, f"-L{python_lib}",
+                        f"-Wl,-rpath,{python_lib}", f"-l{python_ld}"], check=True)
+        # no python api is called, so the interpreter is not initialized
+        print(f"entities {args.entities}, custom bindings {args.custom}")
+        print(subprocess.run([exe], check=True, capture_output=True, text=True).stdout, end="")
+
+
+if __name__ == "__main__":
+    main()
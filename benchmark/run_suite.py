@@ -0,0 +1,143 @@
+"""Benchmark the full generator pipeline on synthetic headers of several scales.
+
+Every run generates the header of a scale, and runs `pybind11_weaver.main --profile` in a fresh process, so the
+peak RSS of each run is isolated. The median of the repeats is reported, together with the time of main phases
+from the profile report.
+
+Usage:
+    python benchmark/run_suite.py --scales tiny small medium --repeat 3 --json out.json --csv out.csv
+    python benchmark/run_suite.py --scales tiny small --baseline old.json  # exit 1 if any scale regressed
+"""
+import argparse
+import csv
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import attrs
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from synthetic import SyntheticSpec, gen_header
+
+_REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+SCALES: Dict[str, SyntheticSpec] = {
+    "tiny": SyntheticSpec(namespaces=2, classes=5, methods=4, overloads=2, templates=4, hierarchy_depth=3,
+                          callbacks=2),
+    "small": SyntheticSpec(namespaces=4, classes=20, methods=6, overloads=2, templates=16, hierarchy_depth=4,
+                           callbacks=4),
+    "medium": SyntheticSpec(namespaces=8, classes=50, methods=8, overloads=2, templates=32, hierarchy_depth=6,
+                            callbacks=8),
+    "large": SyntheticSpec(namespaces=16, classes=80, methods=8, overloads=2, templates=64, hierarchy_depth=8,
+                           callbacks=16),
+}
+
+# phases of the profile report that are copied into the result
+_PHASES = ["load_tu", "map_from_gu", "codegen", "write", "write/clang_format"]
+
+
+def run_once(spec: SyntheticSpec, work_dir: str) -> Dict:
+    header = os.path.join(work_dir, "bench.h")
+    with open(header, "w") as f:
+        f.write(gen_header(spec))
+    cfg = os.path.join(work_dir, "cfg.yaml")
+    with open(cfg, "w") as f:
+        f.write(f"""
+common_config:
+  cxx_flags: [ "-std=c++17", ]
+io_configs:
+  - inputs: [ "{header}" ]
+    output: "{work_dir}/bench.cc.inc"
+""")
+    profile_file = os.path.join(work_dir, "profile.json")
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([_REPO_ROOT, os.environ.get("PYTHONPATH", "")]))
+    beg = time.perf_counter()
+    subprocess.run([sys.executable, "-m", "pybind11_weaver.main", "--config", cfg, "--profile", profile_file],
+                   check=True, env=env, stdout=subprocess.DEVNULL)
+    wall = time.perf_counter() - beg
+    with open(profile_file, "r") as f:
+        report = json.load(f)
+    unit = report["units"][0]
+    ret = {
+        "wall_seconds": wall,
+        "gen_seconds": report["seconds"],
+        "peak_rss_kb": report["peak_rss_kb"],
+        "output_bytes": os.path.getsize(os.path.join(work_dir, "bench.cc.inc")),
+        "entities": sum(v for k, v in unit["counters"].items() if k.startswith("entities.")),
+        "visited_cursors": unit["counters"]["visited_cursors"],
+    }
+    for phase in _PHASES:
+        ret[f"{phase.replace('/', '_')}_seconds"] = unit["phases"].get(phase, {}).get("seconds", 0.0)
+    return ret
+
+
+def run_scale(name: str, spec: SyntheticSpec, repeat: int) -> Dict:
+    runs = []
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory(prefix="pybind11_weaver_bench_") as work_dir:
+            runs.append(run_once(spec, work_dir))
+    result = {"scale": name, "symbols": spec.symbol_count()}
+    for key in runs[0]:
+        result[key] = statistics.median(run[key] for run in runs)
+    result["spec"] = attrs.asdict(spec)
+    return result
+
+
+def compare(results: List[Dict], baseline_file: str, threshold: float) -> bool:
+    """Print the ratio to baseline, return False if any scale is slower or larger than threshold."""
+    with open(baseline_file, "r") as f:
+        baseline = {r["scale"]: r for r in json.load(f)["results"]}
+    ok = True
+    for r in results:
+        old = baseline.get(r["scale"], None)
+        if old is None or old["spec"] != r["spec"]:
+            print(f"{r['scale']}: no comparable baseline")
+            continue
+        for key in ["gen_seconds", "peak_rss_kb"]:
+            ratio = r[key] / old[key] if old[key] else 1.0
+            regressed = ratio > 1 + threshold
+            ok = ok and not regressed
+            print(f"{r['scale']}: {key} {old[key]:.3f} -> {r[key]:.3f} ({ratio:.2f}x){' REGRESSED' if regressed else ''}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", nargs="+", default=["tiny", "small", "medium"], choices=list(SCALES.keys()))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", type=str, default="", help="Write results as json.")
+    parser.add_argument("--csv", type=str, default="", help="Write results as csv.")
+    parser.add_argument("--baseline", type=str, default="", help="A json written by --json to compare with.")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="Relative increase of time or peak RSS that counts as a regression.")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'scale':>8} {'symbols':>8} {'entities':>8} {'gen(s)':>8} {'wall(s)':>8} {'rss(MB)':>8} {'fmt(s)':>8}")
+    for name in args.scales:
+        r = run_scale(name, SCALES[name], args.repeat)
+        results.append(r)
+        print(f"{name:>8} {r['symbols']:>8} {r['entities']:>8.0f} {r['gen_seconds']:>8.2f} {r['wall_seconds']:>8.2f} "
+              f"{r['peak_rss_kb'] / 1024:>8.1f} {r['write_clang_format_seconds']:>8.2f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"python": sys.version, "results": results}, f, indent=2)
+    if args.csv:
+        fields = [k for k in results[0].keys() if k != "spec"]
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(results)
+    if args.baseline and not compare(results, args.baseline, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Synthetic C++ headers for benchmarking the generator.
+
+The header is made of `namespaces` namespaces, each contains:
+    1. A chain of `hierarchy_depth` polymorphic classes.
+    2. `classes` classes derived from the deepest class of the chain (or standalone when the depth is 0), each has
+        `methods` methods, and every method has `overloads` overloads.
+    3. A class template `Box`, which is instantiated implicitly by the return types of `templates` functions.
+    4. `callbacks` functions that take a function pointer callback.
+
+Usage:
+    python benchmark/synthetic.py --namespaces 2 --classes 10 > bench.h
+"""
+import argparse
+from typing import List
+
+import attrs
+
+
+@attrs.define
+class SyntheticSpec:
+    namespaces: int = 2
+    classes: int = 10
+    methods: int = 4
+    overloads: int = 2
+    templates: int = 4
+    hierarchy_depth: int = 3
+    callbacks: int = 2
+
+    def symbol_count(self) -> int:
+        """Number of C++ symbols (namespaces, classes, ctors, methods, fields and functions) in the header."""
+        chain = self.hierarchy_depth * 2  # the class and its virtual method
+        classes = self.classes * (1 + 2 + self.methods * self.overloads + 1)
+        box_instances = min(self.templates, self.classes) if self.classes > 0 else min(self.templates, 1)
+        boxes = box_instances * 4  # the class and its members
+        functions = self.templates + self.callbacks
+        return self.namespaces * (1 + chain + classes + boxes + functions)
+
+
+def _gen_namespace(spec: SyntheticSpec, ns_id: int, with_bodies: bool) -> List[str]:
+    def body(stmt: str = "") -> str:
+        if not with_bodies:
+            return ";"
+        return f" {{ {stmt} }}" if stmt else " {}"
+
+    lines = [f"namespace ns{ns_id} {{"]
+    for level in range(spec.hierarchy_depth):
+        base = f" : public Level{level - 1}" if level > 0 else ""
+        lines.append(f"struct Level{level}{base} {{")
+        lines.append(f"  virtual ~Level{level}() = default;")
+        lines.append(f"  virtual int level{level}_method(int v, double w){body('return 0;')}")
+        lines.append("};")
+
+    base = f" : public Level{spec.hierarchy_depth - 1}" if spec.hierarchy_depth > 0 else ""
+    for cls_id in range(spec.classes):
+        lines.append(f"class Class{cls_id}{base} {{")
+        lines.append("public:")
+        lines.append(f"  Class{cls_id}(){body()}")
+        lines.append(f"  explicit Class{cls_id}(int v){body()}")
+        for m in range(spec.methods):
+            for o in range(spec.overloads):
+                extra = "".join(f", int extra{i}" for i in range(o))
+                lines.append(f"  double method{m}(const Class{cls_id} &other, float f{extra}) const{body('return 0;')}")
+        lines.append("  int field;")
+        lines.append("};")
+
+    lines.append("template <class T> struct Box {")
+    lines.append("  T value;")
+    lines.append(f"  T get() const{body('return value;')}")
+    lines.append(f"  void set(const T &v){body('value = v;')}")
+    lines.append("};")
+    for t in range(spec.templates):
+        # `Box<Class_i>` is instantiated implicitly, some of the instantiations are shared by several functions
+        cls_name = f"Class{t % spec.classes}" if spec.classes > 0 else "int"
+        lines.append(f"inline Box<{cls_name}> make_box{t}(){body('return {};')}" if with_bodies else
+                     f"Box<{cls_name}> make_box{t}();")
+
+    for c in range(spec.callbacks):
+        lines.append(f"{'inline ' if with_bodies else ''}void on_event{c}(int (*callback)(int id, double value), "
+                     f"void *user_data){body()}")
+    lines.append("}")
+    return lines
+
+
+def gen_header(spec: SyntheticSpec, with_bodies: bool = False) -> str:
+    """When `with_bodies` is set, functions are defined inline, so the bindings could be linked and imported."""
+    lines = ["#pragma once", ""]
+    for ns_id in range(spec.namespaces):
+        lines.extend(_gen_namespace(spec, ns_id, with_bodies))
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    for field in attrs.fields(SyntheticSpec):
+        parser.add_argument(f"--{field.name}", type=int, default=field.default)
+    args = parser.parse_args()
+    print(gen_header(SyntheticSpec(**vars(args))))
+
+
+if __name__ == "__main__":
+    main()
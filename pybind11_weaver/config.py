@@ -7,7 +7,7 @@ import attrs
 import pybind11
 import yaml
 
-import pybind11_weaver.third_party.ccsyspath as ccsyspath
+from pybind11_weaver.utils import profiler, toolchain_probe
 
 
 def _unique_flags(flags: List[str]) -> List[str]:
@@ -22,14 +22,26 @@ class IOConfig:
     decl_fn_name: str = "DeclFn"
     root_module_namespace: str = ""
     _cxx_flags: List[str] = None
+    _cache_dir: str = ""
     extra_cxx_flags: List[str] = attrs.field(factory=list)
     gen_docstring: bool = True
     strict_visibility_mode: bool = False
+    skip_function_bodies: bool = False
+    depfile: str = ""
+    output_shards: int = 1
+    prelude_header: str = ""
+    reproducible: bool = False
+    compact_codegen: bool = False
+    lazy_namespaces: bool = False
+    _config_file: str = ""
 
     def normalize(self, common_config: "CommonConfig"):
         if len(self.inputs) == 0 or self.output == "":
             raise ValueError("Inputs and output can not be empty")
+        if self.output_shards < 1:
+            raise ValueError("output_shards must be positive")
         self._cxx_flags = common_config.cxx_flags + _unique_flags(self.extra_cxx_flags)
+        self._cache_dir = common_config.cache_dir
         self._normalize_inputs()
 
     def _normalize_inputs(self):
@@ -79,6 +91,9 @@ class CommonConfig:
     compiler: str = ""
     cxx_flags: List[str] = attrs.field(factory=list)
     include_directories: List[str] = attrs.field(factory=list)
+    jobs: int = 1
+    cache_dir: str = ""
+    parallel_compiler_probe: bool = False
 
     def normalize(self):
         include_sys_flags = self._get_default_include_flags()
@@ -91,13 +106,15 @@ class CommonConfig:
             try_to_use = [os.environ.get("CXX")] + try_to_use
         if self.compiler != "":
             try_to_use = [self.compiler] + try_to_use
-        cxx_sys_path = []
-        for compiler in try_to_use:
-            cxx_sys_path = ccsyspath.system_include_paths(compiler)
-            if len(cxx_sys_path) > 0:
-                self.compiler = compiler
-                break
-        full_list = [d.decode("utf-8") for d in cxx_sys_path] + [
+        cache_file = ""
+        if self.cache_dir != "":
+            cache_file = os.path.join(self.cache_dir, "toolchain.json")
+        with profiler.current().phase("probe_compiler"):
+            compiler, cxx_sys_path = toolchain_probe.system_include_paths(try_to_use, cache_file,
+                                                                          self.parallel_compiler_probe)
+        if compiler != "":
+            self.compiler = compiler
+        full_list = cxx_sys_path + [
             sysconfig.get_path("include"),
             pybind11.get_include(),
         ]
@@ -140,7 +157,9 @@ class MainConfig:
         if len(file_or_content) == 0:
             raise ValueError("file_or_content can not be empty")
         content = file_or_content
+        config_file = ""
         if os.path.exists(content):  # it is a file
+            config_file = os.path.abspath(file_or_content)
             with open(content, "r") as yml:
                 content = yml.read()
                 content = content.replace("${CFG_DIR}", os.path.dirname(os.path.abspath(file_or_content)))
@@ -150,6 +169,7 @@ class MainConfig:
         main_config.common_config.normalize()
         for i, io_config in enumerate(main_config.io_configs):
             io_config.normalize(main_config.common_config)
+            io_config._config_file = config_file
         if len(main_config.io_configs) == 0:
             raise ValueError("No IOConfig is specified")
         return main_config
@@ -14,6 +14,14 @@ from pybind11_weaver import gen_unit
 _logger = logging.getLogger(__name__)
 _KIND = cindex.CursorKind
 
+# cursor kinds that `create_entity` may create entity from, or whose children may be entities
+CREATABLE_KINDS = frozenset([_KIND.CXCursor_EnumDecl,
+                             _KIND.CXCursor_Namespace,
+                             _KIND.CXCursor_ClassDecl,
+                             _KIND.CXCursor_StructDecl,
+                             _KIND.CXCursor_FunctionDecl,
+                             _KIND.CXCursor_UnexposedDecl])
+
 
 def create_entity(gu: gen_unit.GenUnit, cursor: cindex.Cursor):
     """Create an entity without parent.
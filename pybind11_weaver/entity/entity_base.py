@@ -1,5 +1,4 @@
 import abc
-import functools
 import weakref
 import logging
 from typing import Dict, List
@@ -60,7 +59,6 @@ class Entity(abc.ABC):
         return None if self._parent is None else self._parent()
 
     @property
-    @functools.lru_cache
     def name(self):
         """Used to difference different entity instances in the same scope."""
         return self.cursor.displayname
@@ -113,6 +111,14 @@ class Entity(abc.ABC):
         """
         return []
 
+    def used_types(self) -> List[str]:
+        """Reference names of the types used by the bindings, e.g. the params and returns of methods.
+
+        Unlike `dependency`, they do not affect the generation order, they are only used to bind the lazy namespaces
+        of these types before this entity.
+        """
+        return []
+
     def top_level_extra_code(self) -> str:
         """Entity may inject extra code into the generated binding struct."""
         return ""
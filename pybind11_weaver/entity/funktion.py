@@ -4,21 +4,26 @@ from typing import List, Dict
 from pylibclang import cindex
 
 from pybind11_weaver import gen_unit
-from pybind11_weaver.utils import fn
+from pybind11_weaver.utils import common, fn, run_state
 from . import entity_base
 
 
+def get_added_funcs() -> Dict[str, int]:
+    """Number of function entities created for each python name, used to make the struct names unique."""
+    return run_state.slot("funktion.added_funcs", lambda: collections.defaultdict(int))
+
+
 class FunctionEntity(entity_base.Entity):
-    _added_func: Dict[str, int] = collections.defaultdict(int)
 
     def __init__(self, gu: gen_unit.GenUnit, cursor: cindex.Cursor):
         entity_base.Entity.__init__(self, gu, cursor)
         assert cursor.kind == cindex.CursorKind.CXCursor_FunctionDecl
         python_name = fn.fn_python_name(cursor)
         struct_name = python_name
-        if FunctionEntity._added_func[python_name] != 0:
-            struct_name += str(FunctionEntity._added_func[python_name])
-        FunctionEntity._added_func[python_name] += 1
+        added_funcs = get_added_funcs()
+        if added_funcs[python_name] != 0:
+            struct_name += str(added_funcs[python_name])
+        added_funcs[python_name] += 1
         self._struct_name = struct_name
         self._extra_code = ""
 
@@ -53,6 +58,9 @@ virtual const char * AddFunction(){{
     def default_pybind11_type_str(self) -> str:
         return f"pybind11::module_ &"
 
+    def used_types(self) -> List[str]:
+        return common.referenced_types([self.cursor.result_type] + [arg.type for arg in self.cursor.get_arguments()])
+
     def extra_code(self) -> str:
         """Entity may inject extra code into the generated binding struct."""
         return self._extra_code
@@ -4,7 +4,7 @@ from typing import List, Tuple
 
 from pylibclang import cindex
 
-from pybind11_weaver.utils import common, fn
+from pybind11_weaver.utils import class_traits, common, fn
 from pybind11_weaver.entity import entity_base
 from . import klass
 
@@ -32,9 +32,8 @@ class GenFiled:
     def run(self, pybind11_obj_sym: str) -> Tuple[List[str], List[str]]:
         codes = []
         kls_entity = self.kls_entity
-        for cursor in kls_entity.cursor.get_children():
-            if cursor.kind == cindex.CursorKind.CXCursor_FieldDecl and \
-                    kls_entity.could_member_export(cursor):
+        for cursor in class_traits.get(kls_entity.cursor).fields:
+            if kls_entity.could_member_export(cursor):
                 if common.is_types_has_unique_ptr([cursor.type]) or \
                         not isinstance(fn.get_pb11_type(cursor.type)[1], fn.NoCast) or \
                         not _is_bindable(cursor):
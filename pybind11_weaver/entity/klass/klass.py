@@ -1,4 +1,3 @@
-import functools
 from typing import List
 import logging
 
@@ -6,7 +5,7 @@ import pylibclang._C
 from pylibclang import cindex
 
 from pybind11_weaver.entity import entity_base
-from pybind11_weaver.utils import common, scope_list
+from pybind11_weaver.utils import class_traits, common, scope_list
 from pybind11_weaver import gen_unit
 from pybind11_weaver.entity.klass import method, field, trampoline
 
@@ -21,6 +20,7 @@ class ClassEntity(entity_base.Entity):
         self.extra_methods_codes = []
         self._top_level_extra = []
         self._dependency = set()
+        self._pybind11_type_str = None
 
     @property
     def name(self):
@@ -39,6 +39,8 @@ class ClassEntity(entity_base.Entity):
         return code
 
     def update_stmts(self, pybind11_obj_sym: str) -> List[str]:
+        if self.gu.io_config.compact_codegen:
+            return self._compact_update_stmts(pybind11_obj_sym)
 
         # generate method binding first, because it will inject template argument using decl
         codes, new_extra = method.GenMethod(self).run(pybind11_obj_sym)
@@ -82,35 +84,68 @@ virtual const char * AddCtor{id}(){{
 """
             extra.append(new_extra)
 
-        for cursor in self.cursor.get_children():
-            if cursor.kind == cindex.CursorKind.CXCursor_Constructor:
-                if self.could_member_export(cursor) and not (
-                        cursor.is_move_constructor() or cursor.is_copy_constructor()):
-                    add_ctor(cursor, pybind11_obj_sym, len(codes))
+        for cursor in self._exported_ctors():
+            add_ctor(cursor, pybind11_obj_sym, len(codes))
 
         if len(codes) == 0:
             codes.append(f"pybind11_weaver::TryAddDefaultCtor<{self.reference_name()}>({pybind11_obj_sym});")
         return codes, extra
 
-    @functools.lru_cache
+    def _exported_ctors(self) -> List[cindex.Cursor]:
+        return [cursor for cursor in class_traits.get(self.cursor).ctors if
+                self.could_member_export(cursor) and not (cursor.is_move_constructor() or cursor.is_copy_constructor())]
+
+    def _compact_update_stmts(self, pybind11_obj_sym: str) -> List[str]:
+        """Methods and ctors are registered from one table by `pybind11_weaver::AddMembers`, instead of a virtual
+        function per member, they could still be customized by the `CustomBindingRegistry`."""
+        entries, new_extra = method.GenMethod(self).run_compact()
+        self.extra_methods_codes.extend(new_extra)
+
+        ctors = self._exported_ctors()
+        comment = self.cursor.raw_comment
+        comment = f'R"_pb11_weaver({comment})_pb11_weaver"' if self.gu.io_config.gen_docstring and comment else "nullptr"
+        for id, cursor in enumerate(ctors):
+            param_types = [arg.type for arg in cursor.get_arguments()]
+            if common.is_types_has_unique_ptr(param_types):
+                continue
+            param_types = [common.safe_type_reference(t) for t in param_types]
+            entries.append(f'pybind11_weaver::CtorDef<{",".join(param_types)}>("Ctor{id}",{comment})')
+
+        codes = []
+        if len(entries) > 0:
+            codes.append(f"pybind11_weaver::AddMembers({pybind11_obj_sym},Key(),custom_members.get(),\n"
+                         + ",\n".join(entries) + ");")
+        if len(ctors) == 0:
+            codes.append(f"pybind11_weaver::TryAddDefaultCtor<{self.reference_name()}>({pybind11_obj_sym});")
+
+        new_codes, new_extra = field.GenFiled(self).run(pybind11_obj_sym)
+        codes.extend(new_codes)
+        self.extra_methods_codes.extend(new_extra)
+        return codes
+
     def default_pybind11_type_str(self) -> str:
+        # computed once per entity, since it registers the trampoline definition and the base dependency
+        if self._pybind11_type_str is None:
+            self._pybind11_type_str = self._make_pybind11_type_str()
+        return self._pybind11_type_str
+
+    def _make_pybind11_type_str(self) -> str:
         t_param_list = [self.reference_name()]
 
-        if not common.is_type_deletable(self.cursor.type):
+        if not class_traits.is_type_deletable(self.cursor.type):
             t_param_list.append(f"std::unique_ptr<{self.reference_name()},pybind11::nodelete>")
         tramp = trampoline.Trampoline(self)
         if tramp is not None:
             t_param_list.append(tramp.get_trampoline_cls_name())
             self._top_level_extra.append(tramp.get_defs())
         base_cursor = None
-        for cursor in self.cursor.get_children():
-            if cursor.kind == cindex.CursorKind.CXCursor_CXXBaseSpecifier:
-                if base_cursor is not None:
-                    base_cursor = None
-                    _logger.warning(
-                        f"Multiple inheritance not supported `{self.cursor.type.spelling}`, base class ignored")
-                else:
-                    base_cursor = cursor
+        for cursor in class_traits.get(self.cursor).bases:
+            if base_cursor is not None:
+                base_cursor = None
+                _logger.warning(
+                    f"Multiple inheritance not supported `{self.cursor.type.spelling}`, base class ignored")
+            else:
+                base_cursor = cursor
 
         if (base_cursor is not None
                 and self.could_user_class_export(base_cursor.type)):
@@ -140,7 +175,16 @@ virtual const char * AddCtor{id}(){{
 
     def dependency(self) -> List[str]:
         self.default_pybind11_type_str()  # force update dependency
-        return list(self._dependency)
+        return sorted(self._dependency)
+
+    def used_types(self) -> List[str]:
+        traits = class_traits.get(self.cursor)
+        types = [cursor.type for cursor in traits.fields if self.could_member_export(cursor)]
+        for cursor in traits.methods + traits.ctors:
+            if self.could_member_export(cursor):
+                types.append(cursor.result_type)
+                types.extend(arg.type for arg in cursor.get_arguments())
+        return common.referenced_types(types)
 
     def top_level_extra_code(self) -> str:
         """Entity may inject extra code into the generated binding struct."""
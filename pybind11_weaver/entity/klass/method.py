@@ -6,7 +6,7 @@ from typing import List, Tuple, Dict, Optional
 import pylibclang._C
 from pylibclang import cindex
 
-from pybind11_weaver.utils import fn, common
+from pybind11_weaver.utils import class_traits, fn, common
 from . import klass
 
 _logger = logging.getLogger(__name__)
@@ -56,6 +56,16 @@ return _pb11_weaver_comment_str;
     def get_call_stmt(self):
         return _call_bind_method.format(method_identifier=self.identifier_name)
 
+    def get_table_entry(self) -> Optional[str]:
+        """Entry of the member table of compact codegen, None if the method could not be bound."""
+        fn_ptr = fn.get_fn_value_expr(self.fn_cursor)
+        if fn_ptr is None:
+            return None
+        comment = self.fn_cursor.raw_comment
+        comment = f'R"_pb11_weaver({comment})_pb11_weaver"' if self.inect_docstring and comment else "nullptr"
+        is_static = "true" if self.fn_cursor.is_static_method() else "false"
+        return f'pybind11_weaver::MakeMethodDef<{is_static}>("{self.identifier_name}","{self.bind_name}",{fn_ptr},{comment})'
+
 
 class GenMethod:
 
@@ -67,16 +77,39 @@ class GenMethod:
         """Return [binding_codes,extra_codes]"""
         codes = []
         extra_codes: List[str] = []
+        methods, using_decls = self._collect()
+        if using_decls is None:
+            return [], []
+        extra_codes.append("\n".join(using_decls))
+
+        call_method_bind = []
+        method_bind_body = []
+        for method in methods:
+            call_method_bind.append(method.get_call_stmt())
+            method_bind_body.append(method.get_def_stmt(pybind11_obj_sym))
+
+        codes.extend(call_method_bind)
+        extra_codes.extend(method_bind_body)
+        return codes, extra_codes
+
+    def run_compact(self) -> Tuple[List[str], List[str]]:
+        """Return [table_entries,extra_codes], for compact codegen."""
+        methods, using_decls = self._collect()
+        if using_decls is None:
+            return [], []
+        entries = [method.get_table_entry() for method in methods]
+        return [entry for entry in entries if entry is not None], ["\n".join(using_decls)]
+
+    def _collect(self) -> Tuple[List[Method], Optional[List[str]]]:
+        """Return [methods,using_decls], using_decls is None if the class could not be bound."""
         kls_entity = self.kls_entity
         methods = []
 
         root_cursor, using_decls, _ = common.get_def_cls_cursor(kls_entity.cursor)
         if using_decls is None:
-            return [], []
-        extra_codes.append("\n".join(using_decls))
-        for cursor in root_cursor.get_children():
-            if cursor.kind == cindex.CursorKind.CXCursor_CXXMethod and kls_entity.could_member_export(
-                    cursor) and not common.is_operator_overload(cursor):
+            return [], None
+        for cursor in class_traits.get(root_cursor).methods:
+            if kls_entity.could_member_export(cursor) and not common.is_operator_overload(cursor):
                 bind_name = fn.fn_python_name(cursor)
                 unique_name = bind_name
                 while len(self.added_method[bind_name]) != 0:
@@ -93,13 +126,4 @@ class GenMethod:
                 methods.append(Method(cursor, kls_entity.gu.io_config.gen_docstring, bind_name, unique_name,
                                       disable_mark))
                 self.added_method[bind_name].append(methods[-1])
-
-        call_method_bind = []
-        method_bind_body = []
-        for method in methods:
-            call_method_bind.append(method.get_call_stmt())
-            method_bind_body.append(method.get_def_stmt(pybind11_obj_sym))
-
-        codes.extend(call_method_bind)
-        extra_codes.extend(method_bind_body)
-        return codes, extra_codes
+        return methods, using_decls
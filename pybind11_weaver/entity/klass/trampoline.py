@@ -1,8 +1,8 @@
-from typing import Union, Set, List
+from typing import Dict, List, Optional, Set, Tuple, Union
 
 from pylibclang import cindex
 
-from pybind11_weaver.utils import common
+from pybind11_weaver.utils import class_traits, common, run_state
 
 _tramp_method = """
 #ifndef PYBIND11_DISABLE_OVERRIDE_{disable_mark}
@@ -31,6 +31,51 @@ public:
 """
 
 
+def _get_sig(cursor: cindex.Cursor, subs: Dict[str, str]) -> str:
+    ret_t = common.safe_type_reference(cursor.result_type, subs)
+    arg_t = [common.safe_type_reference(arg.type, subs) for arg in cursor.get_arguments()]
+    fn_name = cursor.spelling
+    sig = f"{ret_t} {fn_name}({','.join(arg_t)})"
+    return sig
+
+
+class _ClassVirtuals:
+    """Virtual methods declared in one class, and the same of its base, which is shared by all derived classes."""
+
+    def __init__(self, template_decls: List[str], subs: Dict[str, str]):
+        self.template_decls = template_decls
+        self.subs = subs
+        # (cursor, virtual kind, signature) in declaration order
+        self.methods: List[Tuple[cindex.Cursor, str, str]] = []
+        self.base: Optional[_ClassVirtuals] = None
+
+
+def _class_virtuals_db() -> Dict[str, Optional[_ClassVirtuals]]:
+    return run_state.slot("trampoline.class_virtuals_db", dict)
+
+
+def clear_cache():
+    _class_virtuals_db().clear()
+
+
+def _get_class_virtuals(cursor: cindex.Cursor) -> Optional[_ClassVirtuals]:
+    key = common.safe_type_reference(cursor.type)
+    if key in _class_virtuals_db():
+        return _class_virtuals_db()[key]
+    def_cursor, decls, subs = common.get_def_cls_cursor(cursor)
+    ret = None
+    if decls is not None:
+        ret = _ClassVirtuals(decls, subs)
+        traits = class_traits.get(def_cursor)
+        for c, virtual_kind in traits.virtual_methods:
+            ret.methods.append((c, virtual_kind, _get_sig(c, subs)))
+        assert len(traits.bases) <= 1, "Multiple inheritance not supported"
+        if len(traits.bases) == 1:
+            ret.base = _get_class_virtuals(traits.bases[0].type.get_declaration())
+    _class_virtuals_db()[key] = ret
+    return ret
+
+
 class Virtuals:
     def __init__(self):
         self.virtuals: List[cindex.Cursor] = []
@@ -55,26 +100,18 @@ class Virtuals:
             base_empty = True
         return base_empty and len(self.virtuals) == 0 and len(self.pure_virtuals) == 0
 
-    def add_pure_virtual(self, cursor: cindex.Cursor):
-        if self._try_add_sig(cursor):
+    def add_pure_virtual(self, cursor: cindex.Cursor, sig: str):
+        if self._try_add_sig(sig):
             self.pure_virtuals.append(cursor)
 
-    def add_virtual(self, cursor: cindex.Cursor):
-        if self._try_add_sig(cursor):
+    def add_virtual(self, cursor: cindex.Cursor, sig: str):
+        if self._try_add_sig(sig):
             self.virtuals.append(cursor)
 
-    def force_add_sig(self, cursor: cindex.Cursor):
-        self.sigs.add(self._get_sig(cursor))
-
-    def _get_sig(self, cursor: cindex.Cursor):
-        ret_t = common.safe_type_reference(cursor.result_type, self.subs)
-        arg_t = [common.safe_type_reference(arg.type, self.subs) for arg in cursor.get_arguments()]
-        fn_name = cursor.spelling
-        sig = f"{ret_t} {fn_name}({','.join(arg_t)})"
-        return sig
+    def force_add_sig(self, sig: str):
+        self.sigs.add(sig)
 
-    def _try_add_sig(self, cursor: cindex.Cursor):
-        sig = self._get_sig(cursor)
+    def _try_add_sig(self, sig: str):
         if sig in self.sigs:
             return False
         self.sigs.add(sig)
@@ -85,7 +122,7 @@ class Trampoline:
 
     def __new__(cls, entity):
         cursor = entity.cursor
-        if common.is_marked_final(entity.cursor):
+        if class_traits.get(entity.cursor).is_final:
             return None
         virt = Virtuals()
         cls.detect_all_virtual_methods(cursor, virt)
@@ -98,22 +135,37 @@ class Trampoline:
     def __init__(self, entity):
         self.entity = entity
 
-    def _get_method(self, cursor: cindex.Cursor, override_type: str, concreate_ref: str):
+    @staticmethod
+    def _get_method_parts(cursor: cindex.Cursor) -> Dict[str, str]:
+        # method cursors are shared by all derived classes, so parts only depend on the method are memoized on it
+        if hasattr(cursor, "_tramp_parts"):
+            return cursor._tramp_parts
         ret_t = common.safe_type_reference(cursor.result_type)
-        method_name = cursor.spelling
-        params_t = [f"{common.safe_type_reference(p.type)}" for p in cursor.get_arguments()]
-        args = [p.spelling if p.spelling != "" else f"arg{i}" for i, p in enumerate(cursor.get_arguments())]
-        last_right_paren = cursor.type.spelling.rfind(")")
-        qualifier = cursor.type.spelling[last_right_paren + 1:]
-        return _tramp_method.format(
-            disable_mark=common.type_python_name(concreate_ref + cursor.type.spelling),
+        arguments = list(cursor.get_arguments())
+        params_t = [f"{common.safe_type_reference(p.type)}" for p in arguments]
+        args = [p.spelling if p.spelling != "" else f"arg{i}" for i, p in enumerate(arguments)]
+        type_spelling = cursor.type.spelling
+        last_right_paren = type_spelling.rfind(")")
+        cursor._tramp_parts = dict(
+            type_spelling=type_spelling,
             ret_t=ret_t,
-            method_name=method_name,
+            method_name=cursor.spelling,
             params=", ".join(f"{p_t} {a}" for p_t, a in zip(params_t, args)),
-            qualifier=qualifier,
+            qualifier=type_spelling[last_right_paren + 1:],
+            args=", ".join(args))
+        return cursor._tramp_parts
+
+    def _get_method(self, cursor: cindex.Cursor, override_type: str, concreate_ref: str):
+        parts = self._get_method_parts(cursor)
+        return _tramp_method.format(
+            disable_mark=common.type_python_name(concreate_ref + parts["type_spelling"]),
+            ret_t=parts["ret_t"],
+            method_name=parts["method_name"],
+            params=parts["params"],
+            qualifier=parts["qualifier"],
             override_type=override_type,
             concreate_ref=concreate_ref,
-            args=", ".join(args)
+            args=parts["args"]
         )
 
     def get_virt_def(self, virt: Virtuals, nest_level: int) -> str:
@@ -151,28 +203,17 @@ class Trampoline:
 
     @staticmethod
     def detect_all_virtual_methods(cursor: cindex.Cursor, to_update: Virtuals):
-        cursor, decls, subs = common.get_def_cls_cursor(cursor)
-        if decls is None:
-            return
-        to_update.template_decls = decls
-        to_update.subs = subs
-        base_found = None
-        for c in cursor.get_children():
-            if c.kind == cindex.CursorKind.CXCursor_CXXMethod:
-                if c.is_virtual_method():
-                    if common.is_marked_final(c) or not common.could_member_accessed(c):
-                        to_update.force_add_sig(c)
-                        continue
-                if not common.could_member_accessed(c):
-                    continue
-                if c.is_pure_virtual_method():
-                    to_update.add_pure_virtual(c)
-                elif c.is_virtual_method():
-                    to_update.add_virtual(c)
-            # recurse into base class
-            elif c.kind == cindex.CursorKind.CXCursor_CXXBaseSpecifier:
-                assert base_found is None, "Multiple inheritance not supported"
-                base_found = c.type.get_declaration()
-        if base_found is not None:
-            base_virt = to_update.create_base()
-            Trampoline.detect_all_virtual_methods(base_found, base_virt)
+        class_virtuals = _get_class_virtuals(cursor)
+        while class_virtuals is not None:
+            to_update.template_decls = class_virtuals.template_decls
+            to_update.subs = class_virtuals.subs
+            for c, virtual_kind, sig in class_virtuals.methods:
+                if virtual_kind == class_traits.SEALED:
+                    to_update.force_add_sig(sig)
+                elif virtual_kind == class_traits.PURE_VIRTUAL:
+                    to_update.add_pure_virtual(c, sig)
+                else:
+                    to_update.add_virtual(c, sig)
+            class_virtuals = class_virtuals.base
+            if class_virtuals is not None:
+                to_update = to_update.create_base()
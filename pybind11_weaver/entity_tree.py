@@ -1,35 +1,22 @@
+import collections
 import logging
 from typing import List, Dict, Tuple
-from contextlib import contextmanager
 
 from pylibclang import cindex
 import pylibclang._C
 
 from pybind11_weaver import gen_unit
-from pybind11_weaver.entity import create_entity
+from pybind11_weaver.entity import create_entity, CREATABLE_KINDS
 from pybind11_weaver.entity import entity_base, funktion
 
-from pybind11_weaver.utils import common
+from pybind11_weaver.utils import common, profiler, source_cache
 
 _logger = logging.getLogger(__name__)
 
 
-@contextmanager
-def _inject_tu(nodes, gu):
-    for node in nodes:
-        node._tu = gu.tu  # keep compatible with cindex and keep tu alive
-    yield nodes
-    for node in nodes:
-        del node._tu
-
-
 def get_template_struct_class(cursor: cindex.Cursor):
-    source_file = cursor.location.file
-    source_line = cursor.location.line
-    # read the source_line-th line's content in the source file
-    with open(source_file.name, 'r') as f:
-        source_code = f.read()
-        line_content = source_code.splitlines()[source_line - 1]
+    location = cursor.location
+    line_content = source_cache.get_line(location.file.name, location.line)
     if "struct" in line_content:
         return "extern template struct"
     else:
@@ -44,7 +31,8 @@ class EntityTree:
     def __init__(self, gu: gen_unit.GenUnit):
         self.entities: Dict[str, entity_base.Entity] = {}
         self.gu = gu
-        self._map_from_gu(gu)
+        with profiler.current().phase("map_from_gu"):
+            self._map_from_gu(gu)
 
     def add_child(self, child: "Entity"):
         if child.name in self.entities:
@@ -63,75 +51,126 @@ class EntityTree:
     def __contains__(self, item):
         return item in self.entities
 
-    def _inject_explicit_template_instantiation(self, gu: gen_unit.GenUnit):
+    def _traverse(self, gu: gen_unit.GenUnit, find_templates: bool) -> Tuple[
+        List[Tuple[cindex.Cursor, int]], Dict[str, str]]:
+        """Walk the TU once, collect entity candidates and template instances that need explicit instantiation.
+
+        Returns:
+            (candidates, implicit_instantiation), candidates are (cursor, index of parent candidate or -1) in pre-order.
+
+        """
         explicit_instantiation = set()
         implicit_instantiation = dict()
+        skip_body = gu.io_config.skip_function_bodies
+        candidates: List[Tuple[cindex.Cursor, int]] = []
+        candidate_of: Dict[int, List[Tuple[cindex.Cursor, int]]] = {gu.tu.cursor.hash: [(gu.tu.cursor, -1)]}
 
         def is_valid(cursor: cindex.Cursor):
             return gu.is_cursor_in_inputs(cursor)
 
+        def parent_candidate(parent: cindex.Cursor):
+            for c, idx in candidate_of.get(parent.hash, []):
+                if c == parent:
+                    return idx
+            return None
+
+        def visit_template(cursor, parent):
+            if cursor.kind in [cindex.CursorKind.CXCursor_ClassDecl,
+                               cindex.CursorKind.CXCursor_StructDecl] and common.is_concreate_template(cursor):
+                key_name = common.safe_type_reference(cursor.type)
+                explicit_instantiation.add(key_name)
+                if key_name in implicit_instantiation:
+                    del implicit_instantiation[key_name]
+            elif cursor.kind == cindex.CursorKind.CXCursor_TemplateRef and is_valid(cursor.referenced):
+                # we can not get more info from template ref anymore, so we need to get info from parent
+                possible_types = []
+                if parent.kind in [cindex.CursorKind.CXCursor_FieldDecl, cindex.CursorKind.CXCursor_ParmDecl,
+                                   cindex.CursorKind.CXCursor_CXXBaseSpecifier]:
+                    possible_types = [parent.type]
+                elif parent.kind in [cindex.CursorKind.CXCursor_FunctionDecl, cindex.CursorKind.CXCursor_CXXMethod]:
+                    possible_types = [parent.result_type] + [arg.type for arg in parent.get_arguments()]
+                else:
+                    _logger.info(
+                        f"Only template instance may used in python will get auto exported, ignored {parent.kind} at {parent.location}")
+
+                for t in possible_types:
+                    t = common.remove_const_ref_pointer(t).get_canonical()
+                    t_c = t.get_declaration()
+                    if common.is_concreate_template(t_c):
+                        template_c = pylibclang._C.clang_getSpecializedCursorTemplate(t_c)
+                        if is_valid(template_c):
+                            key_name = common.safe_type_reference(t)
+                            if key_name not in explicit_instantiation:
+                                implicit_instantiation[key_name] = get_template_struct_class(template_c)
+
         def visitor(cursor, parent, unused1):
+            self.visited_cursors += 1
+            cursor._tu = gu.tu  # keep compatible with cindex and keep tu alive
+            parent._tu = gu.tu
+            if skip_body and cursor.kind == cindex.CursorKind.CXCursor_CompoundStmt:
+                return pylibclang._C.CXChildVisitResult.CXChildVisit_Continue
             if not is_valid(cursor):
                 return pylibclang._C.CXChildVisitResult.CXChildVisit_Continue
-            with _inject_tu([cursor, parent], gu):
-                if cursor.kind in [cindex.CursorKind.CXCursor_ClassDecl,
-                                   cindex.CursorKind.CXCursor_StructDecl] and common.is_concreate_template(cursor):
-                    key_name = common.safe_type_reference(cursor.type)
-                    explicit_instantiation.add(key_name)
-                    if key_name in implicit_instantiation:
-                        del implicit_instantiation[key_name]
-                elif cursor.kind == cindex.CursorKind.CXCursor_TemplateRef and is_valid(cursor.referenced):
-                    # we can not get more info from template ref anymore, so we need to get info from parent
-                    possible_types = []
-                    if parent.kind in [cindex.CursorKind.CXCursor_FieldDecl, cindex.CursorKind.CXCursor_ParmDecl,
-                                       cindex.CursorKind.CXCursor_CXXBaseSpecifier]:
-                        possible_types = [parent.type]
-                    elif parent.kind in [cindex.CursorKind.CXCursor_FunctionDecl, cindex.CursorKind.CXCursor_CXXMethod]:
-                        possible_types = [parent.result_type] + [arg.type for arg in parent.get_arguments()]
-                    else:
-                        _logger.info(
-                            f"Only template instance may used in python will get auto exported, ignored {parent.kind} at {parent.location}")
-
-                    for t in possible_types:
-                        t = common.remove_const_ref_pointer(t).get_canonical()
-                        t_c = t.get_declaration()
-                        if common.is_concreate_template(t_c):
-                            template_c = pylibclang._C.clang_getSpecializedCursorTemplate(t_c)
-                            if is_valid(template_c):
-                                key_name = common.safe_type_reference(t)
-                                if key_name not in explicit_instantiation:
-                                    implicit_instantiation[key_name] = get_template_struct_class(template_c)
-
-            return pylibclang._C.CXChildVisitResult.CXChildVisit_Recurse
+            if find_templates:
+                visit_template(cursor, parent)
+            is_candidate = False
+            if cursor.kind in CREATABLE_KINDS:
+                parent_idx = parent_candidate(parent)
+                if parent_idx is not None:
+                    candidate_of.setdefault(cursor.hash, []).append((cursor, len(candidates)))
+                    candidates.append((cursor, parent_idx))
+                    is_candidate = True
+            if is_candidate or find_templates:
+                return pylibclang._C.CXChildVisitResult.CXChildVisit_Recurse
+            return pylibclang._C.CXChildVisitResult.CXChildVisit_Continue
 
         pylibclang._C.clang_visitChildren(gu.tu.cursor, visitor, pylibclang._C.voidp(0))
-        init_code = "\n".join([f"{prefix} {type_name};" for type_name, prefix in implicit_instantiation.items()])
-        if len(implicit_instantiation) > 0:
-            _logger.info(f"Implicit template instance binding added: \n {init_code}");
-        gu.reload_tu(init_code)
-        funktion.FunctionEntity._added_func.clear()
-
-    def _map_from_gu(self, gu: gen_unit.GenUnit):
-        self._inject_explicit_template_instantiation(gu)
-        last_parent: List[entity_base.Entity] = [None]
-        worklist: List[Tuple[cindex.Cursor, entity_base.Entity]] = [(gu.tu.cursor, self)]
-
-        def visitor(child_cursor, unused0, unused1):
-            child_cursor._tu = gu.tu  # keep compatible with cindex and keep tu alive
-            parent = last_parent[0]
-            if gu.is_cursor_in_inputs(child_cursor):
-                if child_cursor.kind == cindex.CursorKind.CXCursor_UnexposedDecl:
-                    worklist.append((child_cursor, parent))
-                    return pylibclang._C.CXChildVisitResult.CXChildVisit_Continue
-                new_entity = create_entity(gu, child_cursor)
+        return candidates, implicit_instantiation
+
+    def _build_entities(self, gu: gen_unit.GenUnit, candidates: List[Tuple[cindex.Cursor, int]]):
+        """Create entities in the order of a LIFO worklist, which creates all children of a scope before visiting them.
+
+        The creation order decides the struct names of same-named functions, so it must be stable across versions.
+        """
+        funktion.get_added_funcs().clear()
+        children: Dict[int, List[int]] = collections.defaultdict(list)
+        for idx, (_, parent_idx) in enumerate(candidates):
+            children[parent_idx].append(idx)
+        scopes: Dict[int, entity_base.Entity] = {-1: self}  # the scope that children of the i-th candidate are added to
+        worklist = [-1]
+        while len(worklist) > 0:
+            idx = worklist.pop()
+            parent = scopes[idx]
+            for child_idx in children[idx]:
+                cursor = candidates[child_idx][0]
+                if cursor.kind == cindex.CursorKind.CXCursor_UnexposedDecl:
+                    scopes[child_idx] = parent
+                    worklist.append(child_idx)
+                    continue
+                new_entity = create_entity(gu, cursor)
                 if new_entity is None:
-                    return pylibclang._C.CXChildVisitResult.CXChildVisit_Continue
+                    continue
                 parent.add_child(new_entity)
-                worklist.append((new_entity.cursor, parent[new_entity.name]))
-            return pylibclang._C.CXChildVisitResult.CXChildVisit_Continue
+                scopes[child_idx] = parent[new_entity.name]
+                worklist.append(child_idx)
 
-        while len(worklist) > 0:
-            new_item = worklist.pop()
-            last_parent[0] = new_item[1]
-            next_cur = new_item[0]
-            pylibclang._C.clang_visitChildren(next_cur, visitor, pylibclang._C.voidp(0))
+    def _map_from_gu(self, gu: gen_unit.GenUnit):
+        prof = profiler.current()
+        self.visited_cursors = 0
+        with prof.phase("traverse"):
+            candidates, implicit_instantiation = self._traverse(gu, find_templates=True)
+        init_code = "\n".join([f"{prefix} {type_name};" for type_name, prefix in implicit_instantiation.items()])
+        if len(implicit_instantiation) > 0:
+            _logger.info(f"Implicit template instance binding added: \n {init_code}");
+        with prof.phase("reload_tu"):
+            gu.reload_tu(init_code)
+        if len(implicit_instantiation) > 0:
+            # cursors of the old TU are invalid now, and the injected code may create new entities
+            with prof.phase("traverse"):
+                candidates, _ = self._traverse(gu, find_templates=False)
+        _logger.info(f"Visited {self.visited_cursors} cursors of {gu.io_config.output}, "
+                     f"input file cache hit rate {gu.file_cache_hit_rate():.1%}")
+        prof.counters["visited_cursors"] += self.visited_cursors
+        prof.counters["implicit_instantiations"] += len(implicit_instantiation)
+        with prof.phase("build_entities"):
+            self._build_entities(gu, candidates)
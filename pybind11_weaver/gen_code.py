@@ -1,13 +1,26 @@
+import bisect
+import contextlib
+import functools
+import heapq
+import io
+import json
 import os.path
-from typing import Dict, List
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+import multiprocessing
 import shutil
+import subprocess
 import sys
+import tempfile
+import time
 import logging
 
-from pybind11_weaver.entity import entity_base, klass, enum
+from pylibclang import cindex
+
+from pybind11_weaver.entity import entity_base, klass, enum, namespace
 from pybind11_weaver import entity_tree
 from pybind11_weaver import gen_unit
-from pybind11_weaver.utils import fn, common
+from pybind11_weaver import config
+from pybind11_weaver.utils import atomic_file, fn, common, depfile, profiler, run_state, source_cache
 
 _logger = logging.getLogger(__name__)
 
@@ -33,7 +46,7 @@ template <class Pybind11T={handle_type}> struct {bind_struct_name} : public Enti
     return EntityScope(handle);
   }}
   
-  static const char * Key(){{ 
+  static constexpr const char * Key(){{ 
     return {unique_struct_key};
   }}
    
@@ -47,7 +60,7 @@ using {entity_struct_name} = {bind_struct_name}<>;
 
 struct {entity_struct_name} : public pybind11_weaver::DisabledEntity {{
   explicit {entity_struct_name}(EntityScope parent_h){{}}
-  static const char * Key(){{ 
+  static constexpr const char * Key(){{ 
     return {unique_struct_key};
   }}
 }};
@@ -56,11 +69,9 @@ struct {entity_struct_name} : public pybind11_weaver::DisabledEntity {{
 """
 
 file_template = """
-// GENERATED AT {date}
-
-{include_directives}
+{generated_mark}
 
-{pybind11_weaver_header}
+{prelude}
 
 namespace {{
 
@@ -78,118 +89,925 @@ using pybind11_weaver::EntityBase;
 pybind11_weaver::_PointerWrapperBase::FastBind(m);
 {create_warped_pointer_bindings}
 
+    pybind11_weaver::EntityTable entities({entity_num});
 {create_entity_var_stmts}
 
-    auto update_fn = [=](){{
-{update_entity_var_stmts}    
+    auto update_fn = [entities = std::move(entities)](){{
+        for (auto & entity : entities) {{
+            entity->Update();
+        }}
+    }};
+    return {{std::move(update_fn)}};
+}}
+
+}} // anonymous namespace
+
+"""
+
+sharded_file_template = """
+{generated_mark}
+
+{prelude}
+
+{shard_fn_decls}
+
+namespace {{
+
+/**
+* Create all entities, return a callable guard that can be called to update all entities.
+* If the returned guard is not called, the guard will call the update function on its destruction.
+* Entities are created by the shards, shards are called in dependency order.
+**/
+[[nodiscard]] pybind11_weaver::CallUpdateGuard {decl_fn_name}(pybind11::module & m, const pybind11_weaver::CustomBindingRegistry & registry){{
+pybind11_weaver::_PointerWrapperBase::FastBind(m);
+{create_warped_pointer_bindings}
+
+    pybind11_weaver::EntityTable entities({entity_num});
+{call_shard_fn_stmts}
+
+    auto update_fn = [entities = std::move(entities)](){{
+        for (auto & entity : entities) {{
+            entity->Update();
+        }}
     }};
-    return {{update_fn}};
+    return {{std::move(update_fn)}};
 }}
 
 }} // anonymous namespace
 
 """
 
+shard_fn_decl_template = """void {shard_fn_name}(pybind11::module & m, const pybind11_weaver::CustomBindingRegistry & registry, pybind11_weaver::EntityTable & entities)"""
+
+lazy_file_template = """
+{generated_mark}
+
+{prelude}
+
+namespace {{
+
+using pybind11_weaver::EntityScope;
+using pybind11_weaver::EntityBase;
+
+
+{entity_struct_decls}
+
+{create_group_fn_decl}{{
+{create_entity_var_stmts}
+}}
+
+/**
+* Create entities of the root module and the namespace modules, return a callable guard that can be called to update
+* them.
+* If the returned guard is not called, the guard will call the update function on its destruction.
+* Members of a namespace are created and updated at the first access of its module.
+**/
+[[nodiscard]] pybind11_weaver::CallUpdateGuard {decl_fn_name}(pybind11::module & m, const pybind11_weaver::CustomBindingRegistry & registry){{
+pybind11_weaver::_PointerWrapperBase::FastBind(m);
+{create_warped_pointer_bindings}
+
+    return pybind11_weaver::LazyBinding::Bind(m, registry, {entity_num}, {create_group_fn_name},
+{lazy_group_defs},
+{lazy_module_defs});
+}}
+
+}} // anonymous namespace
+
+"""
+
+lazy_sharded_file_template = """
+{generated_mark}
+
+{prelude}
+
+{shard_fn_decls}
+
+namespace {{
+
+{create_group_fn_decl}{{
+{call_shard_fn_stmts}
+}}
+
+/**
+* Create entities of the root module and the namespace modules, return a callable guard that can be called to update
+* them.
+* If the returned guard is not called, the guard will call the update function on its destruction.
+* Members of a namespace are created and updated at the first access of its module, by the shards.
+**/
+[[nodiscard]] pybind11_weaver::CallUpdateGuard {decl_fn_name}(pybind11::module & m, const pybind11_weaver::CustomBindingRegistry & registry){{
+pybind11_weaver::_PointerWrapperBase::FastBind(m);
+{create_warped_pointer_bindings}
+
+    return pybind11_weaver::LazyBinding::Bind(m, registry, {entity_num}, {create_group_fn_name},
+{lazy_group_defs},
+{lazy_module_defs});
+}}
+
+}} // anonymous namespace
+
+"""
+
+# same as `pybind11_weaver::LazyBinding::CreateFn`
+lazy_create_fn_decl_template = """void {fn_name}(int group, pybind11::module & m, const pybind11_weaver::CustomBindingRegistry & registry, pybind11_weaver::EntityTable & entities)"""
+
+shard_file_template = """
+{generated_mark}
+
+{prelude}
+
+namespace {{
+
+using pybind11_weaver::EntityScope;
+using pybind11_weaver::EntityBase;
+
+
+{entity_struct_decls}
+
+}} // anonymous namespace
+
+/**
+* Create entities of shard {shard_id}, the created entities will be put into `entities`.
+**/
+{shard_fn_decl}{{
+{create_entity_var_stmts}
+}}
+
+"""
+
+
+class _ScheduleNode:
+    def __init__(self, entity: entity_base.Entity, parent: Optional["_ScheduleNode"], index: int):
+        self.entity = entity
+        self.parent = parent
+        self.index = index  # index in sorted keys of the scope
+        self.pass_num = 0  # in which pass of the scope it could be generated, if scope is scanned repeatedly
+        self.path: Tuple[Tuple[int, int], ...] = ()
+        self.dependents: List[_ScheduleNode] = []
+        self.pending = 0
+
+
+def schedule_entities(entities: Dict[str, entity_base.Entity],
+                      generated_entities: Dict[str, entity_base.Entity]) -> List[
+    Tuple[entity_base.Entity, Optional[entity_base.Entity]]]:
+    """Order entities and their children recursively, so that parent and dependency are always ahead.
+
+    Kahn's algorithm is used, dependencies are resolved by reference name across all scopes. Entities are ordered
+    in depth first order, siblings are ordered by name, an entity whose dependency is a later sibling is delayed
+    after that sibling.
+
+    Args:
+        generated_entities: entities generated before, dependency on them is treated as resolved.
+
+    Returns:
+        A list of [entity, parent entity or None]
+    """
+    nodes: List[_ScheduleNode] = []
+
+    def collect(scope: Dict[str, entity_base.Entity], parent: Optional[_ScheduleNode]):
+        for i, key in enumerate(sorted(scope.keys())):
+            node = _ScheduleNode(scope[key], parent, i)
+            nodes.append(node)
+            collect(node.entity.children, node)
+
+    collect(entities, None)
+    by_ref_name: Dict[str, _ScheduleNode] = dict()
+    for node in nodes:
+        by_ref_name.setdefault(node.entity.reference_name(), node)
+
+    deps: Dict[int, List[_ScheduleNode]] = dict()
+    for node in nodes:
+        deps[id(node)] = []
+        if node.parent is not None:
+            node.parent.dependents.append(node)
+            node.pending += 1
+        for d in node.entity.dependency():
+            if d in generated_entities:
+                continue
+            if d not in by_ref_name:
+                _logger.warning(f"Dependency `{d}` of `{node.entity.reference_name()}` is not generated, ignored")
+                continue
+            dep_node = by_ref_name[d]
+            dep_node.dependents.append(node)
+            node.pending += 1
+            deps[id(node)].append(dep_node)
+
+    def on_ready(node: _ScheduleNode):
+        # emulate scanning the scope pass by pass: a dependency on a later sibling delays it to the next pass
+        for d in deps[id(node)]:
+            if d.parent is node.parent:
+                node.pass_num = max(node.pass_num, d.pass_num + (1 if d.index > node.index else 0))
+        parent_path = () if node.parent is None else node.parent.path
+        node.path = parent_path + ((node.pass_num, node.index),)
+        heapq.heappush(ready, (node.path, id(node), node))
+
+    ready = []
+    for node in nodes:
+        if node.pending == 0:
+            on_ready(node)
+    ordered = []
+    while len(ready) > 0:
+        _, _, node = heapq.heappop(ready)
+        ordered.append((node.entity, None if node.parent is None else node.parent.entity))
+        for dependent in node.dependents:
+            dependent.pending -= 1
+            if dependent.pending == 0:
+                on_ready(dependent)
+
+    if len(ordered) != len(nodes):
+        blocked = [f"{node.entity.reference_name()} (waits for {[d.entity.reference_name() for d in deps[id(node)]]})"
+                   for node in nodes if node.pending > 0]
+        raise RuntimeError(f"Circular dependency found among entities: {', '.join(blocked)}")
+    return ordered
+
+
+class LazyGroup:
+    """Entities that are created and updated together, see `pybind11_weaver::LazyGroupDef`."""
+
+    def __init__(self, begin: int, end: int):
+        self.begin = begin
+        self.end = end
+        self.deps: List[int] = []
+
+    def cpp_def(self) -> str:
+        return f"{{{self.begin},{self.end},{{{','.join(str(d) for d in self.deps)}}}}}"
+
+
+class LazyNamespaces:
+    """Groups of entities and the namespace modules that load them, when namespaces are bound lazily.
+
+    Group 0 is the root module, it also contains all the namespace entities.
+    """
+
+    def __init__(self):
+        self.groups: List[LazyGroup] = []
+        self.modules: List[Tuple[int, int]] = []  # [namespace entity, group of its members]
+
+    def cpp_defs(self) -> Tuple[str, str]:
+        """Initializers of `std::vector<LazyGroupDef>` and `std::vector<LazyModuleDef>`."""
+        groups = ",\n".join(group.cpp_def() for group in self.groups)
+        modules = ",\n".join(f"{{{entity},{group}}}" for entity, group in self.modules)
+        return f"{{\n{groups}\n}}", f"{{\n{modules}\n}}"
+
+
+def _strongly_connected(edges: List[List[int]]) -> List[List[int]]:
+    """Tarjan's algorithm, a component is returned after the components it has edges to."""
+    num = len(edges)
+    index = [-1] * num
+    low = [0] * num
+    on_stack = [False] * num
+    stack = []
+    components = []
+    counter = 0
+    for root in range(num):
+        if index[root] != -1:
+            continue
+        work = [(root, 0)]  # emulate the recursion, [node, next edge to visit]
+        while len(work) > 0:
+            v, i = work.pop()
+            if i == 0:
+                index[v] = low[v] = counter
+                counter += 1
+                stack.append(v)
+                on_stack[v] = True
+            recursed = False
+            for j in range(i, len(edges[v])):
+                w = edges[v][j]
+                if index[w] == -1:
+                    work.append((v, j + 1))
+                    work.append((w, 0))
+                    recursed = True
+                    break
+                if on_stack[w]:
+                    low[v] = min(low[v], index[w])
+            if recursed:
+                continue
+            if low[v] == index[v]:
+                component = []
+                while True:
+                    w = stack.pop()
+                    on_stack[w] = False
+                    component.append(w)
+                    if w == v:
+                        break
+                components.append(sorted(component))
+            if len(work) > 0:
+                caller = work[-1][0]
+                low[caller] = min(low[caller], low[v])
+    return components
+
+
+def group_lazy_namespaces(ordered: List[Tuple[entity_base.Entity, Optional[entity_base.Entity]]], beg_id: int,
+                          lazy: LazyNamespaces) -> List[Tuple[entity_base.Entity, Optional[entity_base.Entity]]]:
+    """Split the scheduled entities into lazy groups, and reorder them so that every group is contiguous.
+
+    Members of a namespace are a group, except the nested namespaces, which are in group 0 together with the entities
+    of the root module. A group depends on the groups of the dependencies and used types of its members, groups depend
+    on each other are merged, so the order of groups is still a valid creation order.
+
+    Returns:
+        The reordered entities, whose ids start from `beg_id`. Groups and modules are put into `lazy`.
+    """
+    base_of: Dict[int, int] = dict()  # the namespace whose members an entity belongs to, 0 is the root module
+    members_base: Dict[int, int] = dict()  # base of the members of a namespace
+    by_ref_name: Dict[str, entity_base.Entity] = dict()
+    for entity, parent in ordered:
+        if isinstance(entity, namespace.NamespaceEntity) or parent is None:
+            base_of[id(entity)] = 0
+        elif isinstance(parent, namespace.NamespaceEntity):
+            # namespaces without members have no group
+            base_of[id(entity)] = members_base.setdefault(id(parent), len(members_base) + 1)
+        else:
+            base_of[id(entity)] = base_of[id(parent)]
+        by_ref_name.setdefault(entity.reference_name(), entity)
+
+    edges = [set() for _ in range(len(members_base) + 1)]
+    for entity, _ in ordered:
+        base = base_of[id(entity)]
+        if base != 0:
+            edges[base].add(0)  # the namespace module
+        for ref in entity.dependency() + entity.used_types():
+            dep = by_ref_name.get(ref, None)
+            if dep is not None and base_of[id(dep)] != base:
+                edges[base].add(base_of[id(dep)])
+
+    components = _strongly_connected([sorted(e) for e in edges])
+    rank_of = [0] * len(edges)
+    for rank, component in enumerate(components):
+        for base in component:
+            rank_of[base] = rank
+    # groups are numbered in dependency order, except that the root module is always group 0
+    root_rank = rank_of[0]
+    group_of_rank = [0 if rank == root_rank else rank + (1 if rank < root_rank else 0)
+                     for rank in range(len(components))]
+
+    order = sorted(range(len(ordered)), key=lambda i: (rank_of[base_of[id(ordered[i][0])]], i))
+    reordered = [ordered[i] for i in order]
+    lazy.groups = [LazyGroup(beg_id, beg_id) for _ in components]
+    entity_ids: Dict[int, int] = dict()
+    for i, (entity, _) in enumerate(reordered):
+        entity_ids[id(entity)] = beg_id + i
+        group = lazy.groups[group_of_rank[rank_of[base_of[id(entity)]]]]
+        if group.begin == group.end:
+            group.begin = beg_id + i
+        group.end = beg_id + i + 1
+    for rank, component in enumerate(components):
+        deps = {group_of_rank[rank_of[dep]] for base in component for dep in edges[base]}
+        lazy.groups[group_of_rank[rank]].deps = sorted(deps - {group_of_rank[rank]})
+    for entity, _ in reordered:
+        if id(entity) in members_base:
+            group_id = group_of_rank[rank_of[members_base[id(entity)]]]
+            if group_id != 0:  # members of group 0 are loaded already
+                lazy.modules.append((entity_ids[id(entity)], group_id))
+    return reordered
+
+
+def _lazy_create_stmts(create_entity_var_stmts: List[str], groups: List[LazyGroup], begin: int, end: int) -> str:
+    """Statements of a `pybind11_weaver::LazyBinding::CreateFn`, which create the entities in [begin, end) of the
+    group."""
+    cases = []
+    for group_id, group in enumerate(groups):
+        group_begin, group_end = max(group.begin, begin), min(group.end, end)
+        if group_begin < group_end:
+            cases.append(f"case {group_id}:\n" + "\n".join(create_entity_var_stmts[group_begin:group_end]) + "\nbreak;")
+    return "switch (group) {\n" + "\n".join(cases) + "\ndefault:\nbreak;\n}"
+
+
+def _location_str(cursor: cindex.Cursor) -> str:
+    location = cursor.location
+    if location.file is None:
+        return ""
+    return f"{location.file.name}:{location.line}"
+
 
 def gen_binding_codes(entities: Dict[str, entity_base.Entity], parent_sym: str, beg_id: int,
-                      generated_entities: Dict[str, entity_base.Entity]):
+                      generated_entities: Dict[str, entity_base.Entity], emit_struct_decl: Callable[[str], None],
+                      table_sym: str = "entities", lazy: Optional[LazyNamespaces] = None):
+    """Generate binding codes for entities and their children recursively.
+
+    The struct decl of every entity is passed to `emit_struct_decl` as soon as it is generated, so the decls, which
+    are the bulk of the output, are never held all together. Decls are emitted in creation order, and the returned
+    create_entity_var_stmts are in the same order, the i-th item is for the i-th emitted entity.
+
+    Args:
+        table_sym: name of the `pybind11_weaver::EntityTable` that entities will be stored in, they are updated in
+            the order of the table.
+        lazy: if provided, namespaces are bound lazily, entities are split into groups by `group_lazy_namespaces`,
+            which are put into it.
+    """
     next_id = beg_id
-    entity_struct_decls: List[str] = []
     create_entity_var_stmts: List[str] = []
-    update_entity_var_stmts: List[str] = []
     exported_type: List[str] = []
-    sorted_keys = sorted(entities.keys())
-    used_keys = set()
-    while len(used_keys) != len(sorted_keys):
-        for key in sorted_keys:
-            entity = entities[key]
-            bypass = False
-            for d in entity.dependency():
-                if d not in generated_entities:
-                    bypass = True
-            if bypass:
-                continue
-            if key in used_keys:
-                continue
-            used_keys.add(key)
-            generated_entities[entity.reference_name()] = entity
-            assert entity is not None
-            if isinstance(entity, klass.ClassEntity) or isinstance(entity, enum.EnumEntity):
-                exported_type.append(common.safe_type_reference(common.remove_const_ref_pointer(entity.cursor.type)))
-            entity_obj_sym = f"v{next_id}"
-            entity_struct_name = "Entity_" + entity.get_pb11weaver_struct_name()
-            # generate body
-            struct_decl = entity_template.format(
-                handle_type=entity.default_pybind11_type_str(),
-                entity_struct_name=entity_struct_name,
-                bind_struct_name="Bind_" + entity.get_pb11weaver_struct_name(),
-                parent_expr=parent_sym,
-                init_handle_expr=entity.init_default_pybind11_value("parent_h"),
-                binding_stmts="\n".join(entity.update_stmts("handle")),
-                unique_struct_key=f"\"{entity.get_pb11weaver_struct_name()}\"",
-                extra_code=entity.extra_code(),
-                top_level_extra=entity.top_level_extra_code())
-            entity_struct_decls.append(struct_decl)
-
-            # generate decl
-            create_entity_var_stmts.append(
-                f"auto {entity_obj_sym} = pybind11_weaver::CreateEntity<{entity_struct_name}>({parent_sym}, registry);")
-
-            # generate updates
-            update_entity_var_stmts.append(f"{entity_obj_sym}->Update();")
-
-            # recursive call to children
-            ret = gen_binding_codes(entities[entity.name].children, entity_obj_sym + "->AsScope()", next_id + 1,
-                                    generated_entities)
-            entity_struct_decls += ret[0]
-            create_entity_var_stmts += ret[1]
-            update_entity_var_stmts += ret[2]
-            exported_type += ret[3]
-            next_id = ret[4]
-
-    return entity_struct_decls, create_entity_var_stmts, update_entity_var_stmts, exported_type, next_id
-
-
-def gen_code(config_file: str):
-    gus = gen_unit.load_all_gu(config_file)
-    for gu in gus:
-        # load entities
-        entity_root = entity_tree.EntityTree(gu)
-        target_entities = entity_root.entities
-        if gu.io_config.root_module_namespace != "":
-            ns_s = gu.io_config.root_module_namespace.split("::")
-            for ns in ns_s:
-                target_entities = target_entities[ns].children
-        generated_entities = dict()
-        entity_struct_decls, create_entity_var_stmts, update_entity_var_stmts, exported_type, _ = gen_binding_codes(
-            entities=target_entities,
-            parent_sym="EntityScope(m)", beg_id=0, generated_entities=generated_entities)
+    entity_syms: Dict[int, str] = dict()
+    prof = profiler.current()
+    with prof.phase("schedule"):
+        ordered = schedule_entities(entities, generated_entities)
+        if lazy is not None:
+            ordered = group_lazy_namespaces(ordered, beg_id, lazy)
+    for entity, parent in ordered:
+        begin = time.perf_counter()
+        generated_entities[entity.reference_name()] = entity
+        if isinstance(entity, klass.ClassEntity) or isinstance(entity, enum.EnumEntity):
+            exported_type.append(common.safe_type_reference(common.remove_const_ref_pointer(entity.cursor.type)))
+        entity_obj_sym = f"{table_sym}[{next_id}]"
+        entity_syms[id(entity)] = entity_obj_sym
+        next_id += 1
+        scope_sym = parent_sym if parent is None else entity_syms[id(parent)] + "->AsScope()"
+        entity_struct_name = "Entity_" + entity.get_pb11weaver_struct_name()
+        # generate body
+        struct_decl = entity_template.format(
+            handle_type=entity.default_pybind11_type_str(),
+            entity_struct_name=entity_struct_name,
+            bind_struct_name="Bind_" + entity.get_pb11weaver_struct_name(),
+            parent_expr=scope_sym,
+            init_handle_expr=entity.init_default_pybind11_value("parent_h"),
+            binding_stmts="\n".join(entity.update_stmts("handle")),
+            unique_struct_key=f"\"{entity.get_pb11weaver_struct_name()}\"",
+            extra_code=entity.extra_code(),
+            top_level_extra=entity.top_level_extra_code())
+        emit_struct_decl(struct_decl)
+
+        # generate decl
+        create_entity_var_stmts.append(
+            f"{entity_obj_sym} = pybind11_weaver::CreateEntity<{entity_struct_name}>({scope_sym}, registry);")
+
+        kind = type(entity).__name__
+        prof.counters[f"entities.{kind}"] += 1
+        prof.add_entity(time.perf_counter() - begin, kind, entity.reference_name(), _location_str(entity.cursor))
+
+    return create_entity_var_stmts, exported_type, next_id
+
+
+prelude_header_template = """
+// GENERATED PRELUDE, INCLUDED BY ALL GENERATED FILES OF `{output}`
+
+#pragma once
+
+{include_directives}
+
+#include <pybind11_weaver/pybind11_weaver.h>
+"""
+
+
+def _pybind11_weaver_header_path() -> str:
+    return os.path.dirname(os.path.abspath(__file__)) + "/include/pybind11_weaver/pybind11_weaver.h"
+
+
+def gen_prelude(gu: gen_unit.GenUnit) -> str:
+    """Return the code that every generated file should start with.
+
+    By default, it is the input include directives and the full text of pybind11_weaver.h. When `prelude_header` is
+    set, these contents are moved into the prelude header (see `gen_prelude_header`), and only an include of the
+    prelude header is returned.
+    """
+    io_cfg = gu.io_config
+    if not io_cfg.prelude_header:
+        with open(_pybind11_weaver_header_path(), "r") as f:
+            return "\n".join(gu.include_directives()) + "\n\n" + f.read()
+    rel_path = os.path.relpath(os.path.abspath(io_cfg.prelude_header),
+                               os.path.dirname(os.path.abspath(io_cfg.output)))
+    return f'#include "{rel_path}"'
+
+
+def gen_prelude_header(gu: gen_unit.GenUnit) -> str:
+    return prelude_header_template.format(output=os.path.basename(gu.io_config.output),
+                                          include_directives="\n".join(gu.include_directives()))
+
+
+def shard_output_path(output: str, shard_id: int) -> str:
+    return f"{output}.shard{shard_id}.cc"
+
+
+def unit_outputs(io_cfg: config.IOConfig) -> List[str]:
+    """Files generated for the io_config in writing order, the depfile excluded."""
+    paths = [io_cfg.prelude_header] if io_cfg.prelude_header else []
+    if io_cfg.output_shards > 1:
+        paths += [shard_output_path(io_cfg.output, shard_id) for shard_id in range(io_cfg.output_shards)]
+    return paths + [io_cfg.output]
+
+
+def is_unit_up_to_date(io_cfg: config.IOConfig) -> bool:
+    """Up-to-date according to the depfile, and none of the generated files is missing."""
+    if not (io_cfg.depfile and depfile.is_up_to_date(io_cfg.depfile, io_cfg.output)):
+        return False
+    # the other files may keep their old mtime when unchanged, so only their existence is checked
+    return all(os.path.exists(path) for path in unit_outputs(io_cfg))
+
+
+def _split_shards(sizes: List[int], shard_num: int) -> List[int]:
+    """Split items into `shard_num` contiguous shards by size, return the shard id of each item."""
+    total = max(sum(sizes), 1)
+    shard_ids = []
+    accumulated = 0
+    for size in sizes:
+        # put the item into the shard where its middle point falls
+        shard_ids.append(min(shard_num - 1, (2 * accumulated + size) * shard_num // (2 * total)))
+        accumulated += size
+    return shard_ids
+
+
+def _format_code(content: str) -> str:
+    # format code if clang-format found
+    if shutil.which("clang-format") is None:
+        return content
+    with profiler.current().phase("clang_format"):
+        result = subprocess.run(["clang-format", "--style=LLVM"], input=content, capture_output=True, text=True)
+    if result.returncode != 0:
+        _logger.warning(f"clang-format failed, code is not formatted: {result.stderr}")
+        return content
+    return result.stdout
+
+
+def _generated_mark(gu: gen_unit.GenUnit) -> str:
+    if gu.io_config.reproducible:
+        return "// GENERATED BY PYBIND11 WEAVER, DO NOT EDIT"
+    return f"// GENERATED AT {gu.creation_time}"
+
+
+def render_unit(io_cfg: config.IOConfig) -> Dict[str, str]:
+    """Generate all files of the io_config in memory, nothing is written to disk.
+
+    The unit runs in a fresh run state, so the output does not depend on which units ran before it, and units
+    rendered in different threads do not interfere.
+
+    Returns:
+        A dict of {path: content} in writing order, includes the prelude header, the shards, the output and the
+        depfile, if they are configured.
+    """
+    with run_state.new_run():
+        gu = gen_unit.GenUnit(io_cfg)
+        try:
+            return render_gen_unit(gu)
+        finally:
+            gu.dispose()
+
+
+class _StructDeclSpill:
+    """Entity struct decls, spilled to an anonymous temporary file as soon as they are generated.
+
+    Decls are read back one by one when the outputs are written, so at most one decl is held in memory.
+    """
+
+    def __init__(self):
+        self._file = tempfile.TemporaryFile()
+        self._offsets = [0]
+        self.sizes: List[int] = []  # in characters, the same as `len` of the decls
+
+    def close(self):
+        self._file.close()
+
+    def append(self, decl: str):
+        data = decl.encode("utf-8")
+        self._file.write(data)
+        self._offsets.append(self._offsets[-1] + len(data))
+        self.sizes.append(len(decl))
+
+    def iter_joined(self, begin: int, end: int) -> Iterator[str]:
+        """Yield `"\\n".join(decls[begin:end])` chunk by chunk."""
+        for i in range(begin, end):
+            if i > begin:
+                yield "\n"
+            self._file.seek(self._offsets[i])
+            yield self._file.read(self._offsets[i + 1] - self._offsets[i]).decode("utf-8")
+
+
+def _join_chunks(head: str, decls: _StructDeclSpill, begin: int, end: int, tail: str) -> Iterator[str]:
+    yield head
+    yield from decls.iter_joined(begin, end)
+    yield tail
+
+
+# [path, chunks_fn, need_format], chunks_fn returns the content of the file chunk by chunk
+_FileStream = Tuple[str, Callable[[], Iterable[str]], bool]
+
+
+def emit_gen_unit(gu: gen_unit.GenUnit) -> Iterator[_FileStream]:
+    """Generate all files of a loaded GenUnit as streams, caller should provide a fresh run state.
+
+    Files are yielded in writing order, `chunks_fn` of a file could be called more than once, but it is only valid
+    until the next file is yielded.
+    """
+    io_cfg = gu.io_config
+    # load entities
+    entity_root = entity_tree.EntityTree(gu)
+    target_entities = entity_root.entities
+    if gu.io_config.root_module_namespace != "":
+        ns_s = gu.io_config.root_module_namespace.split("::")
+        for ns in ns_s:
+            target_entities = target_entities[ns].children
+    sharded = io_cfg.output_shards > 1
+    lazy = LazyNamespaces() if io_cfg.lazy_namespaces else None
+    create_group_fn_name = f"{io_cfg.decl_fn_name}_CreateGroup"
+    generated_entities = dict()
+    with contextlib.closing(_StructDeclSpill()) as decls:
+        with profiler.current().phase("codegen"):
+            create_entity_var_stmts, exported_type, entity_num = gen_binding_codes(
+                entities=target_entities,
+                parent_sym="EntityScope(m)", beg_id=0, generated_entities=generated_entities,
+                emit_struct_decl=decls.append, lazy=lazy)
 
         warn_unexported_types(exported_type)
+        source_cache.log_stats(io_cfg.output)
+        _logger.info(f"Type cache of {io_cfg.output}: {dict(common.get_type_cache_stats())}")
+
+        prelude = gen_prelude(gu)
+        if lazy is not None:
+            lazy_group_defs, lazy_module_defs = lazy.cpp_defs()
+        if io_cfg.prelude_header:
+            yield io_cfg.prelude_header, functools.partial(iter, [gen_prelude_header(gu)]), False
+
+        # gen file, templates are split at the decls, which are streamed from the spill
+        if not sharded and lazy is None:
+            head, tail = file_template.split("{entity_struct_decls}")
+            head = head.format(generated_mark=_generated_mark(gu), prelude=prelude)
+            tail = tail.format(
+                decl_fn_name=gu.io_config.decl_fn_name,
+                create_warped_pointer_bindings=gen_wrapped_pointer_code(),
+                entity_num=entity_num,
+                create_entity_var_stmts="\n".join(create_entity_var_stmts),
+            )
+            yield io_cfg.output, functools.partial(_join_chunks, head, decls, 0, len(decls.sizes), tail), True
+        elif not sharded:
+            head, tail = lazy_file_template.split("{entity_struct_decls}")
+            head = head.format(generated_mark=_generated_mark(gu), prelude=prelude)
+            tail = tail.format(
+                create_group_fn_decl=lazy_create_fn_decl_template.format(fn_name=create_group_fn_name),
+                create_entity_var_stmts=_lazy_create_stmts(create_entity_var_stmts, lazy.groups, 0, entity_num),
+                decl_fn_name=gu.io_config.decl_fn_name,
+                create_warped_pointer_bindings=gen_wrapped_pointer_code(),
+                entity_num=entity_num,
+                create_group_fn_name=create_group_fn_name,
+                lazy_group_defs=lazy_group_defs,
+                lazy_module_defs=lazy_module_defs,
+            )
+            yield io_cfg.output, functools.partial(_join_chunks, head, decls, 0, len(decls.sizes), tail), True
+        else:
+            shard_ids = _split_shards(decls.sizes, io_cfg.output_shards)
+            shard_fn_decls = []
+            call_shard_fn_stmts = []
+            begin = 0
+            for shard_id in range(io_cfg.output_shards):
+                shard_fn_name = f"{io_cfg.decl_fn_name}_Shard{shard_id}"
+                end = bisect.bisect_right(shard_ids, shard_id)  # shards are contiguous
+                if lazy is None:
+                    shard_fn_decl = shard_fn_decl_template.format(shard_fn_name=shard_fn_name)
+                    call_shard_fn_stmts.append(f"{shard_fn_name}(m, registry, entities);")
+                    shard_create_stmts = "\n".join(create_entity_var_stmts[begin:end])
+                else:
+                    shard_fn_decl = lazy_create_fn_decl_template.format(fn_name=shard_fn_name)
+                    call_shard_fn_stmts.append(f"{shard_fn_name}(group, m, registry, entities);")
+                    shard_create_stmts = _lazy_create_stmts(create_entity_var_stmts, lazy.groups, begin, end)
+                shard_fn_decls.append(shard_fn_decl + ";")
+                head, tail = shard_file_template.split("{entity_struct_decls}")
+                head = head.format(generated_mark=_generated_mark(gu), prelude=prelude)
+                tail = tail.format(
+                    shard_id=shard_id,
+                    shard_fn_decl=shard_fn_decl,
+                    create_entity_var_stmts=shard_create_stmts,
+                )
+                yield (shard_output_path(io_cfg.output, shard_id),
+                       functools.partial(_join_chunks, head, decls, begin, end, tail), True)
+                begin = end
+            if lazy is None:
+                file_content = sharded_file_template.format(
+                    generated_mark=_generated_mark(gu),
+                    prelude=prelude,
+                    shard_fn_decls="\n".join(shard_fn_decls),
+                    decl_fn_name=gu.io_config.decl_fn_name,
+                    create_warped_pointer_bindings=gen_wrapped_pointer_code(),
+                    entity_num=entity_num,
+                    call_shard_fn_stmts="\n".join(call_shard_fn_stmts),
+                )
+            else:
+                file_content = lazy_sharded_file_template.format(
+                    generated_mark=_generated_mark(gu),
+                    prelude=prelude,
+                    shard_fn_decls="\n".join(shard_fn_decls),
+                    create_group_fn_decl=lazy_create_fn_decl_template.format(fn_name=create_group_fn_name),
+                    call_shard_fn_stmts="\n".join(call_shard_fn_stmts),
+                    decl_fn_name=gu.io_config.decl_fn_name,
+                    create_warped_pointer_bindings=gen_wrapped_pointer_code(),
+                    entity_num=entity_num,
+                    create_group_fn_name=create_group_fn_name,
+                    lazy_group_defs=lazy_group_defs,
+                    lazy_module_defs=lazy_module_defs,
+                )
+            yield io_cfg.output, functools.partial(iter, [file_content]), True
+
+    if io_cfg.depfile:
+        deps = set(gu.dependencies())
+        deps.add(_pybind11_weaver_header_path())
+        if io_cfg._config_file:
+            deps.add(io_cfg._config_file)
+        # written at last, its mtime is used as the stamp of the generation
+        yield io_cfg.depfile, functools.partial(iter, [depfile.format_depfile(io_cfg.output, sorted(deps))]), False
+
+
+def render_gen_unit(gu: gen_unit.GenUnit) -> Dict[str, str]:
+    """Same as `render_unit`, but from a loaded GenUnit. Caller should provide a fresh run state."""
+    files: Dict[str, str] = dict()
+    for path, chunks_fn, need_format in emit_gen_unit(gu):
+        content = "".join(chunks_fn())
+        files[path] = _format_code(content) if need_format else content
+    return files
+
+
+def _keep_unchanged(io_cfg: config.IOConfig, path: str, only_changed: bool) -> bool:
+    return path != io_cfg.depfile and (only_changed or io_cfg.reproducible or path == io_cfg.prelude_header)
+
+
+def write_unit(io_cfg: config.IOConfig, files: Dict[str, str], only_changed: bool = False) -> List[str]:
+    """Write the files returned by `render_unit`, return the paths written.
+
+    Files are replaced atomically, so a build running concurrently never sees a partially written file.
+
+    Args:
+        only_changed: skip the files whose content on disk is the same, it is implied by `reproducible` of the
+            io_config. The prelude header is always skipped when unchanged, so the precompiled header would not be
+            invalidated. The depfile is always written, since its mtime is the stamp of the generation.
+    """
+    written = []
+    for path, content in files.items():
+        if _keep_unchanged(io_cfg, path, only_changed):
+            if atomic_file.write_text_if_changed(path, content):
+                written.append(path)
+        else:
+            atomic_file.write_text(path, content)
+            written.append(path)
+    return written
+
+
+def _stream_clang_format(chunks: Iterable[str], out: TextIO) -> bool:
+    """Pipe chunks through clang-format into `out`, return False if clang-format failed."""
+    out.flush()
+    proc = subprocess.Popen(["clang-format", "--style=LLVM"], stdin=subprocess.PIPE, stdout=out,
+                            stderr=subprocess.PIPE, text=True)
+    try:
+        for chunk in chunks:
+            proc.stdin.write(chunk)
+        proc.stdin.close()
+    except BrokenPipeError:  # clang-format exited early, its error is reported below
+        with contextlib.suppress(BrokenPipeError):
+            proc.stdin.close()
+    stderr = proc.stderr.read()
+    proc.stderr.close()
+    if proc.wait() != 0:
+        _logger.warning(f"clang-format failed, code is not formatted: {stderr}")
+        return False
+    return True
+
+
+def _write_chunks(chunks_fn: Callable[[], Iterable[str]], need_format: bool, path: str):
+    with open(path, "w") as f:
+        if need_format and shutil.which("clang-format") is not None:
+            with profiler.current().phase("clang_format"):
+                if _stream_clang_format(chunks_fn(), f):
+                    return
+            f.seek(0)
+            f.truncate()
+        f.writelines(chunks_fn())
+
+
+def write_gen_unit(gu: gen_unit.GenUnit, only_changed: bool = False) -> Dict[str, bool]:
+    """Generate and write all files of a loaded GenUnit, caller should provide a fresh run state.
+
+    Unlike `render_gen_unit`, contents are streamed through clang-format into the files, so the memory used does not
+    grow with the size of the output. See `write_unit` for `only_changed`.
+
+    Returns:
+        A dict of {path: whether written} in writing order.
+    """
+    io_cfg = gu.io_config
+    written = dict()
+    for path, chunks_fn, need_format in emit_gen_unit(gu):
+        with profiler.current().phase("write"):
+            written[path] = atomic_file.atomic_write(path, functools.partial(_write_chunks, chunks_fn, need_format),
+                                                     only_changed=_keep_unchanged(io_cfg, path, only_changed))
+    return written
+
+
+def _gen_one_unit(io_cfg: config.IOConfig, profile_top: int = 20) -> Dict:
+    """Generate and write one unit, return the profile report of the unit."""
+    begin = time.perf_counter()
+    with run_state.new_run():
+        prof = profiler.current()
+        gu = gen_unit.GenUnit(io_cfg)
+        try:
+            write_gen_unit(gu)
+        finally:
+            gu.dispose()
+        return dict(output=io_cfg.output, seconds=time.perf_counter() - begin, peak_rss_kb=profiler.peak_rss_kb(),
+                    **prof.report(profile_top))
+
+
+class _RecordCollector(logging.Handler):
+    """Keep log records in memory, so that a worker's logs can be replayed by the parent process."""
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records: List[logging.LogRecord] = []
+
+    def emit(self, record: logging.LogRecord):
+        # make the record picklable
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        self.records.append(record)
+
+
+def run_in_worker(task: Callable[[config.IOConfig], Any], io_cfg: config.IOConfig) -> Tuple[
+    bool, Any, List[logging.LogRecord], str]:
+    """Run task on one unit in a worker process, return [success, result, log_records, stdout].
+
+    Logs and stdout are kept, so that they could be replayed by the parent process with `replay_worker_output`.
+    """
+    collector = _RecordCollector()
+    root_logger = logging.getLogger()
+    root_logger.addHandler(collector)
+    stdout = io.StringIO()
+    success = True
+    result = None
+    try:
+        with contextlib.redirect_stdout(stdout):
+            result = task(io_cfg)
+    except Exception:
+        _logger.exception(f"Failed to generate `{io_cfg.output}`")
+        success = False
+    finally:
+        root_logger.removeHandler(collector)
+    return success, result, collector.records, stdout.getvalue()
+
+
+def replay_worker_output(records: List[logging.LogRecord], stdout: str):
+    sys.stdout.write(stdout)
+    for record in records:
+        logging.getLogger(record.name).handle(record)
+
+
+def gen_code(config_file: str, jobs: Optional[int] = None, check_uptodate: bool = False, profile_file: str = "",
+             profile_top: int = 20) -> int:
+    """Generate code for all io_configs in the config file, return the number of failed units.
+
+    Args:
+        config_file: path to the config file, or the content of the config file.
+        jobs: number of worker processes, default to `common_config.jobs`, non-positive value means all cpus.
+        check_uptodate: only generate the io_configs that are not up-to-date according to their depfile.
+        profile_file: when set, a json report of the time and peak RSS of every phase will be written to it.
+        profile_top: number of the slowest entities listed in the report of each unit.
+
+    """
+    begin = time.perf_counter()
+    unit_reports: List[Dict] = []
+    with run_state.new_run():
+        try:
+            return _gen_all_units(config_file, jobs, check_uptodate, profile_top, unit_reports)
+        finally:
+            if profile_file:
+                report = dict(seconds=time.perf_counter() - begin, peak_rss_kb=profiler.peak_rss_kb(),
+                              **profiler.current().report(profile_top), units=unit_reports)
+                with open(profile_file, "w") as f:
+                    json.dump(report, f, indent=2)
+
+
+def _gen_all_units(config_file: str, jobs: Optional[int], check_uptodate: bool, profile_top: int,
+                   unit_reports: List[Dict]) -> int:
+    with profiler.current().phase("load_config"):
+        main_cfg = config.MainConfig.load(config_file)
+    io_cfgs = main_cfg.io_configs
+    if check_uptodate:
+        io_cfgs = [io_cfg for io_cfg in io_cfgs if not is_unit_up_to_date(io_cfg)]
+        if len(io_cfgs) == 0:
+            _logger.info("All outputs are up-to-date")
+            return 0
+    if jobs is None:
+        jobs = main_cfg.common_config.jobs
+    if jobs <= 0:
+        jobs = os.cpu_count()
+    jobs = min(jobs, len(io_cfgs))
 
-        # load pybind11_weaver_header
-        pybind11_weaver_header_path = os.path.dirname(
-            os.path.abspath(__file__)) + "/include/pybind11_weaver/pybind11_weaver.h"
-        with open(pybind11_weaver_header_path, "r") as f:
-            pybind11_weaver_header = f.read()
-
-        # gen file
-        file_content = file_template.format(
-            date=gu.creation_time,
-            include_directives="\n".join(gu.include_directives()),
-            pybind11_weaver_header=pybind11_weaver_header,
-            decl_fn_name=gu.io_config.decl_fn_name,
-            entity_struct_decls="\n".join(entity_struct_decls),
-            create_warped_pointer_bindings=gen_wrapped_pointer_code(),
-            create_entity_var_stmts="\n".join(create_entity_var_stmts),
-            update_entity_var_stmts="\n".join(update_entity_var_stmts),
-        )
-        with open(gu.io_config.output, "w") as f:
-            f.write(file_content)
-
-        # format file if clang-format found
-        if shutil.which("clang-format") is not None:
-            os.system(f"clang-format -i {gu.io_config.output} --style=LLVM")
+    failed = 0
+    if jobs == 1:
+        for io_cfg in io_cfgs:
+            try:
+                unit_reports.append(_gen_one_unit(io_cfg, profile_top))
+            except Exception:
+                _logger.exception(f"Failed to generate `{io_cfg.output}`")
+                failed += 1
+    else:
+        task = functools.partial(run_in_worker, functools.partial(_gen_one_unit, profile_top=profile_top))
+        # a fresh process for every unit, so the memory of a unit is returned to OS as soon as it is done
+        with multiprocessing.Pool(processes=jobs, maxtasksperchild=1) as pool:
+            # results are consumed in the order of io_configs, which keeps the merged logs deterministic
+            for success, unit_report, records, stdout in pool.imap(task, io_cfgs):
+                replay_worker_output(records, stdout)
+                if not success:
+                    failed += 1
+                else:
+                    unit_reports.append(unit_report)
+    if failed:
+        _logger.error(f"{failed} of {len(io_cfgs)} units failed")
+    return failed
 
 
 def gen_wrapped_pointer_code() -> str:
@@ -1,16 +1,87 @@
 __all__ = [
     "GenUnit",
+    "ParseError",
     "load_all_gu"
 ]
 
+import collections
 import datetime
-import functools
-from typing import List, Tuple
+import hashlib
+import os
+import tempfile
+import threading
+from typing import Dict, List, Set, Tuple
 
 from pylibclang import cindex
 
 from pybind11_weaver import config
-from pybind11_weaver.utils import common
+from pybind11_weaver.utils import common, profiler, tu_cache
+
+
+# Preamble is the leading preprocessor directives of the main file, it must be followed by some token to be reused.
+_PREAMBLE_END = 'static_assert(true, "end of preamble");'
+
+# CXTranslationUnit_CreatePreambleOnFirstParse, which is not exposed by cindex
+_PARSE_CREATE_PREAMBLE_ON_FIRST_PARSE = 0x100
+
+_PARSE_OPTIONS = cindex.TranslationUnit.PARSE_PRECOMPILED_PREAMBLE | _PARSE_CREATE_PREAMBLE_ON_FIRST_PARSE
+
+_tmp_dir = None
+_tmp_dir_lock = threading.Lock()
+
+
+def _main_file_dir() -> str:
+    global _tmp_dir
+    with _tmp_dir_lock:
+        if _tmp_dir is None:
+            _tmp_dir = tempfile.TemporaryDirectory(prefix="pybind11_weaver_")
+    return _tmp_dir.name
+
+
+def _creation_time() -> datetime.datetime:
+    # https://reproducible-builds.org/specs/source-date-epoch/
+    epoch = os.environ.get("SOURCE_DATE_EPOCH", "")
+    if epoch.isdigit():
+        return datetime.datetime.fromtimestamp(int(epoch), tz=datetime.timezone.utc)
+    return datetime.datetime.now()
+
+
+class ParseError(RuntimeError):
+    """The inputs have errors, `dependencies` are the files the failed TU depends on."""
+
+    def __init__(self, message: str, dependencies: List[str]):
+        RuntimeError.__init__(self, message)
+        self.dependencies = dependencies
+
+
+def _dispose_tu(tu: cindex.TranslationUnit):
+    """Dispose the TU now, libclang deletes its preamble file on disposal.
+
+    pylibclang never frees the cursors and types it returns, they keep the TU object alive, so the TU would not be
+    disposed until the process exits normally, and never in a pool worker.
+    """
+    cindex.conf.lib.clang_disposeTranslationUnit(tu)
+    # disposing a null TU is a no-op, so the later `__del__` is safe
+    tu.set_ptr(0)
+
+
+def _tu_dependencies(tu: cindex.TranslationUnit) -> List[str]:
+    return sorted(set(inclusion.include.name for inclusion in tu.get_includes()))
+
+
+class _SuffixMatcher:
+    """Tell whether a string ends with any of the suffixes, suffixes are grouped by length to be matched by hash."""
+
+    def __init__(self, suffixes: List[str]):
+        self._by_len: Dict[int, Set[str]] = collections.defaultdict(set)
+        for suffix in suffixes:
+            self._by_len[len(suffix)].add(suffix)
+
+    def match(self, s: str) -> bool:
+        for length, suffixes in self._by_len.items():
+            if s[len(s) - length:] in suffixes:
+                return True
+        return False
 
 
 class GenUnit:
@@ -20,16 +91,83 @@ class GenUnit:
 
     def __init__(self, io_config: config.IOConfig):
         self.io_config = io_config
-        self._load_tu()
-        self.creation_time: str = datetime.datetime.now().strftime("%m/%d/%Y, %H:%M:%S")
+        self.file_cache_hits = 0
+        self.file_cache_misses = 0
+        self._tu_cache = None
+        if io_config._cache_dir:
+            self._tu_cache = tu_cache.TUCache(os.path.join(io_config._cache_dir, "tu"))
+        with profiler.current().phase("load_tu"):
+            self._load_tu()
+        self.creation_time: str = _creation_time().strftime("%m/%d/%Y, %H:%M:%S")
+
+    def _parse_args(self) -> List[str]:
+        args = ["-x", "c++", "-fparse-all-comments", ] + self.io_config._cxx_flags
+        cwd = os.getcwd()
+        if os.path.realpath(os.path.dirname(self._main_file_path())) != os.path.realpath(cwd):
+            # quoted inputs are searched relative to the main file first, so they could be relative to the working dir
+            args.append(f"-iquote{cwd}")
+        return args
+
+    def _parse_options(self) -> int:
+        options = _PARSE_OPTIONS
+        if self._tu_cache is not None:
+            # libclang crashes when loading an ast file saved from a TU with preamble
+            options = cindex.TranslationUnit.PARSE_NONE
+        if self.io_config.skip_function_bodies:
+            # only declarations are needed, bodies and the instantiations at the end of TU are skipped
+            options |= cindex.TranslationUnit.PARSE_SKIP_FUNCTION_BODIES | cindex.TranslationUnit.PARSE_INCOMPLETE
+        return options
+
+    def _main_file_path(self) -> str:
+        """libclang only builds preamble for a main file that exists on disk, even if its content is unsaved.
+
+        Every unit has its own main file named after its output, so the units parsed concurrently, or sharing a
+        cache dir, never share the preamble and cached AST of one path.
+        """
+        main_dir = _main_file_dir() if self._tu_cache is None else self._tu_cache.cache_dir
+        output = os.path.abspath(self.io_config.output)
+        digest = hashlib.sha256(output.encode("utf-8")).hexdigest()[:16]
+        path = os.path.join(main_dir, f"{os.path.basename(output).split('.')[0]}_{digest}.cpp")
+        if not os.path.exists(path):
+            open(path, "w").close()
+        return path
+
+    def _initial_content(self) -> str:
+        return "\n".join(self.include_directives() + [_PREAMBLE_END])
 
     def _load_tu(self, extra_content: str = ""):
-        content = "\n".join(self.include_directives()) + extra_content
-        unsaved_file = ("tmp.cpp", content)
+        content = self._initial_content() + extra_content
+        unsaved_file = (self._main_file_path(), content)
+        self._from_cache = False
+        if self._tu_cache is not None:
+            self._cache_key = self._tu_cache.make_key(content, self._parse_args() + [str(self._parse_options())])
+            cached = self._tu_cache.load(self._cache_key)
+            if cached is not None:
+                # the cached TU is the final one, which had been reloaded with all extra content
+                self.tu, final_content = cached
+                self.unsaved_file = (self.tu.spelling, final_content)
+                self._from_cache = True
+                self._on_tu_changed()
+                return
+        self._parse(unsaved_file)
+
+    def _parse(self, unsaved_file: Tuple[str, str]):
         index = cindex.Index.create()
         tu = index.parse(unsaved_file[0],
                          unsaved_files=[unsaved_file],
-                         args=["-x", "c++", "-fparse-all-comments", ] + self.io_config._cxx_flags)
+                         args=self._parse_args(),
+                         options=self._parse_options())
+        try:
+            self._check_diagnostics(tu)
+        except ParseError:
+            _dispose_tu(tu)
+            raise
+        self.tu = tu
+        self.unsaved_file = unsaved_file
+        self._on_tu_changed()
+
+    @staticmethod
+    def _check_diagnostics(tu: cindex.TranslationUnit):
         load_fail = False
         for diag in tu.diagnostics:
             print(diag.severity)
@@ -38,11 +176,13 @@ class GenUnit:
             print(diag.option)
             load_fail = True
         if load_fail:
-            raise RuntimeError("Failed to parse the input file.")
-        self.tu = tu
-        self.unsaved_file = unsaved_file
+            raise ParseError("Failed to parse the input file.", _tu_dependencies(tu))
+
+    def _on_tu_changed(self):
+        # CXFile handles are only valid in the TU that created them
+        self._file_in_inputs: Dict[int, bool] = dict()
+        self._input_matcher = _SuffixMatcher(self.include_files() + [self.unsaved_file[0]])
 
-    @functools.cache
     def include_files(self):
         files = []
         for f in self.io_config.inputs:
@@ -51,30 +191,74 @@ class GenUnit:
         return files
 
     def reload_tu(self, new_content: str):
+        if new_content.strip() == "":
+            # nothing changed, and a TU loaded from ast file has already contained all extra content.
+            if self._tu_cache is not None and not self._from_cache:
+                self._tu_cache.save(self._cache_key, self.tu, self.unsaved_file[1])
+            return
         unsaved_file = (self.unsaved_file[0], self.unsaved_file[1] + "\n" + new_content)
+        if self._from_cache:
+            # a TU loaded from ast file could not be reparsed
+            self._parse(unsaved_file)
+            self._from_cache = False
+        else:
+            self.tu.reparse([unsaved_file])
+        self.unsaved_file = unsaved_file
+        self._on_tu_changed()
+        if self._tu_cache is not None:
+            self._tu_cache.save(self._cache_key, self.tu, self.unsaved_file[1])
+
+    def reparse(self):
+        """Parse the inputs again after they changed on disk.
+
+        The TU goes back to its initial content, extra content should be reloaded again. The TU object is reused,
+        so libclang could keep its preamble when the headers in the preamble are unchanged.
+        """
+        unsaved_file = (self.unsaved_file[0], self._initial_content())
+        if self._from_cache:
+            self._parse(unsaved_file)
+            self._from_cache = False
+            return
         self.tu.reparse([unsaved_file])
         self.unsaved_file = unsaved_file
+        self._on_tu_changed()
+        self._check_diagnostics(self.tu)
+
+    def dispose(self):
+        """Dispose the TU, the GenUnit could not be used any more."""
+        if self.tu is not None:
+            _dispose_tu(self.tu)
+            self.tu = None
+
+    def dependencies(self) -> List[str]:
+        """Files on disk that the TU depends on."""
+        return _tu_dependencies(self.tu)
 
     def include_directives(self) -> List[str]:
         return ["#include " + path for path in self.io_config.inputs]
 
     def is_cursor_in_inputs(self, cursor: cindex.Cursor):
-        valid_files = self.include_files() + [self.unsaved_file[0]]
         file = cursor.location.file
         if file is None:
             return False
-        cursor_filename = file.name
-        in_src = False
-        for tail in valid_files:
-            if cursor_filename.endswith(tail):
-                in_src = True
-                break
+        file_key = file.get_ptr()
+        in_src = self._file_in_inputs.get(file_key, None)
+        if in_src is None:
+            self.file_cache_misses += 1
+            in_src = self._input_matcher.match(file.name)
+            self._file_in_inputs[file_key] = in_src
+        else:
+            self.file_cache_hits += 1
         return (in_src
                 and cursor.linkage != cindex.LinkageKind.CXLinkage_Internal
                 and common.is_public(cursor)
                 and common.is_visible(cursor,
                                       self.io_config.strict_visibility_mode))
 
+    def file_cache_hit_rate(self) -> float:
+        total = self.file_cache_hits + self.file_cache_misses
+        return self.file_cache_hits / total if total > 0 else 0.0
+
 
 def load_all_gu(file_or_content: str) -> List[GenUnit]:
     main_cfg = config.MainConfig.load(file_or_content)
@@ -1,11 +1,17 @@
 #ifndef GITHUB_COM_PYBIND11_WEAVER
 #define GITHUB_COM_PYBIND11_WEAVER
 #include <atomic>
+#include <chrono>
+#include <cstdint>
 #include <functional>
-#include <map>
 #include <mutex>
+#include <stdexcept>
+#include <string>
+#include <string_view>
 #include <thread>
+#include <type_traits>
 #include <utility>
+#include <vector>
 
 #include <pybind11/functional.h>
 #include <pybind11/pybind11.h>
@@ -86,59 +92,88 @@ template <typename R, typename... Args> struct FnPointerWrapper {
 
   template <class CR, typename... CArgs> struct GetCptr {
     using CFnPtrT = CR (*)(CArgs...);
+    using ConvertFnT = CR (*)(const std::function<CppFnT> &, CArgs...);
+
+    /**
+     * Every call site passes a captureless lambda as `convert`, its closure
+     * type is unique, so it is used to key a static slot, which holds the
+     * callable while the returned C function pointer is alive.
+     *
+     * The slot is written under a lock, and read by the trampoline with an
+     * atomic load only, so the C callers never lock, allocate or copy.
+     *
+     * The returned pointer is only valid until `guard` is destroyed, i.e.
+     * until the C function it is passed to returns. Every call, from any
+     * thread, must have returned by then, since the callable is reset on
+     * release; a call after release throws std::bad_function_call. Keeping
+     * the callable alive for calls racing the release would need a reference
+     * count (or a lock) on every call, and waiting for them in the release
+     * could deadlock on the GIL.
+     */
+    template <class ConvertT>
     static CFnPtrT Run(std::function<CppFnT> to_call, Guardian &&guard,
-                       CFnPtrT c_wrapper, const char *uuid0, int64_t uuid1) {
-      // lock
+                       ConvertT convert) {
+      SlotOf<ConvertT>::slot.Acquire(std::move(to_call), convert);
       guard.dtor_callbacks.push_back(
-          [uuid0, uuid1]() { ReleaseFnProxy(uuid0, uuid1); });
-      SetFnProxy(uuid0, uuid1, to_call);
-      return c_wrapper;
+          []() { SlotOf<ConvertT>::slot.Release(); });
+      return &Trampoline<ConvertT>;
     }
-  };
 
-  using FnMapT =
-      std::map<const char *, std::map<int64_t, std::function<CppFnT>>>;
-  static void SetFnProxy(const char *uuid0, int64_t uuid1,
-                         std::function<CppFnT> &fn) {
-    FnMapMutex().lock();
-    while (FnMap()[uuid0].count(uuid1) != 0) {
-      // The chance is so low, spin lock should be fine
-      FnMapMutex().unlock();
-      std::this_thread::sleep_for(std::chrono::milliseconds(1));
-      FnMapMutex().lock();
+  private:
+    struct Slot {
+      struct State {
+        std::function<CppFnT> fn;
+        ConvertFnT convert = nullptr;
+      };
+
+      void Acquire(std::function<CppFnT> fn, ConvertFnT convert) {
+        std::unique_lock<std::mutex> lock(mutex);
+        while (busy) {
+          // The chance is so low, spin lock should be fine
+          lock.unlock();
+          std::this_thread::sleep_for(std::chrono::milliseconds(1));
+          lock.lock();
+        }
+        busy = true;
+        state.fn = std::move(fn);
+        state.convert = convert;
+        current.store(&state, std::memory_order_release);
+      }
+
+      void Release() {
+        std::lock_guard<std::mutex> lock(mutex);
+        current.store(nullptr, std::memory_order_release);
+        state.fn = nullptr;
+        busy = false;
+      }
+
+      std::atomic<const State *> current{nullptr};
+      std::mutex mutex;
+      bool busy = false;
+      State state;
+    };
+
+    template <class ConvertT> struct SlotOf {
+      static inline Slot slot;
+    };
+
+    template <class ConvertT> static CR Trampoline(CArgs... args) {
+      auto *state =
+          SlotOf<ConvertT>::slot.current.load(std::memory_order_acquire);
+      if (state == nullptr) {
+        throw std::bad_function_call();
+      }
+      return state->convert(state->fn, std::forward<CArgs>(args)...);
     }
-    FnMap()[uuid0][uuid1] = fn;
-    FnMapMutex().unlock();
-  }
-
-  static std::function<CppFnT> GetFnProxy(const char *uuid0, int64_t uuid1) {
-    std::lock_guard<std::mutex> _(FnMapMutex());
-    auto ret = FnMap()[uuid0][uuid1];
-    return ret;
-  }
-
-  static void ReleaseFnProxy(const char *uuid0, int64_t uuid1) {
-    std::lock_guard<std::mutex> _(FnMapMutex());
-    FnMap()[uuid0].erase(uuid1);
-  }
-  static FnMapT &FnMap() {
-    static FnMapT fns;
-    return fns;
-  }
-
-  static std::mutex &FnMapMutex() {
-    static std::mutex m;
-    return m;
-  }
+  };
 };
 
 class CallUpdateGuard {
 public:
   using Fn = std::function<void(void)>;
-  CallUpdateGuard(Fn fn) : fn_(fn) {}
+  CallUpdateGuard(Fn fn) : fn_(std::move(fn)) {}
 
-  CallUpdateGuard(CallUpdateGuard &&rhs) {
-    this->fn_ = rhs.fn_;
+  CallUpdateGuard(CallUpdateGuard &&rhs) : fn_(std::move(rhs.fn_)) {
     rhs.fn_ = nullptr;
   }
 
@@ -176,14 +211,165 @@ private:
   pybind11::module_ *module_ = nullptr;
 };
 
+// FNV-1a, so the keys of entities could be hashed at compile time.
+constexpr std::uint64_t HashKey(std::string_view key) {
+  std::uint64_t hash = 14695981039346656037ULL;
+  for (char c : key) {
+    hash ^= static_cast<unsigned char>(c);
+    hash *= 1099511628211ULL;
+  }
+  return hash;
+}
+
+// A flat hash map with string keys, which is looked up by a string_view and
+// its hash, so no string is created for lookup. Keys could not be removed.
+template <class ValueT> class KeyMap {
+public:
+  bool empty() const { return size_ == 0; }
+
+  const ValueT *find(std::uint64_t hash, std::string_view key) const {
+    if (size_ == 0) {
+      return nullptr;
+    }
+    size_t mask = slots_.size() - 1;
+    for (size_t i = hash & mask;; i = (i + 1) & mask) {
+      const Slot &slot = slots_[i];
+      if (!slot.used) {
+        return nullptr;
+      }
+      if (slot.hash == hash && slot.key == key) {
+        return &slot.value;
+      }
+    }
+  }
+
+  const ValueT *find(std::string_view key) const {
+    return find(HashKey(key), key);
+  }
+
+  // Same as std::map::emplace, the value of an existing key is kept.
+  std::pair<ValueT *, bool> emplace(std::string_view key, ValueT value) {
+    std::uint64_t hash = HashKey(key);
+    if (auto found = find(hash, key)) {
+      return {const_cast<ValueT *>(found), false};
+    }
+    if ((size_ + 1) * 2 > slots_.size()) {
+      Rehash(slots_.empty() ? 16 : slots_.size() * 2);
+    }
+    ++size_;
+    return {&Insert(Slot{hash, true, std::string(key), std::move(value)}),
+            true};
+  }
+
+private:
+  struct Slot {
+    std::uint64_t hash = 0;
+    bool used = false;
+    std::string key;
+    ValueT value;
+  };
+
+  ValueT &Insert(Slot &&slot) {
+    size_t mask = slots_.size() - 1;
+    size_t i = slot.hash & mask;
+    while (slots_[i].used) {
+      i = (i + 1) & mask;
+    }
+    slots_[i] = std::move(slot);
+    return slots_[i].value;
+  }
+
+  void Rehash(size_t slot_num) {
+    std::vector<Slot> old(slot_num);
+    old.swap(slots_);
+    for (auto &slot : old) {
+      if (slot.used) {
+        Insert(std::move(slot));
+      }
+    }
+  }
+
+  std::vector<Slot> slots_;
+  size_t size_ = 0;
+};
+
+// Custom bindings of members, keyed by the Key of entity and then the member,
+// a null function disables the member. The handle is the pybind11 object of
+// entity.
+using CustomMemberFnT = std::function<void(void *)>;
+using CustomMemberRegistryT = KeyMap<KeyMap<CustomMemberFnT>>;
+
 struct EntityBase {
   virtual ~EntityBase() = default;
 
   virtual void Update() = 0;
 
   virtual EntityScope AsScope() = 0;
+
+  std::shared_ptr<const CustomMemberRegistryT> custom_members;
 };
 
+// Members used by compact codegen, which are registered from a table by
+// `AddMembers`, instead of a virtual function for each of them.
+// Registration runs only once, so it is optimized for size, the dispatchers
+// created by pybind11 are not affected.
+#if defined(__GNUC__)
+#define PB11_WEAVER_COLD __attribute__((noinline, cold))
+#else
+#define PB11_WEAVER_COLD PYBIND11_NOINLINE
+#endif
+
+template <bool IsStatic, class FnT> struct MethodDef {
+  MethodDef(const char *key_, const char *name_, FnT fn_, const char *doc_)
+      : key(key_), name(name_), fn(fn_), doc(doc_) {}
+  template <class PB11T> PB11_WEAVER_COLD void AddTo(PB11T &handle) const {
+    if constexpr (IsStatic) {
+      handle.def_static(name, fn, doc);
+    } else {
+      handle.def(name, fn, doc);
+    }
+  }
+  const char *key;
+  const char *name;
+  FnT fn;
+  const char *doc;
+};
+
+template <bool IsStatic, class FnT>
+MethodDef<IsStatic, FnT> MakeMethodDef(const char *key, const char *name,
+                                       FnT fn, const char *doc) {
+  return MethodDef<IsStatic, FnT>(key, name, fn, doc);
+}
+
+template <class... ArgsT> struct CtorDef {
+  CtorDef(const char *key_, const char *doc_) : key(key_), doc(doc_) {}
+  template <class PB11T> PB11_WEAVER_COLD void AddTo(PB11T &handle) const {
+    handle.def(pybind11::init<ArgsT...>(), doc);
+  }
+  const char *key;
+  const char *doc;
+};
+
+template <class PB11T, class... DefT>
+PB11_WEAVER_COLD void AddMembers(PB11T &handle, const char *entity_key,
+                                 const CustomMemberRegistryT *custom,
+                                 const DefT &...defs) {
+  const KeyMap<CustomMemberFnT> *members =
+      custom ? custom->find(entity_key) : nullptr;
+  auto add = [&](const auto &def) {
+    if (members) {
+      if (auto fn = members->find(def.key)) {
+        if (*fn) {
+          (*fn)(&handle);
+        }
+        return;
+      }
+    }
+    def.AddTo(handle);
+  };
+  (add(defs), ...);
+}
+
 struct DisabledEntity : public EntityBase {
   void Update() override {}
   EntityScope AsScope() override { return EntityScope{0, 0}; }
@@ -191,17 +377,29 @@ struct DisabledEntity : public EntityBase {
 
 struct CustomBindingRegistry {
   using CTorT = std::function<std::shared_ptr<EntityBase>(EntityScope &&)>;
-  using RegistryT = std::map<std::string, CTorT>;
+  using RegistryT = KeyMap<CTorT>;
 
-  bool contains(const std::string &key) const {
-    return registry_.count(key) > 0;
+  bool empty() const { return registry_.empty() && !members_; }
+
+  bool contains(std::string_view key) const {
+    return registry_.find(key) != nullptr;
+  }
+  CTorT at(std::string_view key) const {
+    auto ctor = registry_.find(key);
+    if (!ctor) {
+      throw std::out_of_range(std::string(key));
+    }
+    return *ctor;
+  }
+  // `hash` must be `HashKey(key)`
+  const CTorT *find(std::uint64_t hash, std::string_view key) const {
+    return registry_.find(hash, key);
   }
-  CTorT at(const std::string &key) const { return registry_.at(key); }
 
   template <class BindingT> void DisableBinding() {
-    auto key = std::string(BindingT::Key());
-    registry_.emplace(
-        key, [](EntityScope &&) { return std::make_shared<DisabledEntity>(); });
+    registry_.emplace(BindingT::Key(), [](EntityScope &&) {
+      return std::make_shared<DisabledEntity>();
+    });
   }
 
   void RegCustomBinding(const std::string &key, CTorT &&ctor) {
@@ -209,14 +407,58 @@ struct CustomBindingRegistry {
   }
 
   template <class BindingT> void SetCustomBinding() {
-    auto key = std::string(BindingT::Key());
-    registry_.emplace(key, [](EntityScope &&parent_h) {
+    registry_.emplace(BindingT::Key(), [](EntityScope &&parent_h) {
       return std::make_shared<BindingT>(std::move(parent_h));
     });
   }
 
+  // Members of compact codegen, `member` is the `X` of `AddMethod_X` or the
+  // `CtorN` of `AddCtorN` in default codegen.
+  template <class BindingT> void DisableMember(const std::string &member) {
+    MutableMembers(BindingT::Key()).emplace(member, nullptr);
+  }
+
+  // `fn` will be called with the pybind11 object of BindingT
+  template <class BindingT, class FnT>
+  void SetCustomMember(const std::string &member, FnT &&fn) {
+    MutableMembers(BindingT::Key())
+        .emplace(member, [fn = std::forward<FnT>(fn)](void *handle) {
+          fn(*static_cast<typename BindingT::Pybind11Type *>(handle));
+        });
+  }
+
+  std::shared_ptr<const CustomMemberRegistryT> members() const {
+    return members_;
+  }
+
 private:
+  KeyMap<CustomMemberFnT> &MutableMembers(std::string_view entity_key) {
+    if (!members_) {
+      members_ = std::make_shared<CustomMemberRegistryT>();
+    }
+    return *members_->emplace(entity_key, {}).first;
+  }
+
   RegistryT registry_;
+  std::shared_ptr<CustomMemberRegistryT> members_;
+};
+
+using EntityTable = std::vector<std::shared_ptr<EntityBase>>;
+
+// Hash of `EntityT::Key()`. Generated entities declare a constexpr `Key()`,
+// so it is computed at compile time. A `Key()` that is not a constant
+// expression, e.g. of a hand-written entity, is hashed at each call.
+template <class EntityT, class = void> struct EntityKeyHash {
+  static std::uint64_t Get() { return HashKey(EntityT::Key()); }
+};
+
+template <class EntityT>
+struct EntityKeyHash<EntityT, std::void_t<std::integral_constant<
+                                  std::uint64_t, HashKey(EntityT::Key())>>> {
+  static constexpr std::uint64_t Get() {
+    return std::integral_constant<std::uint64_t,
+                                  HashKey(EntityT::Key())>::value;
+  }
 };
 
 template <class EntityT>
@@ -225,14 +467,134 @@ CreateEntity(EntityScope &&parent_h, const CustomBindingRegistry &registry) {
   if (parent_h.IsDisabled()) {
     return std::make_shared<DisabledEntity>();
   }
-  auto key = std::string(EntityT::Key());
-  if (!registry.contains(key)) {
+  if (registry.empty()) {
     return std::make_shared<EntityT>(std::move(parent_h));
+  }
+  std::shared_ptr<EntityBase> entity;
+  if (auto ctor =
+          registry.find(EntityKeyHash<EntityT>::Get(), EntityT::Key())) {
+    entity = (*ctor)(std::move(parent_h));
   } else {
-    auto fn = registry.at(key);
-    return fn(std::move(parent_h));
+    entity = std::make_shared<EntityT>(std::move(parent_h));
   }
+  entity->custom_members = registry.members();
+  return entity;
 }
 
+// Used by lazy namespaces, entities are split into groups, which are created
+// and updated at the first access of the namespace modules they belong to.
+// Namespace modules are always created with the root module, so they could be
+// imported as usual.
+struct LazyGroupDef {
+  int begin; // entities of the group are entities[begin, end)
+  int end;
+  std::vector<int> deps; // groups that must be loaded before this one
+};
+
+struct LazyModuleDef {
+  int entity; // the namespace entity, whose members are the group
+  int group;
+};
+
+class LazyBinding : public std::enable_shared_from_this<LazyBinding> {
+public:
+  // Create the entities of a group into the table
+  using CreateFn = void (*)(int group, pybind11::module_ &m,
+                            const CustomBindingRegistry &registry,
+                            EntityTable &entities);
+
+  // Group 0 is the root module and the namespace modules, it is created with
+  // its dependencies immediately, and updated by the returned guard. Other
+  // groups are loaded by the `__getattr__` and `__dir__` of their modules.
+  static CallUpdateGuard Bind(pybind11::module_ &m,
+                              const CustomBindingRegistry &registry,
+                              size_t entity_num, CreateFn create,
+                              std::vector<LazyGroupDef> groups,
+                              std::vector<LazyModuleDef> modules) {
+    auto lazy = std::make_shared<LazyBinding>(m, registry, entity_num, create,
+                                              std::move(groups));
+    lazy->Load(0, false);
+    for (const auto &module : modules) {
+      lazy->AddHooks(module);
+    }
+    return {[lazy]() { lazy->Update(0); }};
+  }
+
+  LazyBinding(pybind11::module_ &m, const CustomBindingRegistry &registry,
+              size_t entity_num, CreateFn create,
+              std::vector<LazyGroupDef> groups)
+      : m_(m), registry_(registry), entities_(entity_num), create_(create),
+        groups_(std::move(groups)), loaded_(groups_.size(), false) {}
+
+  void Load(int group, bool update = true) {
+    if (loaded_[group]) {
+      return;
+    }
+    loaded_[group] = true; // set first, a failed group is not created twice
+    const LazyGroupDef &def = groups_[group];
+    for (int dep : def.deps) {
+      Load(dep);
+    }
+    create_(group, m_, registry_, entities_);
+    if (update) {
+      Update(group);
+    }
+  }
+
+  void Update(int group) {
+    const LazyGroupDef &def = groups_[group];
+    for (int i = def.begin; i < def.end; ++i) {
+      entities_[i]->Update();
+    }
+    if (group != 0) {
+      // only the namespace entities of group 0 are used as scopes later
+      for (int i = def.begin; i < def.end; ++i) {
+        entities_[i].reset();
+      }
+    }
+  }
+
+private:
+  void AddHooks(const LazyModuleDef &def) {
+    EntityScope scope = entities_[def.entity]->AsScope();
+    if (scope.IsDisabled()) {
+      return;
+    }
+    pybind11::module_ module = static_cast<pybind11::module_ &>(scope);
+    int group = def.group;
+    auto self = shared_from_this();
+    module.attr("__getattr__") = pybind11::cpp_function(
+        [self, module, group](const std::string &name) {
+          // dunder names are probed by the import system, they never load
+          bool is_dunder = name.size() > 4 && name.compare(0, 2, "__") == 0 &&
+                           name.compare(name.size() - 2, 2, "__") == 0;
+          if (!is_dunder) {
+            self->Load(group);
+          }
+          pybind11::dict attrs = module.attr("__dict__");
+          if (!attrs.contains(name)) {
+            throw pybind11::attribute_error(
+                "module '" + module.attr("__name__").cast<std::string>() +
+                "' has no attribute '" + name + "'");
+          }
+          return pybind11::object(attrs[name.c_str()]);
+        },
+        pybind11::name("__getattr__"));
+    module.attr("__dir__") = pybind11::cpp_function(
+        [self, module, group]() {
+          self->Load(group);
+          return pybind11::list(module.attr("__dict__")); // sorted by dir()
+        },
+        pybind11::name("__dir__"));
+  }
+
+  pybind11::module_ m_;
+  CustomBindingRegistry registry_; // copied, groups are loaded after DeclFn
+  EntityTable entities_;
+  CreateFn create_;
+  std::vector<LazyGroupDef> groups_;
+  std::vector<bool> loaded_;
+};
+
 } // namespace pybind11_weaver
 #endif // GITHUB_COM_PYBIND11_WEAVER
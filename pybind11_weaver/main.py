@@ -1,7 +1,7 @@
 import argparse
 
 import pybind11_weaver
-from pybind11_weaver import gen_code
+from pybind11_weaver import gen_code, watch
 
 
 def parse_args():
@@ -14,6 +14,31 @@ def parse_args():
                         type=str,
                         default=None,
                         help="Path to the config file")
+    parser.add_argument("--jobs",
+                        type=int,
+                        default=None,
+                        help="Number of io_configs to generate in parallel, non-positive value means all cpus. "
+                             "Default to `jobs` in common_config.")
+    parser.add_argument("--check-uptodate",
+                        action="store_true",
+                        default=False,
+                        help="Skip the io_configs whose output is up-to-date according to its depfile.")
+    parser.add_argument("--profile",
+                        type=str,
+                        default="",
+                        help="Write a json report of the time and peak RSS of every phase to the given path.")
+    parser.add_argument("--profile-top",
+                        type=int,
+                        default=20,
+                        help="Number of the slowest entities listed for each io_config in the profile report.")
+    parser.add_argument("--watch",
+                        action="store_true",
+                        default=False,
+                        help="Keep running, and regenerate the io_configs whose input files changed.")
+    parser.add_argument("--watch-interval",
+                        type=float,
+                        default=0.5,
+                        help="Seconds between two checks of the input files in watch mode.")
     args, _ = parser.parse_known_args()
     if hasattr(args, "get_include") and args.get_include:
         print(pybind11_weaver.get_include())
@@ -24,11 +49,15 @@ def parse_args():
     return args
 
 
-ARGS = parse_args()
-
-
 def main():
-    gen_code.gen_code(ARGS.config)
+    args = parse_args()
+    if args.watch:
+        watch.Watcher(args.config, interval=args.watch_interval).run()
+        return
+    failed = gen_code.gen_code(args.config, jobs=args.jobs, check_uptodate=args.check_uptodate,
+                               profile_file=args.profile, profile_top=args.profile_top)
+    if failed:
+        exit(1)
     print("Done!")
 
 
@@ -0,0 +1,101 @@
+"""In-process API to generate bindings, for tools that embed pybind11_weaver in a long-living interpreter.
+
+    with WeaverSession(jobs=4) as session:
+        files = session.generate("path/to/config.yaml")  # {path: content}, nothing is written
+        session.generate("path/to/config.yaml", write=True)
+
+Every unit runs with its own run state, so a session could be used repeatedly without restarting the interpreter.
+"""
+import functools
+import logging
+import multiprocessing
+import multiprocessing.pool
+import os
+import threading
+from typing import Dict, List, Optional
+
+from pybind11_weaver import config
+from pybind11_weaver import gen_code
+
+_logger = logging.getLogger(__name__)
+
+# libclang could not be driven from several threads at the same time, in-process units are serialized
+_in_process_lock = threading.Lock()
+
+
+class WeaverSession:
+    """Generate bindings in the current interpreter.
+
+    With `jobs == 1`, units are generated one by one in the current process. Otherwise, units are generated
+    concurrently by a pool of worker processes, the pool is created at the first use and is reused by all later
+    calls, until `close()` is called.
+    """
+
+    def __init__(self, jobs: int = 1):
+        """
+        Args:
+            jobs: number of units to generate concurrently, non-positive value means all cpus.
+        """
+        self.jobs = jobs if jobs > 0 else os.cpu_count()
+        self._pool: Optional[multiprocessing.pool.Pool] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def generate(self, config_file: str, write: bool = False, check_uptodate: bool = False) -> Dict[str, str]:
+        """Generate all io_configs in the config, return the {path: content} of all generated files.
+
+        Args:
+            config_file: path to the config file, or the content of the config file.
+            write: also write the generated files to disk.
+            check_uptodate: skip the io_configs that are up-to-date according to their depfile.
+
+        Raises:
+            RuntimeError: some units failed, all other units are still generated (and written).
+        """
+        io_cfgs = config.MainConfig.load(config_file).io_configs
+        if check_uptodate:
+            io_cfgs = [io_cfg for io_cfg in io_cfgs if not gen_code.is_unit_up_to_date(io_cfg)]
+        files: Dict[str, str] = dict()
+        failed: List[str] = []
+        for io_cfg, unit_files in zip(io_cfgs, self._render_all(io_cfgs)):
+            if unit_files is None:
+                failed.append(io_cfg.output)
+                continue
+            if write:
+                gen_code.write_unit(io_cfg, unit_files)
+            files.update(unit_files)
+        if failed:
+            raise RuntimeError(f"Failed to generate {failed}")
+        return files
+
+    def _render_all(self, io_cfgs: List[config.IOConfig]):
+        """Yield the files of each unit in order, None for the failed ones."""
+        if self.jobs == 1 or len(io_cfgs) <= 1:
+            for io_cfg in io_cfgs:
+                unit_files = None
+                with _in_process_lock:
+                    try:
+                        unit_files = gen_code.render_unit(io_cfg)
+                    except Exception:
+                        _logger.exception(f"Failed to generate `{io_cfg.output}`")
+                yield unit_files
+            return
+
+        if self._pool is None:
+            # workers are not forked from the current process directly, which may have other threads running libclang
+            self._pool = multiprocessing.get_context("forkserver").Pool(processes=self.jobs)
+        # results are consumed in the order of io_configs, which keeps the merged logs deterministic
+        task = functools.partial(gen_code.run_in_worker, gen_code.render_unit)
+        for success, unit_files, records, stdout in self._pool.imap(task, io_cfgs):
+            gen_code.replay_worker_output(records, stdout)
+            yield unit_files if success else None
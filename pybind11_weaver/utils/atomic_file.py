@@ -0,0 +1,59 @@
+"""Replace files atomically, so readers (compilers, build systems) never see a partially written file."""
+import filecmp
+import os
+import tempfile
+from typing import Callable, Optional
+
+
+def _get_umask() -> int:
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+
+_UMASK = _get_umask()
+
+
+def atomic_write(path: str, write_fn: Callable[[str], None], only_changed: bool = False) -> bool:
+    """Let `write_fn` write a temporary file beside `path`, then move the temporary file to `path`.
+
+    When `only_changed` is set, an existing `path` with the same content is kept, so is its mtime. Return whether
+    `path` is written.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=".tmp_")
+    os.close(fd)
+    try:
+        os.chmod(tmp_path, 0o666 & ~_UMASK)  # mkstemp creates files that only the owner could read
+        write_fn(tmp_path)
+        if only_changed and os.path.isfile(path) and filecmp.cmp(tmp_path, path, shallow=False):
+            return False
+        os.replace(tmp_path, path)
+        return True
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def read_text(path: str) -> Optional[str]:
+    """Return the content of the file, None if it could not be read."""
+    try:
+        with open(path, "r") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def write_text(path: str, content: str):
+    def write_fn(tmp_path: str):
+        with open(tmp_path, "w") as f:
+            f.write(content)
+
+    atomic_write(path, write_fn)
+
+
+def write_text_if_changed(path: str, content: str) -> bool:
+    """Write the file only when its content is different, so its mtime is kept otherwise. Return whether written."""
+    if read_text(path) == content:
+        return False
+    write_text(path, content)
+    return True
@@ -0,0 +1,97 @@
+"""Facts about class declarations, each class is scanned only once for one GenUnit.
+
+The index lives in the current run, call `clear()` before working on a new GenUnit in the same run, since cursors
+are only valid in the TU that created them.
+"""
+from typing import Dict, List, Tuple
+
+from pylibclang import cindex
+
+from pybind11_weaver.utils import common, run_state
+
+# classification of virtual methods
+SEALED = "sealed"  # final or not accessible, could not be overridden in python
+PURE_VIRTUAL = "pure_virtual"
+VIRTUAL = "virtual"
+
+
+class ClassTraits:
+    """Facts about the direct children of a class cursor, collected in one scan."""
+
+    def __init__(self, cursor: cindex.Cursor):
+        self.cursor = cursor
+        self.is_final = False
+        # destructor and `operator delete` are accessible, bases are not taken into account
+        self.self_deletable = True
+        self.bases: List[cindex.Cursor] = []
+        self.ctors: List[cindex.Cursor] = []
+        self.methods: List[cindex.Cursor] = []
+        self.fields: List[cindex.Cursor] = []
+        # virtual methods in declaration order, and one of SEALED, PURE_VIRTUAL or VIRTUAL
+        self.virtual_methods: List[Tuple[cindex.Cursor, str]] = []
+        self._scan()
+
+    def _scan(self):
+        for c in self.cursor.get_children():
+            kind = c.kind
+            if kind == cindex.CursorKind.CXCursor_CXXFinalAttr:
+                self.is_final = True
+            elif kind == cindex.CursorKind.CXCursor_CXXBaseSpecifier:
+                self.bases.append(c)
+            elif kind == cindex.CursorKind.CXCursor_Constructor:
+                self.ctors.append(c)
+            elif kind == cindex.CursorKind.CXCursor_FieldDecl:
+                self.fields.append(c)
+            elif kind == cindex.CursorKind.CXCursor_Destructor:
+                if not common.could_member_accessed(c):
+                    self.self_deletable = False
+            elif kind == cindex.CursorKind.CXCursor_CXXMethod:
+                self.methods.append(c)
+                if c.spelling == "operator delete" and not common.could_member_accessed(c):
+                    self.self_deletable = False
+                if c.is_virtual_method():
+                    if common.is_marked_final(c) or not common.could_member_accessed(c):
+                        self.virtual_methods.append((c, SEALED))
+                    elif c.is_pure_virtual_method():
+                        self.virtual_methods.append((c, PURE_VIRTUAL))
+                    else:
+                        self.virtual_methods.append((c, VIRTUAL))
+
+
+def _index() -> Dict[int, List[ClassTraits]]:
+    return run_state.slot("class_traits.index", dict)
+
+
+def _deletable_db() -> Dict[str, bool]:
+    return run_state.slot("class_traits.deletable_db", dict)
+
+
+def clear():
+    _index().clear()
+    _deletable_db().clear()
+
+
+def get(cursor: cindex.Cursor) -> ClassTraits:
+    """Return the traits of the class cursor, the children of cursor are scanned at the first query."""
+    candidates = _index().setdefault(cursor.hash, [])
+    for traits in candidates:
+        if traits.cursor == cursor:
+            return traits
+    traits = ClassTraits(cursor)
+    candidates.append(traits)
+    return traits
+
+
+def is_type_deletable(type: cindex.Type) -> bool:
+    cursor = type.get_declaration()
+    if cursor.kind not in [cindex.CursorKind.CXCursor_ClassDecl, cindex.CursorKind.CXCursor_StructDecl]:
+        return True
+    type_name = common.safe_type_reference(type)
+    deletable_db = _deletable_db()
+    if type_name in deletable_db:
+        return deletable_db[type_name]
+    cursor, _, _ = common.get_def_cls_cursor(cursor)
+    traits = get(cursor)
+    deletable = traits.self_deletable and all(is_type_deletable(base.type) for base in traits.bases)
+    deletable_db[type_name] = deletable
+    return deletable
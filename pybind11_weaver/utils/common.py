@@ -1,9 +1,12 @@
-from typing import List, Tuple, Optional, Dict
+import collections
+from typing import List, Tuple, Optional, Dict, Set
 
 from pylibclang import cindex
 import pylibclang._C
 import logging
 
+from pybind11_weaver.utils import run_state, source_cache
+
 _logger = logging.getLogger(__name__)
 
 
@@ -12,18 +15,20 @@ def is_public(cursor: cindex.Cursor) -> bool:
                                            cindex.AccessSpecifier.CX_CXXProtected]
 
 
+_VISIBILITY_CHECKED_KINDS = frozenset([cindex.CursorKind.CXCursor_Constructor,
+                                       cindex.CursorKind.CXCursor_CXXMethod,
+                                       cindex.CursorKind.CXCursor_FunctionDecl])
+
+
 def is_visible(cursor: cindex.Cursor, strcit_mode: bool) -> bool:
-    vis = pylibclang._C.clang_getCursorVisibility(cursor) == cindex._C.CXVisibilityKind.CXVisibility_Default
-    lazy_inline_check = cursor.is_definition() and ".h" in str(cursor.location.file)
-    strict_inline_check = pylibclang._C.clang_Cursor_isFunctionInlined(
-        cursor) or pylibclang._C.clang_Cursor_isInlineNamespace(cursor)
-    vis = vis or lazy_inline_check or strict_inline_check
-    if strcit_mode:
-        return vis
-    else:
-        should_check = cursor.kind in [cindex.CursorKind.CXCursor_Constructor, cindex.CursorKind.CXCursor_CXXMethod,
-                                       cindex.CursorKind.CXCursor_FunctionDecl]
-        return vis if should_check else True
+    if not strcit_mode and cursor.kind not in _VISIBILITY_CHECKED_KINDS:
+        return True
+    if pylibclang._C.clang_getCursorVisibility(cursor) == cindex._C.CXVisibilityKind.CXVisibility_Default:
+        return True
+    if cursor.is_definition() and ".h" in str(cursor.location.file):
+        return True
+    return bool(pylibclang._C.clang_Cursor_isFunctionInlined(cursor) or
+                pylibclang._C.clang_Cursor_isInlineNamespace(cursor))
 
 
 def is_operator_overload(cursor: cindex.Cursor) -> bool:
@@ -54,12 +59,9 @@ def type_python_name(name) -> str:
     return name
 
 
-_used_types = set()
-
-
-def get_used_types():
+def get_used_types() -> Set[str]:
     """All used types will be ensured to be exposed to python, even if they are not binded directly"""
-    return _used_types
+    return run_state.slot("common.used_types", set)
 
 
 def _sub_type_str(type_str, subs: Dict[str, str]):
@@ -98,13 +100,23 @@ def _sub_type_str(type_str, subs: Dict[str, str]):
     return ret
 
 
+def get_type_cache_stats() -> collections.Counter:
+    """Hit/miss counters of the type queries memoized on the type objects, and the type mapping cache in `fn`"""
+    return run_state.slot("common.type_cache_stats", collections.Counter)
+
+
 def safe_type_reference(type: cindex.Type, subs: Dict[str, str] = None) -> str:
+    if subs is None and hasattr(type, "_safe_reference"):
+        get_type_cache_stats()["safe_type_reference_hits"] += 1
+        return type._safe_reference
+    get_type_cache_stats()["safe_type_reference_misses"] += 1
     ret = type.get_canonical().spelling
     if "type-parameter" in ret:
-        if subs is None:
-            return type.spelling  # type is a template parameter
-        else:
+        if subs is not None:
             return _sub_type_str(type.spelling, subs)
+        ret = type.spelling  # type is a template parameter
+    if subs is None:
+        type._safe_reference = ret
     return ret
 
 
@@ -112,7 +124,7 @@ def add_used_types(type: cindex.Type):
     canonical = type.get_canonical()
     if int(canonical.kind) > int(
             cindex.TypeKind.CXType_LastBuiltin) and "std::" not in canonical.get_canonical().spelling:
-        _used_types.add(safe_type_reference(remove_const_ref_pointer(type)))
+        get_used_types().add(safe_type_reference(remove_const_ref_pointer(type)))
 
 
 def remove_const_ref(type: cindex.Type):
@@ -129,13 +141,35 @@ def remove_pointer(type: cindex.Type):
 
 
 def remove_const_ref_pointer(type: cindex.Type):
+    if hasattr(type, "_without_const_ref_pointer"):
+        get_type_cache_stats()["remove_const_ref_pointer_hits"] += 1
+        return type._without_const_ref_pointer
+    get_type_cache_stats()["remove_const_ref_pointer_misses"] += 1
     tu = type._tu
-    type = remove_const_ref(type)
-    type._tu = tu
-    if type.kind in [cindex.TypeKind.CXType_Pointer]:
-        return remove_const_ref_pointer(type.get_pointee())
-    else:
-        return type
+    ret = remove_const_ref(type)
+    ret._tu = tu
+    if ret.kind in [cindex.TypeKind.CXType_Pointer]:
+        ret = remove_const_ref_pointer(ret.get_pointee())
+    type._without_const_ref_pointer = ret
+    return ret
+
+
+def referenced_types(types: List[cindex.Type]) -> List[str]:
+    """Reference names of the types and their template arguments, const, reference and pointer are removed."""
+    ret = []
+
+    def visit(type: cindex.Type):
+        type = remove_const_ref_pointer(type)
+        ret.append(safe_type_reference(type))
+        for i in range(type.get_num_template_arguments()):
+            arg = type.get_template_argument_type(i)
+            if arg.kind != cindex.TypeKind.CXType_Invalid:
+                arg._tu = type._tu
+                visit(arg)
+
+    for t in types:
+        visit(t)
+    return ret
 
 
 def is_types_has_unique_ptr(types: List[cindex.Type]):
@@ -157,48 +191,6 @@ def is_marked_final(cursor: cindex.Cursor):
     return False
 
 
-_deletable_db = dict()
-
-
-def is_type_deletable(type: cindex.Type):
-    cursor = type.get_declaration()
-    deletable = True
-    if cursor.kind not in [cindex.CursorKind.CXCursor_ClassDecl, cindex.CursorKind.CXCursor_StructDecl]:
-        return True
-    cursor, _, _ = get_def_cls_cursor(cursor)
-
-    for c in cursor.get_children():
-        if c.kind == cindex.CursorKind.CXCursor_Destructor and not could_member_accessed(c):
-            deletable = False
-        if c.kind == cindex.CursorKind.CXCursor_CXXMethod and c.spelling == "operator delete":
-            if not could_member_accessed(c):
-                deletable = False
-        if c.kind == cindex.CursorKind.CXCursor_CXXBaseSpecifier:
-            base_name = safe_type_reference(c.type)
-            if base_name in _deletable_db:
-                deletable = _deletable_db[base_name]
-            else:
-                if not is_type_deletable(c.type):
-                    deletable = False
-        if not deletable:
-            break
-    _deletable_db[safe_type_reference(type)] = deletable
-    return deletable
-
-
-def _is_explicit_instantiation(cursor: cindex.Cursor):
-    tokens = [x.spelling for x in cursor.get_tokens()]
-    for i, token in enumerate(tokens):
-        if token == "template":
-            if tokens[i + 1] == "<":
-                return False
-            else:
-                if tokens[i + 1] == "class" or tokens[i + 1] == "struct":
-                    return True
-                else:
-                    raise NotImplementedError("Only class and struct explicit instantiation supported for now")
-
-
 def _get_template_param_arg_pair(template_cursor: cindex.Cursor, specialized_cursor: cindex.Cursor) -> Optional[Tuple[
     List[str], Dict[str, str]]]:
     decls = []
@@ -234,7 +226,7 @@ def get_def_cls_cursor(cursor: cindex.Cursor) -> Tuple[cindex.Cursor, Optional[L
         template_cursor = pylibclang._C.clang_getSpecializedCursorTemplate(cursor)
         template_cursor._tu = cursor._tu
         template_decls, subs = _get_template_param_arg_pair(template_cursor, cursor)
-        if _is_explicit_instantiation(cursor):
+        if source_cache.is_explicit_instantiation(cursor):
             ret_cursor = template_cursor  # Only when instantiation, return the template cursor
 
     return ret_cursor, template_decls, subs
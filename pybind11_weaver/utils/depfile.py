@@ -0,0 +1,75 @@
+"""Make/Ninja compatible depfile support."""
+import os
+from typing import List, Optional, Tuple
+
+
+def _escape(path: str) -> str:
+    return path.replace("\\", "\\\\").replace(" ", "\\ ").replace("#", "\\#").replace("$", "$$")
+
+
+def _unescape_split(content: str) -> List[str]:
+    words = []
+    current = []
+
+    def flush():
+        if current:
+            words.append("".join(current))
+            current.clear()
+
+    i = 0
+    while i < len(content):
+        c = content[i]
+        nxt = content[i + 1] if i + 1 < len(content) else ""
+        if c == "\\" and nxt == "\n":  # line continuation
+            flush()
+            i += 2
+        elif c == "\\" and nxt in [" ", "#", "\\"]:
+            current.append(nxt)
+            i += 2
+        elif c == "$" and nxt == "$":
+            current.append("$")
+            i += 2
+        elif c.isspace():
+            flush()
+            i += 1
+        else:
+            current.append(c)
+            i += 1
+    flush()
+    return words
+
+
+def format_depfile(target: str, deps: List[str]) -> str:
+    lines = [f"{_escape(target)}:"] + [f"  {_escape(d)}" for d in deps]
+    return " \\\n".join(lines) + "\n"
+
+
+def read_depfile(path: str) -> Optional[Tuple[str, List[str]]]:
+    """Return [target, deps], or None if the file is not a valid depfile."""
+    try:
+        with open(path, "r") as f:
+            words = _unescape_split(f.read())
+    except OSError:
+        return None
+    if len(words) == 0 or not words[0].endswith(":"):
+        return None
+    return words[0][:-1], words[1:]
+
+
+def is_up_to_date(depfile: str, target: str) -> bool:
+    """A target is up to date when it exists, and none of its deps is newer than the depfile.
+
+    The depfile's mtime is used as the stamp of last generation, so the target itself is free to keep its old mtime
+    when its content is unchanged.
+    """
+    parsed = read_depfile(depfile)
+    if parsed is None or parsed[0] != target or not os.path.exists(target):
+        return False
+    stamp = os.stat(depfile).st_mtime_ns
+    for dep in parsed[1]:
+        try:
+            if os.stat(dep).st_mtime_ns > stamp:
+                return False
+        except OSError:
+            return False
+    return True
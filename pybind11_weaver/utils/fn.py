@@ -1,10 +1,10 @@
-from typing import List, Tuple, Optional, Union
+from typing import Dict, List, Set, Tuple, Optional, Union
 
 from pylibclang import cindex
 
 from . import scope_list
 
-from pybind11_weaver.utils import common
+from pybind11_weaver.utils import common, class_traits, run_state
 
 
 def _get_fn_pointer_type(cursor: cindex.Cursor) -> Optional[str]:
@@ -35,19 +35,16 @@ def _get_fn_pointer_type(cursor: cindex.Cursor) -> Optional[str]:
         return f"pybind11_weaver::FnPtrT<void,{ret_t}({','.join(args_t)})>::type"
 
 
-_wrapped_db = set()
-
-
-def get_wrapped_types():
-    return _wrapped_db
+def get_wrapped_types() -> Set[cindex.Type]:
+    return run_state.slot("fn.wrapped_types", set)
 
 
 class ValueCast:
-    nest_level = -1
 
     def __init__(self, c_type: cindex.Type, pb11_type: str):
         self.c_type = c_type
         self.pb11_type = pb11_type
+        self.nest_level = -1
 
     def __call__(self, value: str, **kwargs):
         self.nest_level += 1
@@ -68,7 +65,7 @@ class PointerToPb11Value(ValueCast):
 
     def __init__(self, *args, **kwargs):
         ValueCast.__init__(self, *args, **kwargs)
-        _wrapped_db.add(self.c_type)
+        get_wrapped_types().add(self.c_type)
 
     def cvt(self, c_value: str, **kwargs):
         return f"pybind11_weaver::WrapP<{common.safe_type_reference(self.c_type)}>({c_value})"
@@ -77,7 +74,7 @@ class PointerToPb11Value(ValueCast):
 class Pb11ValueToPointer(ValueCast):
     def __init__(self, *args, **kwargs):
         ValueCast.__init__(self, *args, **kwargs)
-        _wrapped_db.add(self.c_type)
+        get_wrapped_types().add(self.c_type)
 
     def cvt(self, pb11_value: str, **kwargs):
         return f"({pb11_value})->Cptr()"
@@ -110,8 +107,29 @@ class Pb11FnToFnPointer(ValueCast):
                                           enumerate(self.c_type.argument_types())])
 
 
+# pb11 type and casts of c types, keyed by `safe_type_reference` of the c type. Casts are stateless between calls,
+# and the side effects of the mapping (used types, wrapped types) are idempotent, so they could be shared.
+def _pb11_type_cache() -> Dict[str, Tuple[str, "ValueCast", "ValueCast"]]:
+    return run_state.slot("fn.pb11_type_cache", dict)
+
+
+def clear_type_cache():
+    _pb11_type_cache().clear()
+    common.get_type_cache_stats().clear()
+
+
 def get_pb11_type(c_type: cindex.Type) -> Tuple[str, "CValuePb11Value", "Pb11ValueToCValue"]:
     c_type_spelling = common.safe_type_reference(c_type)
+    cache = _pb11_type_cache()
+    if c_type_spelling in cache:
+        common.get_type_cache_stats()["get_pb11_type_hits"] += 1
+    else:
+        common.get_type_cache_stats()["get_pb11_type_misses"] += 1
+        cache[c_type_spelling] = _map_pb11_type(c_type, c_type_spelling)
+    return cache[c_type_spelling]
+
+
+def _map_pb11_type(c_type: cindex.Type, c_type_spelling: str) -> Tuple[str, "ValueCast", "ValueCast"]:
     canonical = c_type.get_canonical()
     ret = c_type_spelling, NoCast(canonical, c_type_spelling), NoCast(canonical, c_type_spelling)
 
@@ -142,7 +160,7 @@ def get_pb11_type(c_type: cindex.Type) -> Tuple[str, "CValuePb11Value", "Pb11Val
         if pointee_decl.kind in [cindex.CursorKind.CXCursor_StructDecl,
                                  cindex.CursorKind.CXCursor_ClassDecl] and not pointee_decl.is_definition():
             return to_warped_ptr()
-        if not common.is_type_deletable(pointee):
+        if not class_traits.is_type_deletable(pointee):
             return to_warped_ptr()
         common.add_used_types(pointee)
     else:
@@ -199,8 +217,7 @@ def wrap_c_callable_in_pb11_type_io(c_callable_name: str, ret_t: cindex.Type, ar
         return None
 
 
-__pb11_callable_inside = """[]({params}){{
-    auto to_call = pybind11_weaver::FnPointerWrapper<{pb11_io_type}>::GetFnProxy(__DATE__ __TIME__ __FILE__ , __COUNTER__);
+__pb11_callable_inside = """[](const std::function<{fn_wrapper_t}::CppFnT> & to_call{params}){{
     {ret_expr};
 }}"""
 
@@ -239,23 +256,19 @@ def wrap_pb11_fn_in_c_type_io(pb11_callable_name: str,
 
     ret_t_is_void = c_ret_t.kind == cindex.TypeKind.CXType_Void
     if not ret_t_is_void and not isinstance(pb11_value_to_c, NoCast):
-        ret_expr = f"auto && __pb11_ret__= ret_expr; return {pb11_value_to_c('__pb11_ret__')}"
+        ret_expr = f"auto && __pb11_ret__= {ret_expr}; return {pb11_value_to_c('__pb11_ret__')}"
     else:
         ret_expr = f"return {ret_expr}"
 
+    fn_wrapper_t = f"pybind11_weaver::FnPointerWrapper<{pb11_io_t_str}>"
+    # the closure type of the c wrapper is unique to this call site, it keys the slot holding the callable
     c_wrapper = __pb11_callable_inside.format(
-        params=','.join(params),
-        pb11_io_type=pb11_io_t_str,
+        params=''.join(',' + p for p in params),
+        fn_wrapper_t=fn_wrapper_t,
         ret_expr=ret_expr)
 
-    fn_wrapper_t = f"pybind11_weaver::FnPointerWrapper<{pb11_io_t_str}>"
     c_fn_sig = f"{','.join([common.safe_type_reference(t) for t in [c_ret_t] + c_args_t])}"
-    return f"""{fn_wrapper_t}::GetCptr<{c_fn_sig}>::Run({pb11_callable_name}, pybind11_weaver::Guardian() , {c_wrapper}, 
-/* clang-format off */
-__DATE__ __TIME__ __FILE__, 
-__COUNTER__ - 1
-/* clang-format on */
-)"""
+    return f"{fn_wrapper_t}::GetCptr<{c_fn_sig}>::Run({pb11_callable_name}, pybind11_weaver::Guardian(), {c_wrapper})"
 
 
 def _fn_template_arg_name(cursor, idx, as_python_name=False) -> Optional[str]:
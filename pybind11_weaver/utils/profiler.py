@@ -0,0 +1,80 @@
+"""Phase-level profiling of a generator run.
+
+The profile of the current run is kept in the run state, phases could be nested, and the nested phases are named by
+the path from the outermost one, e.g. `map_from_gu/reload_tu`.
+
+    with profiler.current().phase("load_tu"):
+        ...
+"""
+import collections
+import contextlib
+import sys
+import time
+from typing import Dict, List, Tuple
+
+from pybind11_weaver.utils import run_state
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+def peak_rss_kb() -> int:
+    """Peak RSS of the current process, 0 if it is not available."""
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peak //= 1024  # bytes on macOS
+    return peak
+
+
+class _PhaseStat:
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.peak_rss_kb = 0
+
+
+class Profile:
+
+    def __init__(self):
+        self.phases: Dict[str, _PhaseStat] = dict()
+        self.counters = collections.Counter()
+        # (seconds, kind, name, location) of every generated entity
+        self.entities: List[Tuple[float, str, str, str]] = []
+        self._stack: List[str] = []
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        self._stack.append(name)
+        # registered on entering, so the phases are listed in the order they start
+        stat = self.phases.setdefault("/".join(self._stack), _PhaseStat())
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            stat.calls += 1
+            stat.seconds += time.perf_counter() - begin
+            stat.peak_rss_kb = peak_rss_kb()
+            self._stack.pop()
+
+    def add_entity(self, seconds: float, kind: str, name: str, location: str):
+        self.entities.append((seconds, kind, name, location))
+
+    def report(self, top_n: int = 20) -> Dict:
+        """Return a json serializable report, with the top_n slowest entities."""
+        slowest = sorted(self.entities, key=lambda e: e[0], reverse=True)[:top_n]
+        return {
+            "phases": {name: {"calls": stat.calls, "seconds": stat.seconds, "peak_rss_kb": stat.peak_rss_kb}
+                       for name, stat in self.phases.items()},
+            "counters": dict(sorted(self.counters.items())),
+            "slowest_entities": [{"seconds": seconds, "kind": kind, "name": name, "location": location}
+                                 for seconds, kind, name, location in slowest],
+        }
+
+
+def current() -> Profile:
+    return run_state.slot("profiler.profile", Profile)
@@ -0,0 +1,35 @@
+"""Mutable state of one generation run.
+
+Modules keep their per-run state (used types, caches, counters ...) in slots of the current run, instead of module
+level globals. The run is stored in a context variable, so runs in different threads or contexts never share state,
+and a process could generate many units one after another without leaking state between them.
+
+Code that runs outside any run shares a process-wide default state, which keeps the modules usable directly.
+"""
+import contextlib
+import contextvars
+from typing import Any, Callable, Dict
+
+_current: contextvars.ContextVar[Dict[str, Any]] = contextvars.ContextVar("pybind11_weaver_run_state")
+
+_default_state: Dict[str, Any] = dict()
+
+
+def slot(name: str, factory: Callable[[], Any]) -> Any:
+    """Return the object named `name` of the current run, it is created by `factory` at the first access."""
+    state = _current.get(_default_state)
+    obj = state.get(name, None)
+    if obj is None:
+        obj = factory()
+        state[name] = obj
+    return obj
+
+
+@contextlib.contextmanager
+def new_run():
+    """Run the body with a fresh state, the previous state is restored on exit."""
+    token = _current.set(dict())
+    try:
+        yield
+    finally:
+        _current.reset(token)
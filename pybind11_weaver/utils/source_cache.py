@@ -0,0 +1,87 @@
+"""Source text and token based queries, cached for one GenUnit.
+
+The cache lives in the current run, call `clear()` before working on a new GenUnit in the same run, since the
+source files may change between units.
+"""
+import collections
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from pylibclang import cindex
+
+from pybind11_weaver.utils import run_state
+
+_logger = logging.getLogger(__name__)
+
+
+def _lines() -> Dict[str, List[str]]:
+    return run_state.slot("source_cache.lines", dict)
+
+
+def _explicit_instantiation() -> Dict[Tuple[str, int, int], Optional[bool]]:
+    return run_state.slot("source_cache.explicit_instantiation", dict)
+
+
+def get_stats() -> collections.Counter:
+    return run_state.slot("source_cache.stats", collections.Counter)
+
+
+def clear():
+    _lines().clear()
+    _explicit_instantiation().clear()
+    get_stats().clear()
+
+
+def get_line(file_name: str, line: int) -> str:
+    """Return the line-th (1-based) line of the file."""
+    cache = _lines()
+    lines = cache.get(file_name, None)
+    if lines is None:
+        get_stats()["file_reads"] += 1
+        with open(file_name, 'r') as f:
+            lines = f.read().splitlines()
+        cache[file_name] = lines
+    else:
+        get_stats()["file_reads_saved"] += 1
+    return lines[line - 1]
+
+
+def _extent_key(cursor: cindex.Cursor) -> Tuple[str, int, int]:
+    extent = cursor.extent
+    return str(extent.start.file), extent.start.offset, extent.end.offset
+
+
+def _classify_instantiation(cursor: cindex.Cursor) -> Optional[bool]:
+    tokens = iter(cursor.get_tokens())
+    for token in tokens:
+        if token.spelling == "template":
+            next_token = next(tokens).spelling
+            if next_token == "<":
+                return False
+            elif next_token == "class" or next_token == "struct":
+                return True
+            else:
+                raise NotImplementedError("Only class and struct explicit instantiation supported for now")
+    return None
+
+
+def is_explicit_instantiation(cursor: cindex.Cursor) -> Optional[bool]:
+    """Tell whether the class cursor is an explicit instantiation `template class Foo<int>;`, or a specialization.
+
+    None is returned when there is no `template` keyword in the extent of cursor.
+    """
+    key = _extent_key(cursor)
+    cache = _explicit_instantiation()
+    if key not in cache:
+        get_stats()["tokenizations"] += 1
+        cache[key] = _classify_instantiation(cursor)
+    else:
+        get_stats()["tokenizations_saved"] += 1
+    return cache[key]
+
+
+def log_stats(unit_name: str):
+    stats = get_stats()
+    _logger.info(f"Source cache of {unit_name}: {stats['file_reads']} file reads "
+                 f"({stats['file_reads_saved']} saved), {stats['tokenizations']} tokenizations "
+                 f"({stats['tokenizations_saved']} saved)")
@@ -0,0 +1,111 @@
+"""Find system include paths of compilers, with an in-process memo and an optional persistent cache.
+
+A probe spawns the compiler once, so the result is cached by the resolved compiler binary, its stamp and the probe
+flags.
+"""
+import concurrent.futures
+import json
+import logging
+import os
+import shutil
+from typing import Dict, List, Optional, Tuple
+
+import pybind11_weaver.third_party.ccsyspath as ccsyspath
+from pybind11_weaver.utils import atomic_file
+
+_logger = logging.getLogger(__name__)
+
+_PROBE_FLAGS = ["-x", "c++"]
+
+# Unlike the run states, the memo is shared by all runs of the process on purpose: a key pins the compiler binary by
+# its stamp, so a probed result never goes stale, and an in-process session would not spawn compilers for every run.
+_memo: Dict[str, List[str]] = dict()
+
+
+def _cache_key(compiler: str) -> Optional[str]:
+    path = shutil.which(compiler)
+    if path is None:
+        return None
+    path = os.path.realpath(path)
+    st = os.stat(path)
+    return json.dumps([path, st.st_mtime_ns, st.st_size, _PROBE_FLAGS])
+
+
+def _load_cache(cache_file: str) -> Dict[str, List[str]]:
+    if not cache_file or not os.path.exists(cache_file):
+        return dict()
+    try:
+        with open(cache_file, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        _logger.info(f"Ignored broken toolchain cache `{cache_file}`")
+        return dict()
+
+
+def _save_cache(cache_file: str, cache: Dict[str, List[str]]):
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(cache_file)), exist_ok=True)
+        atomic_file.write_text(cache_file, json.dumps(cache, indent=1))
+    except OSError as e:
+        # the cache is optional, generation goes on without it
+        _logger.warning(f"Failed to save toolchain cache `{cache_file}`: {e}")
+
+
+def _probe(compiler: str) -> List[str]:
+    try:
+        return [p.decode("utf-8") for p in ccsyspath.system_include_paths(compiler)]
+    except (OSError, ValueError):
+        _logger.info(f"Failed to probe system include paths of `{compiler}`")
+        return []
+
+
+def system_include_paths(compilers: List[str], cache_file: str = "", parallel: bool = False) -> Tuple[
+    str, List[str]]:
+    """Return [compiler, system include paths] of the first compiler that has any system include path.
+
+    Args:
+        compilers: candidates in priority order.
+        cache_file: path of the persistent cache, empty means only cache in process.
+        parallel: probe all uncached candidates concurrently, instead of one by one until found.
+
+    """
+    keys = [_cache_key(c) for c in compilers]
+    cache = _load_cache(cache_file)
+    cache_updated = False
+
+    def lookup(i: int) -> Optional[List[str]]:
+        key = keys[i]
+        if key is None:
+            return []
+        if key in cache:
+            _memo[key] = cache[key]
+        elif key in _memo:
+            record(i, _memo[key])
+        return _memo.get(key, None)
+
+    def record(i: int, paths: List[str]):
+        nonlocal cache_updated
+        _memo[keys[i]] = paths
+        cache[keys[i]] = paths
+        cache_updated = True
+
+    if parallel:
+        to_probe = [i for i in range(len(compilers)) if lookup(i) is None]
+        if len(to_probe) > 0:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=len(to_probe)) as pool:
+                for i, paths in zip(to_probe, pool.map(lambda i: _probe(compilers[i]), to_probe)):
+                    record(i, paths)
+
+    found = ("", [])
+    for i, compiler in enumerate(compilers):
+        paths = lookup(i)
+        if paths is None:
+            paths = _probe(compiler)
+            record(i, paths)
+        if len(paths) > 0:
+            found = (compiler, paths)
+            break
+
+    if cache_file and cache_updated:
+        _save_cache(cache_file, cache)
+    return found
@@ -0,0 +1,95 @@
+"""A persistent cache of parsed translation units.
+
+Each entry is made of two files in the cache dir:
+    1. `<key>.ast`, the TU saved by libclang.
+    2. `<key>.json`, the manifest, which records the final content of the unsaved file and the content hash of every
+        file the TU touched.
+
+The key is computed from the content of the unsaved file and the parse args, an entry is valid only when all files
+recorded in the manifest are unchanged.
+"""
+import hashlib
+import json
+import logging
+import os
+from typing import Dict, List, Optional, Tuple
+
+from pylibclang import cindex
+
+from pybind11_weaver.utils import atomic_file
+
+_logger = logging.getLogger(__name__)
+
+
+def _file_hash(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class TUCache:
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(content: str, args: List[str]) -> str:
+        return hashlib.sha256(json.dumps([content, args]).encode("utf-8")).hexdigest()
+
+    def _paths(self, key: str) -> Tuple[str, str]:
+        base = os.path.join(self.cache_dir, key)
+        return base + ".ast", base + ".json"
+
+    @staticmethod
+    def _is_file_unchanged(path: str, record: Dict) -> bool:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        # libclang refuses to load an ast file once any input file's stamp changed, so stamp is checked first,
+        # and content hash is used to catch the changes that keep the stamp, e.g. `cp -p`.
+        if st.st_mtime_ns != record["mtime_ns"] or st.st_size != record["size"]:
+            return False
+        return _file_hash(path) == record["sha256"]
+
+    def load(self, key: str) -> Optional[Tuple[cindex.TranslationUnit, str]]:
+        """Return [tu, content of unsaved file] if there is a valid entry."""
+        ast_path, manifest_path = self._paths(key)
+        if not os.path.exists(ast_path) or not os.path.exists(manifest_path):
+            return None
+        try:
+            with open(manifest_path, "r") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        for path, record in manifest["files"].items():
+            if not self._is_file_unchanged(path, record):
+                _logger.info(f"TU cache `{key}` is outdated, for `{path}` changed")
+                return None
+        try:
+            tu = cindex.Index.create().read(ast_path)
+        except cindex.TranslationUnitLoadError:
+            _logger.info(f"Failed to load TU cache `{ast_path}`, ignored")
+            return None
+        _logger.info(f"TU loaded from cache `{ast_path}`")
+        return tu, manifest["content"]
+
+    def save(self, key: str, tu: cindex.TranslationUnit, content: str):
+        ast_path, manifest_path = self._paths(key)
+        files = dict()
+        for inclusion in tu.get_includes():
+            # do not normalize the path, `..` after a symlink could not be resolved textually
+            path = os.path.join(os.getcwd(), inclusion.include.name)
+            if path in files:
+                continue
+            st = os.stat(path)
+            files[path] = {"mtime_ns": st.st_mtime_ns, "size": st.st_size, "sha256": _file_hash(path)}
+        manifest = {"content": content, "files": files}
+
+        def write_manifest(tmp_path):
+            with open(tmp_path, "w") as f:
+                json.dump(manifest, f)
+
+        # ast first, a manifest always points to a complete ast
+        atomic_file.atomic_write(ast_path, tu.save)
+        atomic_file.atomic_write(manifest_path, write_manifest)
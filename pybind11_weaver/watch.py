@@ -0,0 +1,128 @@
+"""Watch mode, keeps the GenUnits of a config alive, and regenerates a unit once any file it depends on changed.
+
+Files are polled by their stamps, the TU of a changed unit is reparsed in place, and only the outputs whose content
+changed are rewritten, so the build system would not recompile unchanged bindings.
+"""
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from pybind11_weaver import config
+from pybind11_weaver import gen_code
+from pybind11_weaver import gen_unit
+from pybind11_weaver.utils import run_state
+
+_logger = logging.getLogger(__name__)
+
+_Stamp = Optional[Tuple[int, int]]
+
+
+def _stamp(path: str) -> _Stamp:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+class _WatchedUnit:
+
+    def __init__(self, io_cfg: config.IOConfig):
+        self.io_cfg = io_cfg
+        self.gu: Optional[gen_unit.GenUnit] = None
+        self.stamps: Dict[str, _Stamp] = dict()
+
+    def changed_files(self) -> List[str]:
+        return [path for path, stamp in self.stamps.items() if _stamp(path) != stamp]
+
+    def drop_gu(self):
+        if self.gu is not None:
+            self.gu.dispose()
+            self.gu = None
+
+
+class Watcher:
+
+    def __init__(self, config_file: str, interval: float = 0.5):
+        """
+        Args:
+            config_file: path to the config file, the config is reloaded when it changed.
+            interval: seconds between two polls.
+        """
+        self.config_file = config_file
+        self.interval = interval
+        self.units: List[_WatchedUnit] = []
+        self._config_stamp: _Stamp = None
+
+    def _load_config(self):
+        self.close()
+        self._config_stamp = _stamp(self.config_file)
+        self.units = [_WatchedUnit(io_cfg) for io_cfg in config.MainConfig.load(self.config_file).io_configs]
+
+    def _generate(self, unit: _WatchedUnit) -> bool:
+        begin = time.perf_counter()
+        # stamps are taken before parsing, so the changes made during generation would be found by next poll
+        stamps = {path: _stamp(path) for path in unit.stamps}
+        try:
+            if unit.gu is None:
+                unit.gu = gen_unit.GenUnit(unit.io_cfg)
+            else:
+                unit.gu.reparse()
+            with run_state.new_run():
+                written = gen_code.write_gen_unit(unit.gu, only_changed=True)
+        except Exception as e:
+            _logger.exception(f"Failed to generate `{unit.io_cfg.output}`, waiting for next change")
+            # the TU may be unusable after a failed reparse, so it will be loaded from scratch
+            unit.drop_gu()
+            if isinstance(e, gen_unit.ParseError):
+                for path in e.dependencies:
+                    stamps.setdefault(path, _stamp(path))
+            unit.stamps = stamps
+            return False
+        for path in unit.gu.dependencies():
+            if path not in stamps:
+                stamps[path] = _stamp(path)
+        unit.stamps = stamps
+        print(f"Generated `{unit.io_cfg.output}` in {time.perf_counter() - begin:.2f}s, "
+              f"{sum(written.values())} of {len(written)} files written")
+        return True
+
+    def generate_all(self):
+        """Load the config and generate all units."""
+        self._load_config()
+        for unit in self.units:
+            self._generate(unit)
+
+    def poll(self) -> int:
+        """Regenerate the units whose dependencies changed, return the number of regenerated units."""
+        if _stamp(self.config_file) != self._config_stamp:
+            _logger.info(f"`{self.config_file}` changed, reload all units")
+            self.generate_all()
+            return len(self.units)
+        regenerated = 0
+        for unit in self.units:
+            changed = unit.changed_files()
+            if changed:
+                _logger.info(f"`{unit.io_cfg.output}` is outdated, for {changed} changed")
+                self._generate(unit)
+                regenerated += 1
+        return regenerated
+
+    def run(self):
+        """Generate all units, then keep watching until interrupted."""
+        self.generate_all()
+        print(f"Watching {len(self.units)} units, press Ctrl+C to stop")
+        try:
+            while True:
+                time.sleep(self.interval)
+                self.poll()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.close()
+
+    def close(self):
+        """Dispose the TUs of all units."""
+        for unit in self.units:
+            unit.drop_gu()
@@ -0,0 +1,72 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from pybind11_weaver import entity_tree, gen_unit
+from pybind11_weaver.entity.klass import trampoline
+from pybind11_weaver.utils import class_traits, common
+
+
+class ClassTraitsTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        with open(os.path.join(tmp_dir.name, "a.h"), "w") as f:
+            f.write("""
+struct Base { protected: ~Base(); };
+struct Derived final : public Base {
+    Derived(int);
+    virtual void foo();
+    virtual void bar() final;
+    int x;
+};
+struct Abstract { virtual void foo() = 0; };
+struct Middle : public Abstract { void foo() override; virtual void baz(); };
+""")
+        self.gu = gen_unit.load_all_gu(f"""
+common_config:
+    include_directories: ["{tmp_dir.name}"]
+io_configs:
+    - inputs: ["a.h"]
+      output: "/path/to/output"
+""")[0]
+        self.cursors = {c.spelling: c for c in self.gu.tu.cursor.get_children()}
+        class_traits.clear()
+
+    def test_traits(self):
+        traits = class_traits.get(self.cursors["Derived"])
+        self.assertIs(traits, class_traits.get(self.cursors["Derived"]))
+        self.assertTrue(traits.is_final)
+        self.assertTrue(traits.self_deletable)
+        self.assertEqual([c.spelling for c in traits.bases], ["Base"])
+        self.assertEqual(len(traits.ctors), 1)
+        self.assertEqual([c.spelling for c in traits.fields], ["x"])
+        self.assertEqual([(c.spelling, k) for c, k in traits.virtual_methods],
+                         [("foo", class_traits.VIRTUAL), ("bar", class_traits.SEALED)])
+        self.assertEqual([k for c, k in class_traits.get(self.cursors["Abstract"]).virtual_methods],
+                         [class_traits.PURE_VIRTUAL])
+        self.assertFalse(class_traits.get(self.cursors["Base"]).self_deletable)
+
+    def test_deletable_scans_once(self):
+        self.assertFalse(class_traits.is_type_deletable(self.cursors["Derived"].type))
+        self.assertTrue(class_traits.is_type_deletable(self.cursors["Abstract"].type))
+        with mock.patch.object(class_traits, "ClassTraits", side_effect=AssertionError("should not scan")):
+            self.assertFalse(class_traits.is_type_deletable(self.cursors["Derived"].type))
+            self.assertFalse(class_traits.is_type_deletable(self.cursors["Base"].type))
+
+    def test_virtuals_resolved_once_per_class(self):
+        tree = entity_tree.EntityTree(self.gu)
+        trampoline.clear_cache()
+        virt = trampoline.Trampoline(tree["Middle"])._virt
+        self.assertEqual(set(trampoline._class_virtuals_db().keys()), {"Middle", "Abstract"})
+        self.assertEqual([c.spelling for c in virt.virtuals], ["foo", "baz"])
+        self.assertEqual(virt.base.pure_virtuals, [])  # overridden by Middle
+        with mock.patch.object(common, "get_def_cls_cursor", side_effect=AssertionError("should not resolve again")):
+            virt = trampoline.Trampoline(tree["Abstract"])._virt
+        self.assertEqual([c.spelling for c in virt.pure_virtuals], ["foo"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,10 @@
 import os
+import tempfile
 import unittest
+from unittest import mock
 
 from pybind11_weaver import config
+from pybind11_weaver.utils import toolchain_probe
 
 
 class ConfigTest(unittest.TestCase):
@@ -48,6 +51,7 @@ io_configs:
         else:
             self.assertEqual(len(cfg.common_config.compiler), 0)
         self.assertEqual(len(cfg.common_config.include_directories), 0)
+        self.assertEqual(cfg.common_config.jobs, 1)
         self.assertEqual(len(cfg.io_configs), 1)
         io_cfg = cfg.io_configs[0]
         self.assertEqual(io_cfg._cxx_flags, cfg.common_config.cxx_flags)
@@ -57,6 +61,10 @@ io_configs:
         self.assertEqual(io_cfg.root_module_namespace, "")
         self.assertEqual(io_cfg.strict_visibility_mode, False)
         self.assertEqual(io_cfg.gen_docstring, True)
+        self.assertEqual(io_cfg.skip_function_bodies, False)
+        self.assertEqual(io_cfg.reproducible, False)
+        self.assertEqual(io_cfg.compact_codegen, False)
+        self.assertEqual(io_cfg.lazy_namespaces, False)
         self.assertEqual(io_cfg.extra_cxx_flags, [])
 
     def test_load_config_with_docstring(self):
@@ -90,6 +98,30 @@ io_configs:
 """)
         self.assertEqual(cfg.io_configs[0].inputs, [f'"{file_name}"'])
 
+    def test_toolchain_probe_cache(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache_file = os.path.join(tmp_dir, "toolchain.json")
+            candidates = ["no_such_compiler_for_weaver", "c++"]
+            compiler, paths = toolchain_probe.system_include_paths(candidates, cache_file, parallel=True)
+            self.assertEqual(compiler, "c++")
+            self.assertGreater(len(paths), 0)
+            self.assertTrue(os.path.exists(cache_file))
+
+            toolchain_probe._memo.clear()
+            with mock.patch.object(toolchain_probe, "_probe", side_effect=AssertionError("should not probe")):
+                self.assertEqual(toolchain_probe.system_include_paths(candidates, cache_file), (compiler, paths))
+
+    def test_toolchain_probe_cache_unwritable(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            not_dir = os.path.join(tmp_dir, "not_dir")
+            open(not_dir, "w").close()
+            toolchain_probe._memo.clear()
+            with self.assertLogs(toolchain_probe.__name__, level="WARNING"):
+                compiler, paths = toolchain_probe.system_include_paths(["c++"], os.path.join(not_dir, "cache.json"))
+            self.assertEqual(compiler, "c++")
+            self.assertGreater(len(paths), 0)
+            self.assertEqual(os.listdir(tmp_dir), ["not_dir"])
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,74 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from pybind11_weaver import entity_tree, gen_unit
+from pybind11_weaver.utils import source_cache
+
+
+class EntityTreeTest(unittest.TestCase):
+
+    def _load(self, header_content: str):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        with open(os.path.join(tmp_dir.name, "a.h"), "w") as f:
+            f.write(header_content)
+        return gen_unit.load_all_gu(f"""
+common_config:
+    include_directories: ["{tmp_dir.name}"]
+io_configs:
+    - inputs: ["a.h"]
+      output: "/path/to/output"
+""")[0]
+
+    def test_no_reparse_without_template(self):
+        gu = self._load("""
+namespace ns {
+struct Foo { int x; };
+void bar(Foo f);
+}
+""")
+        with mock.patch.object(gu.tu, "reparse") as reparse:
+            tree = entity_tree.EntityTree(gu)
+            reparse.assert_not_called()
+        self.assertIn("Foo", tree["ns"])
+        self.assertIn("bar(Foo)", tree["ns"])
+        self.assertGreater(tree.visited_cursors, 0)
+
+    def test_implicit_template_instance(self):
+        gu = self._load("""
+template <class T> struct Box { T v; };
+void use(Box<int> b);
+""")
+        tree = entity_tree.EntityTree(gu)
+        self.assertIn("extern template struct Box<int>;", gu.unsaved_file[1])
+        self.assertEqual(len([name for name in tree.entities if name.startswith("Box")]), 1)
+        self.assertIn("use(Box<int>)", tree)
+
+    def test_source_cache(self):
+        gu = self._load("""
+template <class T> struct Box { T v; };
+void use(Box<int> b, Box<float> c);
+""")
+        source_cache.clear()
+        entity_tree.EntityTree(gu)
+        self.assertEqual(source_cache.get_stats()["file_reads"], 1)
+        self.assertEqual(source_cache.get_stats()["file_reads_saved"], 1)
+
+    def test_function_struct_names(self):
+        gu = self._load("""
+void f(char);
+namespace x { void f(double); void f(float); void f(int); }
+namespace y { void f(int); }
+""")
+        tree = entity_tree.EntityTree(gu)
+        # user code refers to these names, e.g. `DisableBinding<Entity_f2>`, they must not change
+        names = {name: tree["x"][name].get_pb11weaver_struct_name() for name in tree["x"].children}
+        self.assertEqual(tree["f(char)"].get_pb11weaver_struct_name(), "f")
+        self.assertEqual(names, {"f(double)": "f2", "f(float)": "f3", "f(int)": "f4"})
+        self.assertEqual(tree["y"]["f(int)"].get_pb11weaver_struct_name(), "f1")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import os
+import tempfile
+import unittest
+
+from pybind11_weaver import gen_unit
+from pybind11_weaver.utils import common, fn
+
+
+class TypeCacheTest(unittest.TestCase):
+
+    def test_pb11_type_cache(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with open(os.path.join(tmp_dir, "a.h"), "w") as f:
+                f.write("struct Opaque; void foo(Opaque* a, Opaque* b, int c);")
+            gu = gen_unit.load_all_gu(f"""
+common_config:
+    include_directories: ["{tmp_dir}"]
+io_configs:
+    - inputs: ["a.h"]
+      output: "/path/to/output"
+""")[0]
+            foo = [c for c in gu.tu.cursor.get_children() if c.spelling == "foo"][0]
+            foo._tu = gu.tu
+            fn.clear_type_cache()
+            a, b, c = [fn.get_pb11_type(arg.type) for arg in foo.get_arguments()]
+            self.assertIs(a, b)
+            self.assertEqual(a[0], "pybind11_weaver::WrappedPtrT<Opaque *>")
+            self.assertEqual(c[0], "int")
+            self.assertEqual(common.get_type_cache_stats()["get_pb11_type_hits"], 1)
+            self.assertEqual(common.get_type_cache_stats()["get_pb11_type_misses"], 2)
+
+            fn.clear_type_cache()
+            self.assertEqual(len(common.get_type_cache_stats()), 0)
+
+class CallbackWrapperTest(unittest.TestCase):
+
+    def _pointee_types(self, decl: str):
+        """Return the function types that the params of `foo` point to."""
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        with open(os.path.join(tmp_dir.name, "a.h"), "w") as f:
+            f.write(decl)
+        gu = gen_unit.load_all_gu(f"""
+common_config:
+    include_directories: ["{tmp_dir.name}"]
+io_configs:
+    - inputs: ["a.h"]
+      output: "/path/to/output"
+""")[0]
+        self.addCleanup(gu.dispose)
+        foo = [c for c in gu.tu.cursor.get_children() if c.spelling == "foo"][0]
+        foo._tu = gu.tu
+        return [arg.type.get_pointee() for arg in foo.get_arguments()]
+
+    def test_wrap_pb11_fn_in_c_type_io(self):
+        a, b = self._pointee_types("void foo(void* (*a)(int, void*), void (*b)());")
+        code_a = fn.wrap_pb11_fn_in_c_type_io("a", a.get_result(), list(a.argument_types()), ["x", "y"])
+        code_b = fn.wrap_pb11_fn_in_c_type_io("b", b.get_result(), [], [])
+        # the call sites are keyed by the closure type of the wrapper, nothing depends on the build
+        for code in [code_a, code_b]:
+            self.assertNotIn("__COUNTER__", code)
+            self.assertNotIn("__DATE__", code)
+        self.assertIn("::CppFnT> & to_call,int x,void * y)", code_a)
+        self.assertIn("::CppFnT> & to_call)", code_b)
+
+    def test_converted_return(self):
+        a, = self._pointee_types("struct Opaque; void foo(Opaque* (*a)(int));")
+        code = fn.wrap_pb11_fn_in_c_type_io("a", a.get_result(), list(a.argument_types()), ["x"])
+        # the python callable returns a wrapped pointer, which is converted back to the c pointer
+        self.assertIn("auto && __pb11_ret__= to_call(x); return (__pb11_ret__)->Cptr()", code)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,392 @@
+import glob
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from pybind11_weaver import config
+from pybind11_weaver import entity_tree
+from pybind11_weaver import gen_code
+from pybind11_weaver import gen_unit
+
+_REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+_SAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sample", "all_feature")
+
+
+def _without_date(content: str) -> str:
+    return "\n".join(line for line in content.splitlines() if not line.startswith("// GENERATED AT"))
+
+
+def _read_without_date(path: str) -> str:
+    with open(path, "r") as f:
+        return _without_date(f.read())
+
+
+class _FakeEntity:
+    def __init__(self, name, deps=(), children=()):
+        self.name = name
+        self.deps = list(deps)
+        self.children = {c.name: c for c in children}
+
+    def reference_name(self):
+        return self.name
+
+    def dependency(self):
+        return self.deps
+
+
+class ScheduleTest(unittest.TestCase):
+
+    @staticmethod
+    def _names(ordered):
+        return [(e.name, None if p is None else p.name) for e, p in ordered]
+
+    def test_order(self):
+        # `a::D` depends on a later sibling `a::C`, and `a::E` depends on `b::B` in another scope
+        a = _FakeEntity("a", children=[_FakeEntity("a::D", ["a::C"]), _FakeEntity("a::C"),
+                                       _FakeEntity("a::E", ["b::B"])])
+        b = _FakeEntity("b", children=[_FakeEntity("b::B")])
+        ordered = gen_code.schedule_entities({"a": a, "b": b}, {})
+        self.assertEqual(self._names(ordered),
+                         [("a", None), ("a::C", "a"), ("a::D", "a"), ("b", None), ("b::B", "b"), ("a::E", "a")])
+
+    def test_missing_dependency(self):
+        entities = {"A": _FakeEntity("A", ["NotExist"]), "B": _FakeEntity("B", ["Generated"])}
+        with self.assertLogs(gen_code.__name__, level="WARNING"):
+            ordered = gen_code.schedule_entities(entities, {"Generated": None})
+        self.assertEqual(self._names(ordered), [("A", None), ("B", None)])
+
+    def test_cycle(self):
+        entities = {"A": _FakeEntity("A", ["B"]), "B": _FakeEntity("B", ["A"]), "C": _FakeEntity("C")}
+        with self.assertRaisesRegex(RuntimeError, "Circular dependency"):
+            gen_code.schedule_entities(entities, {})
+
+
+class LazyNamespacesTest(unittest.TestCase):
+
+    def _group(self, header_content: str):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        with open(os.path.join(tmp_dir.name, "a.h"), "w") as f:
+            f.write(header_content)
+        gu = gen_unit.load_all_gu(f"""
+common_config:
+    cxx_flags: [ "-std=c++17", ]
+    include_directories: ["{tmp_dir.name}"]
+io_configs:
+    - inputs: ["a.h"]
+      output: "/path/to/output"
+""")[0]
+        lazy = gen_code.LazyNamespaces()
+        ordered = gen_code.group_lazy_namespaces(
+            gen_code.schedule_entities(entity_tree.EntityTree(gu).entities, {}), 0, lazy)
+        names = [entity.reference_name() for entity, _ in ordered]
+        groups = [set(names[g.begin:g.end]) for g in lazy.groups]
+        return names, groups, lazy
+
+    def test_groups(self):
+        names, groups, lazy = self._group("""
+namespace b { struct Base {}; }
+namespace a { struct Derived : public b::Base {}; }
+namespace c { inline b::Base MakeBase() { return {}; } }
+namespace p { struct PA; }
+namespace q { struct QA { int f(const p::PA &); }; }
+namespace p { struct PA { q::QA make(); }; }
+namespace outer { namespace inner { struct I {}; } }
+""")
+        self.assertEqual(groups[0], {"a", "b", "c", "p", "q", "outer", "outer::inner"})
+        self.assertIn({"b::Base"}, groups)
+        self.assertIn({"p::PA", "q::QA"}, groups)  # depend on each other
+        self.assertIn({"outer::inner::I"}, groups)
+        group_of = {name: i for i, group in enumerate(groups) for name in group}
+        self.assertIn(group_of["b::Base"], lazy.groups[group_of["a::Derived"]].deps)
+        self.assertIn(group_of["b::Base"], lazy.groups[group_of["c::MakeBase"]].deps)
+        # namespaces without members have no group
+        modules = {names[entity]: group for entity, group in lazy.modules}
+        self.assertEqual(modules, {"a": group_of["a::Derived"], "b": group_of["b::Base"], "c": group_of["c::MakeBase"],
+                                   "p": group_of["p::PA"], "q": group_of["p::PA"], "outer::inner": group_of["outer::inner::I"]})
+        # dependencies are created before
+        for group in lazy.groups:
+            for dep in group.deps:
+                self.assertLessEqual(lazy.groups[dep].end, group.begin)
+
+    def test_root_uses_namespace(self):
+        names, groups, lazy = self._group("""
+namespace a { struct A {}; }
+namespace b { struct B {}; }
+inline a::A MakeA() { return {}; }
+""")
+        # a is used by the root module, so it is loaded eagerly
+        self.assertEqual(groups, [{"a", "b", "a::A", "MakeA"}, {"b::B"}])
+        self.assertEqual([(names[entity], group) for entity, group in lazy.modules], [("b", 1)])
+
+
+class GenCodeTest(unittest.TestCase):
+
+    def _config(self, out_dir: str, with_bad_unit: bool) -> str:
+        cfg = f"""
+common_config:
+  cxx_flags: [ "-std=c++17", ]
+  include_directories: [ "{_SAMPLE_DIR}" ]
+io_configs:
+"""
+        if with_bad_unit:
+            # the units after the bad one should still be generated
+            cfg += f"""
+  - inputs: [ "path/to/not_exist.h" ]
+    output: "{out_dir}/not_exist.cc.inc"
+"""
+        cfg += f"""
+  - inputs: [ "c_lib/c_lib.h","template_pb11_weaver_helper.h" ]
+    output: "{out_dir}/all_feature.cc.inc"
+  - inputs: [ "c_lib/not_exported.h" ]
+    output: "{out_dir}/not_exported.cc.inc"
+"""
+        return cfg
+
+    def test_parallel_same_as_serial(self):
+        with tempfile.TemporaryDirectory() as serial_dir, tempfile.TemporaryDirectory() as parallel_dir:
+            self.assertEqual(gen_code.gen_code(self._config(serial_dir, False), jobs=1), 0)
+            self.assertEqual(gen_code.gen_code(self._config(parallel_dir, False), jobs=2), 0)
+            for name in ["all_feature.cc.inc", "not_exported.cc.inc"]:
+                self.assertEqual(_read_without_date(os.path.join(serial_dir, name)),
+                                 _read_without_date(os.path.join(parallel_dir, name)))
+
+    def test_failure(self):
+        for jobs in [1, 3]:
+            with tempfile.TemporaryDirectory() as out_dir:
+                with self.assertLogs(gen_code.__name__, level="ERROR"):
+                    failed = gen_code.gen_code(self._config(out_dir, True), jobs=jobs)
+                self.assertEqual(failed, 1)
+                self.assertTrue(os.path.exists(os.path.join(out_dir, "all_feature.cc.inc")))
+                self.assertTrue(os.path.exists(os.path.join(out_dir, "not_exported.cc.inc")))
+                self.assertFalse(os.path.exists(os.path.join(out_dir, "not_exist.cc.inc")))
+
+    def test_no_preamble_left(self):
+        def preambles():
+            return set(glob.glob(os.path.join(tempfile.gettempdir(), "preamble-*.pch")))
+
+        before = preambles()
+        with tempfile.TemporaryDirectory() as out_dir:
+            for jobs in [1, 2]:
+                self.assertEqual(gen_code.gen_code(self._config(out_dir, False), jobs=jobs), 0)
+                self.assertEqual(preambles() - before, set())
+
+    def test_depfile_and_check_uptodate(self):
+        with tempfile.TemporaryDirectory() as work_dir:
+            header = os.path.join(work_dir, "foo.h")
+            output = os.path.join(work_dir, "foo.cc.inc")
+            dep = os.path.join(work_dir, "foo.d")
+            cfg = os.path.join(work_dir, "cfg.yaml")
+            with open(header, "w") as f:
+                f.write("int foo();")
+            with open(cfg, "w") as f:
+                f.write(f"""
+io_configs:
+  - inputs: [ "{header}" ]
+    output: "{output}"
+    depfile: "{dep}"
+""")
+            self.assertEqual(gen_code.gen_code(cfg), 0)
+            with open(dep, "r") as f:
+                content = f.read()
+            self.assertTrue(content.startswith(f"{output}:"))
+            self.assertIn(header, content)
+            self.assertIn(cfg, content)
+
+            os.remove(output)
+            self.assertEqual(gen_code.gen_code(cfg, check_uptodate=True), 0)
+            self.assertTrue(os.path.exists(output))  # regenerated for output missing
+
+            stamp = os.stat(dep).st_mtime_ns
+            self.assertEqual(gen_code.gen_code(cfg, check_uptodate=True), 0)
+            self.assertEqual(os.stat(dep).st_mtime_ns, stamp)  # skipped
+
+            os.utime(header, ns=(stamp + 10 ** 9, stamp + 10 ** 9))
+            self.assertEqual(gen_code.gen_code(cfg, check_uptodate=True), 0)
+            self.assertNotEqual(os.stat(dep).st_mtime_ns, stamp)  # regenerated for header changed
+
+    def test_check_uptodate_missing_files(self):
+        with tempfile.TemporaryDirectory() as work_dir:
+            header = os.path.join(work_dir, "foo.h")
+            output = os.path.join(work_dir, "foo.cc.inc")
+            dep = os.path.join(work_dir, "foo.d")
+            with open(header, "w") as f:
+                f.write("int foo(); int bar();")
+            cfg = f"""
+io_configs:
+  - inputs: [ "{header}" ]
+    output: "{output}"
+    depfile: "{dep}"
+    output_shards: 2
+    prelude_header: "{work_dir}/prelude.h"
+"""
+            io_cfg = config.MainConfig.load(cfg).io_configs[0]
+            self.assertEqual(list(gen_code.render_unit(io_cfg)), gen_code.unit_outputs(io_cfg) + [dep])
+            self.assertEqual(gen_code.gen_code(cfg), 0)
+            for path in gen_code.unit_outputs(io_cfg):
+                self.assertTrue(gen_code.is_unit_up_to_date(io_cfg))
+                os.remove(path)
+                self.assertFalse(gen_code.is_unit_up_to_date(io_cfg))
+                self.assertEqual(gen_code.gen_code(cfg, check_uptodate=True), 0)
+                self.assertTrue(os.path.exists(path))
+
+    def test_output_shards(self):
+        with tempfile.TemporaryDirectory() as single_dir, tempfile.TemporaryDirectory() as sharded_dir:
+            self.assertEqual(gen_code.gen_code(self._config(single_dir, False)), 0)
+            cfg = self._config(sharded_dir, False).replace('all_feature.cc.inc"', 'all_feature.cc.inc"\n    output_shards: 3')
+            self.assertEqual(gen_code.gen_code(cfg), 0)
+
+            struct_mark = "#ifndef PB11_WEAVER_DISABLE_Entity_"
+            output = os.path.join(sharded_dir, "all_feature.cc.inc")
+            driver = _read_without_date(output)
+            self.assertNotIn(struct_mark, driver)
+            struct_num = 0
+            for shard_id in range(3):
+                self.assertIn(f"DeclFn_Shard{shard_id}(m, registry, entities);", driver)
+                shard = _read_without_date(gen_code.shard_output_path(output, shard_id))
+                self.assertIn(f"void DeclFn_Shard{shard_id}(", shard)
+                self.assertIn(struct_mark, shard)
+                struct_num += shard.count(struct_mark)
+            single = _read_without_date(os.path.join(single_dir, "all_feature.cc.inc"))
+            self.assertEqual(struct_num, single.count(struct_mark))
+            # both keep created entities in a table, and keys could be hashed at compile time
+            self.assertIn("pybind11_weaver::EntityTable entities(", single)
+            self.assertIn("static constexpr const char *Key()", single)
+
+    def test_streamed_same_as_rendered(self):
+        with tempfile.TemporaryDirectory() as out_dir:
+            cfg = self._config(out_dir, False).replace('all_feature.cc.inc"', 'all_feature.cc.inc"\n    output_shards: 3')
+            self.assertEqual(gen_code.gen_code(cfg), 0)
+            for io_cfg in config.MainConfig.load(cfg).io_configs:
+                files = gen_code.render_unit(io_cfg)
+                for path, content in files.items():
+                    with open(path, "r") as f:
+                        self.assertEqual(_without_date(f.read()), _without_date(content))
+            self.assertEqual(len(os.listdir(out_dir)), 5)
+
+    def test_struct_decl_spill(self):
+        decls = ["struct A {};", "// \u00e9t\u00e9\nstruct B {};", "", "struct C {};"]
+        spill = gen_code._StructDeclSpill()
+        for decl in decls:
+            spill.append(decl)
+        self.assertEqual(spill.sizes, [len(decl) for decl in decls])
+        self.assertEqual("".join(spill.iter_joined(1, 4)), "\n".join(decls[1:4]))
+        self.assertEqual("".join(spill.iter_joined(0, 2)), "\n".join(decls[0:2]))
+        self.assertEqual(list(spill.iter_joined(2, 2)), [])
+        spill.close()
+
+    def test_compact_codegen(self):
+        with tempfile.TemporaryDirectory() as out_dir:
+            cfg = self._config(out_dir, False).replace('all_feature.cc.inc"',
+                                                       'all_feature.cc.inc"\n    compact_codegen: true')
+            self.assertEqual(gen_code.gen_code(cfg), 0)
+            output = _read_without_date(os.path.join(out_dir, "all_feature.cc.inc"))
+            self.assertNotIn("virtual const char *AddMethod_", output)
+            self.assertNotIn("virtual const char *AddCtor", output)
+            self.assertIn("pybind11_weaver::AddMembers(", output)
+            # members are keyed by the same names as the virtual functions of default codegen
+            for key in ['"Method"', '"Method1"', '"StaticMethod"', '"Ctor0"']:
+                self.assertIn(key, output)
+
+    def test_lazy_namespaces(self):
+        with tempfile.TemporaryDirectory() as eager_dir, tempfile.TemporaryDirectory() as lazy_dir:
+            self.assertEqual(gen_code.gen_code(self._config(eager_dir, False)), 0)
+            cfg = self._config(lazy_dir, False).replace('all_feature.cc.inc"',
+                                                        'all_feature.cc.inc"\n    lazy_namespaces: true')
+            self.assertEqual(gen_code.gen_code(cfg), 0)
+            output = _read_without_date(os.path.join(lazy_dir, "all_feature.cc.inc"))
+            self.assertIn("pybind11_weaver::LazyBinding::Bind(", output)
+            self.assertIn("switch (group)", output)
+            struct_mark = "#ifndef PB11_WEAVER_DISABLE_Entity_"
+            eager = _read_without_date(os.path.join(eager_dir, "all_feature.cc.inc"))
+            self.assertEqual(output.count(struct_mark), eager.count(struct_mark))
+
+    def test_prelude_header(self):
+        with tempfile.TemporaryDirectory() as out_dir:
+            prelude = os.path.join(out_dir, "prelude.h")
+            cfg = self._config(out_dir, False).replace('all_feature.cc.inc"',
+                                                       f'all_feature.cc.inc"\n    prelude_header: "{prelude}"')
+            self.assertEqual(gen_code.gen_code(cfg), 0)
+            with open(prelude, "r") as f:
+                prelude_content = f.read()
+            self.assertIn('#include "c_lib/c_lib.h"', prelude_content)
+            self.assertIn("#include <pybind11_weaver/pybind11_weaver.h>", prelude_content)
+            output = _read_without_date(os.path.join(out_dir, "all_feature.cc.inc"))
+            self.assertIn('#include "prelude.h"', output)
+            self.assertNotIn("namespace pybind11_weaver {", output)
+
+            stamp = os.stat(prelude).st_mtime_ns
+            self.assertEqual(gen_code.gen_code(cfg), 0)
+            self.assertEqual(os.stat(prelude).st_mtime_ns, stamp)
+
+    def test_profile(self):
+        with tempfile.TemporaryDirectory() as out_dir:
+            for jobs in [1, 2]:
+                profile_file = os.path.join(out_dir, f"profile{jobs}.json")
+                self.assertEqual(gen_code.gen_code(self._config(out_dir, False), jobs=jobs, profile_file=profile_file,
+                                                   profile_top=3), 0)
+                with open(profile_file, "r") as f:
+                    report = json.load(f)
+                self.assertIn("load_config/probe_compiler", report["phases"])
+                self.assertEqual([unit["output"] for unit in report["units"]],
+                                 [os.path.join(out_dir, "all_feature.cc.inc"),
+                                  os.path.join(out_dir, "not_exported.cc.inc")])
+                unit = report["units"][0]
+                self.assertEqual(list(unit["phases"].keys())[:3],
+                                 ["load_tu", "map_from_gu", "map_from_gu/traverse"])
+                for phase in ["map_from_gu/reload_tu", "codegen", "codegen/schedule", "write"]:
+                    self.assertIn(phase, unit["phases"])
+                self.assertGreater(unit["peak_rss_kb"], 0)
+                self.assertGreater(unit["counters"]["visited_cursors"], 0)
+                self.assertGreater(unit["counters"]["entities.ClassEntity"], 0)
+                self.assertEqual(len(unit["slowest_entities"]), 3)
+                seconds = [e["seconds"] for e in unit["slowest_entities"]]
+                self.assertEqual(seconds, sorted(seconds, reverse=True))
+                for entity in unit["slowest_entities"]:
+                    self.assertRegex(entity["location"], r".+:\d+$")
+
+    def test_reproducible(self):
+        with tempfile.TemporaryDirectory() as out_dir:
+            cfg = os.path.join(out_dir, "cfg.yaml")
+            with open(cfg, "w") as f:
+                f.write(self._config(out_dir, False).replace('all_feature.cc.inc"',
+                                                             'all_feature.cc.inc"\n    reproducible: true'))
+            output = os.path.join(out_dir, "all_feature.cc.inc")
+            contents = []
+            stamps = []
+            for hash_seed in ["1", "2"]:
+                # string hashes differ in the processes, so any iteration over sets would change the output
+                env = dict(os.environ, PYTHONHASHSEED=hash_seed, PYTHONPATH=_REPO_ROOT)
+                subprocess.run([sys.executable, "-m", "pybind11_weaver.main", "--config", cfg], check=True, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                with open(output, "rb") as f:
+                    contents.append(f.read())
+                stamps.append(os.stat(output).st_mtime_ns)
+            self.assertEqual(contents[0], contents[1])
+            self.assertEqual(stamps[0], stamps[1])  # not replaced
+            self.assertNotIn(b"GENERATED AT", contents[0])
+            self.assertEqual([name for name in os.listdir(out_dir) if name.startswith(".tmp_")], [])
+
+    def test_many_virtual_classes(self):
+        # every class must get exactly one trampoline, no matter how many classes are scheduled
+        with tempfile.TemporaryDirectory() as work_dir:
+            header = os.path.join(work_dir, "many.h")
+            output = os.path.join(work_dir, "many.cc.inc")
+            with open(header, "w") as f:
+                for i in range(200):
+                    f.write(f"struct C{i} {{ virtual ~C{i}() = default; virtual int foo(int); }};\n")
+            self.assertEqual(gen_code.gen_code(f"""
+io_configs:
+  - inputs: [ "{header}" ]
+    output: "{output}"
+"""), 0)
+            content = _read_without_date(output)
+            for i in range(200):
+                self.assertEqual(content.count(f"class PyTrampC{i} "), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,4 +1,7 @@
+import os
+import tempfile
 import unittest
+from unittest import mock
 
 from pybind11_weaver import gen_unit
 
@@ -18,6 +21,89 @@ io_configs:
         for gu in gen_units:
             self.assertIsNotNone(gu.tu)
 
+    def test_reload_tu(self):
+        gu = gen_unit.load_all_gu("""
+io_configs:
+    - inputs: [<cstdio>]
+      output: "/path/to/output"
+""")[0]
+        self.assertTrue(os.path.isabs(gu.tu.spelling))
+        self.assertTrue(os.path.exists(gu.tu.spelling))
+        with mock.patch.object(gu.tu, "reparse") as reparse:
+            gu.reload_tu("")
+            reparse.assert_not_called()
+        gu.reload_tu("int foo();")
+        self.assertIn("foo", [c.spelling for c in gu.tu.cursor.get_children()])
+
+    def test_input_relative_to_cwd(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with open(os.path.join(tmp_dir, "a.h"), "w") as f:
+                f.write("int foo();")
+            self.addCleanup(os.chdir, os.getcwd())
+            os.chdir(tmp_dir)
+            gu = gen_unit.load_all_gu("""
+io_configs:
+    - inputs: ['"a.h"']
+      output: "/path/to/output"
+""")[0]
+            self.assertIn("foo", [c.spelling for c in gu.tu.cursor.get_children()])
+            gu.dispose()
+
+    def test_suffix_matcher(self):
+        matcher = gen_unit._SuffixMatcher(["a.h", "dir/b.h", "tmp.cpp"])
+        self.assertTrue(matcher.match("/path/to/a.h"))
+        self.assertTrue(matcher.match("/path/dir/b.h"))
+        self.assertTrue(matcher.match("tmp.cpp"))
+        self.assertFalse(matcher.match("/path/to/b.h"))
+        self.assertFalse(matcher.match(".h"))
+
+    def test_input_file_cache(self):
+        gu = gen_unit.load_all_gu("""
+io_configs:
+    - inputs: [<cstdio>]
+      output: "/path/to/output"
+""")[0]
+        cursors = [c for c in gu.tu.cursor.get_children() if c.location.file is not None]
+        in_inputs = [gu.is_cursor_in_inputs(c) for c in cursors]
+        self.assertTrue(any(in_inputs))
+        self.assertEqual(gu.file_cache_hits + gu.file_cache_misses, len(cursors))
+        self.assertGreater(gu.file_cache_hit_rate(), 0.5)
+
+    def test_skip_function_bodies(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with open(os.path.join(tmp_dir, "a.h"), "w") as f:
+                f.write("inline int foo() { return undeclared_in_body(); }")
+            cfg = """
+common_config:
+    include_directories: ["{tmp_dir}"]
+io_configs:
+    - inputs: ["a.h"]
+      output: "/path/to/output"
+      skip_function_bodies: {skip}
+"""
+            gu = gen_unit.load_all_gu(cfg.format(tmp_dir=tmp_dir, skip="true"))[0]
+            self.assertIn("foo", [c.spelling for c in gu.tu.cursor.get_children()])
+            with self.assertRaises(RuntimeError):
+                gen_unit.load_all_gu(cfg.format(tmp_dir=tmp_dir, skip="false"))
+
+    def test_tu_cache(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cfg = f"""
+common_config:
+    cache_dir: "{cache_dir}"
+io_configs:
+    - inputs: [<cstdio>]
+      output: "/path/to/output"
+"""
+            gu = gen_unit.load_all_gu(cfg)[0]
+            self.assertFalse(gu._from_cache)
+            gu.reload_tu("int foo();")
+
+            cached_gu = gen_unit.load_all_gu(cfg)[0]
+            self.assertTrue(cached_gu._from_cache)
+            self.assertEqual(cached_gu.unsaved_file, gu.unsaved_file)
+            self.assertIn("foo", [c.spelling for c in cached_gu.tu.cursor.get_children()])
+
 
 if __name__ == "__main__":
     unittest.main()
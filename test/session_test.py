@@ -0,0 +1,87 @@
+import os
+import tempfile
+import threading
+import unittest
+
+from pybind11_weaver import gen_code
+from pybind11_weaver.session import WeaverSession
+from pybind11_weaver.utils import common
+
+_SAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sample", "all_feature")
+
+
+def _without_date(content: str) -> str:
+    return "\n".join(line for line in content.splitlines() if not line.startswith("// GENERATED AT"))
+
+
+class SessionTest(unittest.TestCase):
+
+    def _config(self, out_dir: str) -> str:
+        return f"""
+common_config:
+  cxx_flags: [ "-std=c++17", ]
+  include_directories: [ "{_SAMPLE_DIR}" ]
+io_configs:
+  - inputs: [ "c_lib/c_lib.h","template_pb11_weaver_helper.h" ]
+    output: "{out_dir}/all_feature.cc.inc"
+  - inputs: [ "c_lib/not_exported.h" ]
+    output: "{out_dir}/not_exported.cc.inc"
+    depfile: "{out_dir}/not_exported.d"
+"""
+
+    def test_in_memory_same_as_file(self):
+        with tempfile.TemporaryDirectory() as out_dir:
+            cfg = self._config(out_dir)
+            self.assertEqual(gen_code.gen_code(cfg), 0)
+            written = dict()
+            for name in os.listdir(out_dir):
+                with open(os.path.join(out_dir, name), "r") as f:
+                    written[os.path.join(out_dir, name)] = _without_date(f.read())
+                os.remove(os.path.join(out_dir, name))
+
+            for jobs in [1, 2]:
+                with WeaverSession(jobs=jobs) as session:
+                    for _ in range(2):  # the session is reusable, and no state leaks from the previous run
+                        files = session.generate(cfg)
+                        self.assertEqual({k: _without_date(v) for k, v in files.items()}, written)
+            self.assertEqual(os.listdir(out_dir), [])
+            self.assertEqual(len(common.get_used_types()), 0)  # state of the runs is not visible outside
+
+            with WeaverSession() as session:
+                session.generate(cfg, write=True)
+            self.assertEqual(set(os.path.join(out_dir, name) for name in os.listdir(out_dir)), set(written.keys()))
+
+    def test_concurrent_sessions(self):
+        with tempfile.TemporaryDirectory() as out_dir:
+            expected = WeaverSession().generate(self._config(out_dir))
+            results = [None] * 3
+
+            def run(i):
+                with WeaverSession(jobs=1 + i % 2) as session:
+                    results[i] = session.generate(self._config(out_dir))
+
+            threads = [threading.Thread(target=run, args=(i,)) for i in range(len(results))]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            for result in results:
+                self.assertEqual(result.keys(), expected.keys())
+                for path in expected:
+                    self.assertEqual(_without_date(result[path]), _without_date(expected[path]))
+
+    def test_failure(self):
+        with tempfile.TemporaryDirectory() as out_dir:
+            cfg = self._config(out_dir) + f"""
+  - inputs: [ "path/to/not_exist.h" ]
+    output: "{out_dir}/not_exist.cc.inc"
+"""
+            with WeaverSession(jobs=3) as session:
+                with self.assertLogs(level="ERROR"):
+                    with self.assertRaisesRegex(RuntimeError, "not_exist.cc.inc"):
+                        session.generate(cfg, write=True)
+            self.assertTrue(os.path.exists(os.path.join(out_dir, "all_feature.cc.inc")))
+
+
+if __name__ == "__main__":
+    unittest.main()
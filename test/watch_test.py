@@ -0,0 +1,76 @@
+import os
+import tempfile
+import unittest
+
+from pybind11_weaver import watch
+
+
+def _bump_mtime(path: str):
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+
+
+class WatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.TemporaryDirectory()
+        self.header = os.path.join(self.work_dir.name, "foo.h")
+        self.output = os.path.join(self.work_dir.name, "foo.cc.inc")
+        self.cfg = os.path.join(self.work_dir.name, "cfg.yaml")
+        with open(self.header, "w") as f:
+            f.write("int foo();")
+        with open(self.cfg, "w") as f:
+            f.write(f"""
+io_configs:
+  - inputs: [ "{self.header}" ]
+    output: "{self.output}"
+""")
+        self.watcher = watch.Watcher(self.cfg)
+        self.watcher.generate_all()
+
+    def tearDown(self):
+        self.watcher.close()
+        self.work_dir.cleanup()
+
+    def _read_output(self) -> str:
+        with open(self.output, "r") as f:
+            return f.read()
+
+    def test_regenerate_on_change(self):
+        self.assertIn('"foo"', self._read_output())
+        self.assertEqual(self.watcher.poll(), 0)
+        tu = self.watcher.units[0].gu.tu
+
+        with open(self.header, "a") as f:
+            f.write("\nint bar();")
+        _bump_mtime(self.header)
+        self.assertEqual(self.watcher.poll(), 1)
+        self.assertIs(self.watcher.units[0].gu.tu, tu)  # reparsed in place
+        self.assertIn('"bar"', self._read_output())
+        self.assertEqual(self.watcher.poll(), 0)
+
+    def test_unchanged_output_not_written(self):
+        stamp = os.stat(self.output).st_mtime_ns
+        _bump_mtime(self.header)
+        self.assertEqual(self.watcher.poll(), 1)
+        self.assertEqual(os.stat(self.output).st_mtime_ns, stamp)
+
+    def test_recover_from_error(self):
+        content = self._read_output()
+        with open(self.header, "a") as f:
+            f.write("\nint bar(")
+        _bump_mtime(self.header)
+        with self.assertLogs(watch.__name__, level="ERROR"):
+            self.assertEqual(self.watcher.poll(), 1)
+        self.assertEqual(self._read_output(), content)
+        self.assertEqual(self.watcher.poll(), 0)  # wait for next change
+
+        with open(self.header, "w") as f:
+            f.write("int foo();\nint bar();")
+        _bump_mtime(self.header)
+        self.assertEqual(self.watcher.poll(), 1)
+        self.assertIn('"bar"', self._read_output())
+
+
+if __name__ == "__main__":
+    unittest.main()